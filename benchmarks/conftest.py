@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+
+
+def make_synthetic_tissue(height, width, seed=0):
+    """Make an RGB image with purple tissue-like blobs on a white background.
+
+    Args:
+        height (int): image height in pixels
+        width (int): image width in pixels
+        seed (int): random seed
+
+    Returns:
+        np.ndarray: uint8 array with shape (height, width, 3)
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    tissue = np.zeros((height, width), dtype=bool)
+    for _ in range(8):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        ry, rx = rng.uniform(0.05, 0.2) * height, rng.uniform(0.05, 0.2) * width
+        tissue |= ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 < 1
+
+    img = np.full((height, width, 3), 240, dtype=np.uint8)
+    stain = rng.normal((150, 60, 170), 20, size=(height, width, 3))
+    img[tissue] = np.clip(stain[tissue], 0, 255).astype(np.uint8)
+    return img
+
+
+def write_aperio_pyramid(path, img, magnification=40, levels=3, level_downsample=4, tile_size=256):
+    """Write an image as a tiled pyramidal TIFF that OpenSlide opens as an Aperio slide.
+
+    Args:
+        path (str): output file path, usually ending in .svs
+        img (np.ndarray): full resolution RGB image
+        magnification (int): scanned magnification stored as aperio.AppMag
+        levels (int): number of pyramid levels
+        level_downsample (int): downsample between consecutive levels
+        tile_size (int): TIFF tile width and height
+    """
+    height, width = img.shape[:2]
+    description = f"Aperio Image Library v10.0.0\n{width}x{height} [0,0 {width}x{height}] ({tile_size}x{tile_size}) RGB|AppMag = {magnification}|MPP = 0.25"
+    with tifffile.TiffWriter(path) as tif:
+        for level in range(levels):
+            tif.write(img, tile=(tile_size, tile_size), photometric="rgb", compression="zlib", metadata=None,
+                      description=description if level == 0 else None, subfiletype=0 if level == 0 else 1)
+            img = np.array(Image.fromarray(img).reduce(level_downsample))
+
+
+@pytest.fixture(scope="session")
+def synthetic_svs_slide(tmp_path_factory):
+    """Path to a 4096x4096 synthetic 40x Aperio slide with 1x, 4x and 16x downsampled levels"""
+    path = tmp_path_factory.mktemp("slides") / "synthetic.svs"
+    write_aperio_pyramid(str(path), make_synthetic_tissue(4096, 4096))
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def synthetic_image_slide(tmp_path_factory):
+    """Path to a 4096x4096 synthetic slide that openslide.open_slide opens as an ImageSlide"""
+    path = tmp_path_factory.mktemp("slides") / "synthetic.png"
+    Image.fromarray(make_synthetic_tissue(4096, 4096)).save(path)
+    return str(path)
+
+
+def get_tiles_per_second(benchmark, tiles):
+    """Mean throughput of a benchmark, or None with --benchmark-disable"""
+    return tiles / benchmark.stats.stats.mean if benchmark.stats is not None else None
+
+
+def make_label_bitmap(height, width, n_labels=3, n_regions=24, seed=0):
+    """Make a uint8 annotation bitmap of elliptical regions, some of them with holes.
+
+    Args:
+        height (int): bitmap height in pixels
+        width (int): bitmap width in pixels
+        n_labels (int): number of labels, numbered from 1
+        n_regions (int): number of annotated regions
+        seed (int): random seed
+
+    Returns:
+        np.ndarray: uint8 array with shape (height, width), 0 where not annotated
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.ogrid[0:height, 0:width]
+    bitmap = np.zeros((height, width), dtype=np.uint8)
+    for region in range(n_regions):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        ry, rx = rng.uniform(0.02, 0.08) * height, rng.uniform(0.02, 0.08) * width
+        distance = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2
+        bitmap[distance < 1] = region % n_labels + 1
+        if region % 3 == 0:
+            bitmap[distance < 0.2] = 0
+    return bitmap
+
+
+@pytest.fixture(scope="session")
+def synthetic_svs_slide_factory(tmp_path_factory):
+    """Make, or reuse, a synthetic 40x Aperio slide of a given width and height, see write_aperio_pyramid"""
+    slides = {}
+
+    def make_slide(size):
+        if size not in slides:
+            path = tmp_path_factory.mktemp("slides") / f"synthetic_{size}.svs"
+            write_aperio_pyramid(str(path), make_synthetic_tissue(size, size))
+            slides[size] = str(path)
+        return slides[size]
+
+    return make_slide
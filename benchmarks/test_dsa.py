@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+from PIL import Image
+
+from benchmarks.conftest import make_label_bitmap
+from luna_pathology.cli.dsa.dsa_viz import heatmap, bitmask_polygon
+
+
+def write_config(path, config):
+    with open(path, "w") as fp:
+        yaml.safe_dump(config, fp)
+    return str(path)
+
+
+@pytest.mark.parametrize("tiles_per_side", [64, 256, 400])
+def test_heatmap(benchmark, tmp_path, tiles_per_side):
+    rng = np.random.default_rng(0)
+    coordinates = [(x, y) for x in range(tiles_per_side) for y in range(tiles_per_side)]
+    pd.DataFrame({
+        "address": [f"x{x}_y{y}_z10" for x, y in coordinates],
+        "coordinates": [str(coordinate) for coordinate in coordinates],
+        "otsu_score": rng.uniform(size=len(coordinates)),
+    }).to_csv(tmp_path / "tile_scores.csv", index=False)
+    data_config = write_config(tmp_path / "heatmap.yaml", {
+        "input": str(tmp_path / "tile_scores.csv"),
+        "image_filename": "123.svs",
+        "column": "otsu_score",
+        "output_folder": str(tmp_path),
+        "annotation_name": "benchmark",
+        "tile_size": 128,
+        "scale_factor": 4,
+    })
+
+    annotation_path = benchmark.pedantic(heatmap, args=(data_config,), rounds=3)
+
+    benchmark.extra_info["tiles"] = len(coordinates)
+    assert annotation_path.endswith("otsu_score_benchmark_123.json")
+
+
+@pytest.mark.parametrize("size", [1024, 4096])
+def test_bitmask_polygon(benchmark, tmp_path, size):
+    bitmask = np.where(make_label_bitmap(size, size) == 1, 255, 0).astype(np.uint8)
+    Image.fromarray(bitmask).save(tmp_path / "tumor.png")
+    data_config = write_config(tmp_path / "bitmask_polygon.yaml", {
+        "input": {"Tumor": str(tmp_path / "tumor.png")},
+        "image_filename": "123.svs",
+        "output_folder": str(tmp_path),
+        "annotation_name": "benchmark",
+    })
+
+    annotation_path = benchmark.pedantic(bitmask_polygon, args=(data_config,), rounds=3)
+
+    benchmark.extra_info["bitmap_size"] = size
+    assert annotation_path.endswith("benchmark_123.json")
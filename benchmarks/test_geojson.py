@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from benchmarks.conftest import make_label_bitmap
+from luna_pathology.common.build_geojson import build_default_geojson_from_annotation, DEFAULT_LABELSET_NAME
+from luna_pathology.cli.dsa.utils import vectorize_np_array_bitmask_by_pixel_value
+
+BITMAP_SIZES = [1024, 4096]
+LABELSETS = {DEFAULT_LABELSET_NAME: {1: "tumor", 2: "stroma", 3: "necrosis"}}
+
+
+@pytest.mark.parametrize("size", BITMAP_SIZES)
+def test_build_default_geojson(benchmark, tmp_path, size):
+    npy_path = str(tmp_path / "annotation.npy")
+    np.save(npy_path, make_label_bitmap(size, size))
+
+    geojson = benchmark.pedantic(build_default_geojson_from_annotation, args=(npy_path, LABELSETS, 0.5), rounds=3)
+
+    benchmark.extra_info["bitmap_size"] = size
+    benchmark.extra_info["features"] = len(geojson["features"])
+    assert {1, 2, 3} == {feature["properties"]["label_num"] for feature in geojson["features"]}
+
+
+@pytest.mark.parametrize("size", BITMAP_SIZES)
+def test_vectorize_bitmask(benchmark, size):
+    bitmask = np.where(make_label_bitmap(size, size) > 0, 255, 0).astype(np.uint8)
+
+    contours = benchmark.pedantic(vectorize_np_array_bitmask_by_pixel_value, args=(bitmask,), rounds=3)
+
+    benchmark.extra_info["bitmap_size"] = size
+    benchmark.extra_info["contours"] = len(contours)
+    assert contours
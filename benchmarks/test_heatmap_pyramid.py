@@ -0,0 +1,32 @@
+import numpy as np
+import openslide
+import pytest
+
+from luna_pathology.common.heatmap_pyramid import HeatmapDeepZoomGenerator
+
+FULL_RESOLUTION_TILE_SIZE = 256
+
+
+@pytest.fixture(scope="module")
+def heatmap_generator(synthetic_svs_slide_factory):
+    slide = openslide.OpenSlide(synthetic_svs_slide_factory(8192))
+    scores = np.random.default_rng(0).uniform(size=(8192 // FULL_RESOLUTION_TILE_SIZE,) * 2).astype(np.float32)
+    return HeatmapDeepZoomGenerator(slide, scores, FULL_RESOLUTION_TILE_SIZE)
+
+
+@pytest.mark.parametrize("cache", ["render", "lru_cache"])
+@pytest.mark.parametrize("downsample", [1, 8])
+def test_heatmap_tiles(benchmark, heatmap_generator, cache, downsample):
+    level = heatmap_generator.level_count - 1 - int(np.log2(downsample))
+    columns, rows = heatmap_generator.level_tiles[level]
+    addresses = [(column, row) for column in range(min(columns, 4)) for row in range(min(rows, 4))]
+
+    def pan():
+        if cache == "render":
+            heatmap_generator._cache.clear()
+        return [heatmap_generator.get_tile_bytes(level, address) for address in addresses]
+
+    tiles = benchmark.pedantic(pan, rounds=5, warmup_rounds=1)
+
+    benchmark.extra_info["tiles"] = len(addresses)
+    assert all(tiles)
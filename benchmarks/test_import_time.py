@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# import time budget of every CLI entry point in ms, and the heavy modules it must not
+# import at startup. torch and seaborn are imported on first use, see
+# luna_pathology.common.preprocess
+CLI_IMPORT_BUDGETS = {
+    "luna_pathology.cli.dsa.dsa_viz":                        (1000, ("torch", "seaborn")),
+    "luna_pathology.cli.dsa.dsa_upload":                     (1000, ("torch", "seaborn")),
+    "luna_pathology.cli.export_tile_classifier":             (1000, ("torch", "seaborn")),
+    "luna_pathology.cli.collect_tile_segment":               (1000, ("torch", "seaborn")),
+    "luna_pathology.cli.generate_tile_labels":               (1500, ("torch", "seaborn")),
+    "luna_pathology.cli.generate_tile_labels_batch":         (1500, ("torch", "seaborn")),
+    "luna_pathology.cli.generate_and_infer_tile_labels":     (1500, ("torch", "seaborn")),
+    "luna_pathology.cli.infer_tile_labels":                  (1500, ("torch", "seaborn")),
+    "luna_pathology.cli.load_slide":                         (1500, ("torch", "seaborn")),
+    "luna_pathology.cli.visualize_tile_labels":              (1500, ("torch", "seaborn")),
+}
+
+
+def get_import_times(module):
+    """Cumulative import time in us of every module imported by a fresh interpreter importing module"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stderr=subprocess.PIPE, universal_newlines=True, env=os.environ.copy(), check=True)
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+@pytest.mark.parametrize("module", CLI_IMPORT_BUDGETS)
+def test_cli_import_time(benchmark, module):
+    budget_ms, lazy_modules = CLI_IMPORT_BUDGETS[module]
+
+    import_times = benchmark.pedantic(get_import_times, args=(module,), rounds=3)
+
+    import_ms = import_times[module] / 1000
+    benchmark.extra_info["import_ms"] = import_ms
+    benchmark.extra_info["budget_ms"] = budget_ms
+    assert not [name for name in lazy_modules if name in import_times]
+    assert import_ms <= budget_ms
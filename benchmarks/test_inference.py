@@ -0,0 +1,95 @@
+import itertools
+
+import pytest
+import torch
+from torchvision.models import resnet18
+
+from benchmarks.conftest import get_tiles_per_second
+from luna_pathology.common.inference import get_tile_data_loader, predict_tiles, prepare_classifier, set_cpu_threads
+from luna_pathology.common.model_export import export_classifier, load_classifier_artifact, compare_classifiers
+from luna_pathology.common.preprocess import iter_tile_bytes
+from luna_pathology.common.tile_store import TileStoreWriter, TileStoreReader
+from luna_pathology.models import eng_tissuenet, ov_tissuenet
+from luna_pathology.models.ov_tissuenet import TissueTileNet
+
+TILE_SIZE = 128
+BATCH_SIZE = 32
+
+# CPU configurations: channels_last, bfloat16
+CPU_CONFIGS = {
+    "fp32":               (False, False),
+    "channels_last":      (True,  False),
+    "bf16":               (False, True),
+    "channels_last_bf16": (True,  True),
+}
+
+
+@pytest.fixture(scope="module")
+def synthetic_tile_store(synthetic_image_slide, tmp_path_factory):
+    store_dir = tmp_path_factory.mktemp("tile_store")
+    address_raster = list(itertools.product(range(1, 9), range(1, 9)))
+    writer = TileStoreWriter(str(store_dir), len(address_raster), TILE_SIZE)
+    df = writer.write_tiles(iter_tile_bytes(synthetic_image_slide, address_raster, TILE_SIZE, TILE_SIZE))
+    writer.write_index(df)
+    return TileStoreReader(str(store_dir))
+
+
+@pytest.fixture(scope="module")
+def resnet18_classifiers(tmp_path_factory):
+    """ResNet18 classifiers of both model packages, loaded from random weight checkpoints"""
+    checkpoint_dir = tmp_path_factory.mktemp("checkpoints")
+    torch.manual_seed(0)
+
+    ov_checkpoint = str(checkpoint_dir / "ov_tissuenet.torch")
+    torch.save(TissueTileNet(resnet18(), 4).state_dict(), ov_checkpoint)
+    eng_checkpoint = str(checkpoint_dir / "eng_tissuenet.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, eng_checkpoint)
+
+    return {
+        "ov_tissuenet":  (ov_tissuenet.get_classifier(checkpoint_path=ov_checkpoint, n_classes=4), ov_tissuenet.get_transform()),
+        "eng_tissuenet": (eng_tissuenet.get_classifier(checkpoint_path=eng_checkpoint, n_classes=5), eng_tissuenet.get_transform()),
+    }
+
+
+@pytest.mark.parametrize("config", CPU_CONFIGS)
+@pytest.mark.parametrize("model", ["ov_tissuenet", "eng_tissuenet"])
+def test_cpu_inference(benchmark, synthetic_tile_store, resnet18_classifiers, model, config):
+    channels_last, bfloat16 = CPU_CONFIGS[config]
+    device = torch.device("cpu")
+    set_cpu_threads()
+
+    classifier, transform = resnet18_classifiers[model]
+    classifier = prepare_classifier(classifier, device, channels_last=channels_last)
+    data_loader = get_tile_data_loader(synthetic_tile_store, transform, device, batch_size=BATCH_SIZE)
+
+    predictions = benchmark.pedantic(predict_tiles, args=(classifier, data_loader, device),
+                                     kwargs={"channels_last": channels_last, "bfloat16": bfloat16}, rounds=3)
+
+    benchmark.extra_info["threads"] = torch.get_num_threads()
+    benchmark.extra_info["tiles_per_sec"] = get_tiles_per_second(benchmark, len(synthetic_tile_store))
+    assert len(synthetic_tile_store) == len(predictions["label"])
+
+
+@pytest.mark.parametrize("quantization", ["eager", "none", "dynamic", "fx"])
+def test_exported_cpu_inference(benchmark, synthetic_tile_store, tmp_path, quantization):
+    device = torch.device("cpu")
+    torch.manual_seed(0)
+    checkpoint_path = str(tmp_path / "eng_tissuenet.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, checkpoint_path)
+    model_params = {"checkpoint_path": checkpoint_path, "n_classes": 5}
+    transform = eng_tissuenet.get_transform()
+    data_loader = get_tile_data_loader(synthetic_tile_store, transform, device, batch_size=BATCH_SIZE)
+
+    eager_classifier = prepare_classifier(eng_tissuenet.get_classifier(**model_params), device)
+    if quantization == "eager":
+        classifier = eager_classifier
+    else:
+        artifact_path = export_classifier("luna_pathology.models.eng_tissuenet", model_params, quantization,
+                                          tile_size=TILE_SIZE, calibration_batches=data_loader)
+        classifier = prepare_classifier(load_classifier_artifact(artifact_path)[0], device)
+        report = compare_classifiers(eager_classifier, classifier, data_loader, device)
+        benchmark.extra_info.update({key: report[key] for key in ["label_agreement", "max_tumor_score_delta"]})
+
+    benchmark.pedantic(predict_tiles, args=(classifier, data_loader, device), rounds=3)
+
+    benchmark.extra_info["tiles_per_sec"] = get_tiles_per_second(benchmark, len(synthetic_tile_store))
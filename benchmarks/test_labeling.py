@@ -0,0 +1,46 @@
+import itertools
+
+import numpy as np
+import pytest
+from shapely.geometry import Point, box
+
+from luna_pathology.common.preprocess import get_regional_labels, get_tile_rectangles
+
+TILE_SIZE = 256
+TILES_PER_SIDE = 64
+SLIDE_DIMENSIONS = (TILE_SIZE * TILES_PER_SIDE, TILE_SIZE * TILES_PER_SIDE)
+
+
+def make_annotations(n_polygons=200, seed=0):
+    """Irregular buffered-point polygons of a few hundred vertices, like pathologist annotations"""
+    rng = np.random.default_rng(seed)
+    polygons = [Point(rng.uniform(0, SLIDE_DIMENSIONS[0]), rng.uniform(0, SLIDE_DIMENSIONS[1]))
+                .buffer(rng.uniform(500, 3000), quad_segs=64) for _ in range(n_polygons)]
+    return polygons, [f"label_{i % 4}" for i in range(n_polygons)]
+
+
+def linear_regional_labels(address_raster, annotation_polygons, annotation_labels):
+    """Per-tile linear contains scan, as get_regional_labels labeled tiles before the STRtree"""
+    labels = []
+    for minx, miny, maxx, maxy in get_tile_rectangles(address_raster, TILE_SIZE, SLIDE_DIMENSIONS):
+        tile_polygon = box(minx, miny, maxx, maxy)
+        labels.append(next((label for polygon, label in zip(annotation_polygons, annotation_labels)
+                            if polygon.contains(tile_polygon)), None))
+    return labels
+
+
+@pytest.mark.parametrize("labeler", ["strtree", "linear"])
+def test_regional_labels(benchmark, labeler):
+    address_raster = list(itertools.product(range(TILES_PER_SIDE), range(TILES_PER_SIDE)))
+    annotation_polygons, annotation_labels = make_annotations()
+
+    if labeler == "strtree":
+        labels = benchmark(get_regional_labels, address_raster, annotation_polygons, annotation_labels,
+                           TILE_SIZE, SLIDE_DIMENSIONS)
+    else:
+        labels = benchmark.pedantic(linear_regional_labels, args=(address_raster, annotation_polygons, annotation_labels),
+                                    rounds=1)
+
+    benchmark.extra_info["tiles"] = len(address_raster)
+    benchmark.extra_info["polygons"] = len(annotation_polygons)
+    assert len(address_raster) == len(labels)
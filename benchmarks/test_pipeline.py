@@ -0,0 +1,76 @@
+import pytest
+import torch
+from torchvision.models import resnet18
+
+from benchmarks.conftest import get_tiles_per_second
+from luna_pathology.common.preprocess import score_tiles, pretile_scoring, run_model
+
+SLIDE_SIZES = [2048, 4096, 8192]
+
+# 20x tiles of 128px from a 40x scan, scored on a 1/8 thumbnail
+PARAMS = {
+    "tile_size": 128,
+    "requested_magnification": 20,
+    "scale_factor": 8,
+    "filter": {
+        "otsu_score": 0.5
+    }
+}
+
+
+@pytest.fixture(scope="module")
+def eng_tissuenet_checkpoint(tmp_path_factory):
+    """ResNet18 eng_tissuenet checkpoint with random weights"""
+    torch.manual_seed(0)
+    checkpoint_path = str(tmp_path_factory.mktemp("checkpoints") / "eng_tissuenet.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, checkpoint_path)
+    return checkpoint_path
+
+
+@pytest.mark.parametrize("size", SLIDE_SIZES)
+def test_score_tiles(benchmark, synthetic_svs_slide_factory, size):
+    slide_path = synthetic_svs_slide_factory(size)
+
+    df, tiling = benchmark.pedantic(score_tiles, args=(slide_path, None, PARAMS, "123"), rounds=3)
+
+    benchmark.extra_info["slide_size"] = size
+    benchmark.extra_info["tiles"] = len(df)
+    assert len(df) > 0
+
+
+@pytest.mark.parametrize("size", SLIDE_SIZES)
+def test_pretile_scoring(benchmark, synthetic_svs_slide_factory, tmp_path, size):
+    slide_path = synthetic_svs_slide_factory(size)
+    output_dirs = iter(range(1000))
+
+    # a new output directory every round, pretile_scoring skips slides it has already tiled
+    def setup():
+        output_dir = tmp_path / f"round_{next(output_dirs)}"
+        output_dir.mkdir()
+        return (slide_path, str(output_dir), None, PARAMS, "123"), {}
+
+    properties = benchmark.pedantic(pretile_scoring, setup=setup, rounds=3)
+
+    benchmark.extra_info["slide_size"] = size
+    benchmark.extra_info["tiles"] = properties["tiles"]
+    benchmark.extra_info["tiles_per_second"] = get_tiles_per_second(benchmark, properties["tiles"])
+    benchmark.extra_info["timings"] = properties["timings"]
+    assert properties["tiles"] > 0
+
+
+def test_run_model(benchmark, synthetic_svs_slide_factory, eng_tissuenet_checkpoint, tmp_path):
+    (tmp_path / "tiles").mkdir()
+    (tmp_path / "scores").mkdir()
+    pretile_scoring(synthetic_svs_slide_factory(4096), str(tmp_path / "tiles"), None, PARAMS, "123")
+    params = {
+        "model_package": "luna_pathology.models.eng_tissuenet",
+        "model": {"checkpoint_path": eng_tissuenet_checkpoint, "n_classes": 5},
+        "device": "cpu",
+        "batch_size": 32,
+    }
+
+    properties = benchmark.pedantic(run_model, args=(str(tmp_path / "tiles"), str(tmp_path / "scores"), params), rounds=3)
+
+    benchmark.extra_info["tiles"] = properties["total_tiles"]
+    benchmark.extra_info["tiles_per_second"] = get_tiles_per_second(benchmark, properties["total_tiles"])
+    assert properties["total_tiles"] > 0
@@ -0,0 +1,61 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from luna_pathology.common.preprocess import address_to_coord, coord_to_address
+from luna_pathology.common.score_raster import save_score_rasters, read_score_raster
+from luna_pathology.common.tile_table import write_tile_table, read_tile_table
+
+TILES_PER_SIDE = 400
+
+
+@pytest.fixture(scope="module")
+def tile_scores(tmp_path_factory):
+    """Tile score csv and Parquet tables, and float16 score raster, of a TILES_PER_SIDE x TILES_PER_SIDE tile grid"""
+    output_dir = tmp_path_factory.mktemp("scores")
+    rng = np.random.default_rng(0)
+    coordinates = list(itertools.product(range(TILES_PER_SIDE), repeat=2))
+    df = pd.DataFrame({
+        "address": [coord_to_address(address, 20) for address in coordinates],
+        "coordinates": [str(address) for address in coordinates],
+        "tumor_score": rng.uniform(size=len(coordinates)),
+    }).set_index("address")
+    df.to_csv(output_dir / "tile_scores.csv")
+    write_tile_table(df, str(output_dir / "tile_scores.parquet"))
+    paths = save_score_rasters(df, ["tumor_score"], str(output_dir), (TILES_PER_SIDE, TILES_PER_SIDE))
+    return str(output_dir / "tile_scores.csv"), str(output_dir / "tile_scores.parquet"), paths["tumor_score"]
+
+
+def csv_score_grid(csv_path):
+    """Score grid rebuilt from the tile score csv, as consumers did before score rasters"""
+    df = pd.read_csv(csv_path).set_index("address")
+    grid = np.full((TILES_PER_SIDE, TILES_PER_SIDE), np.nan, dtype=np.float32)
+    for address, score in df["tumor_score"].items():
+        x, y = address_to_coord(address)
+        grid[y, x] = score
+    return grid
+
+
+def tile_table_score_grid(tile_table_path):
+    """Score grid from the typed x and y columns of a Parquet tile table"""
+    df = read_tile_table(tile_table_path)
+    grid = np.full((TILES_PER_SIDE, TILES_PER_SIDE), np.nan, dtype=np.float32)
+    grid[df["y"], df["x"]] = df["tumor_score"]
+    return grid
+
+
+@pytest.mark.parametrize("source", ["score_raster", "tile_table", "csv"])
+def test_load_score_grid(benchmark, tile_scores, source):
+    csv_path, tile_table_path, raster_path = tile_scores
+
+    if source == "score_raster":
+        grid = benchmark(lambda: read_score_raster(raster_path)[0])
+    elif source == "tile_table":
+        grid = benchmark(tile_table_score_grid, tile_table_path)
+    else:
+        grid = benchmark.pedantic(csv_score_grid, args=(csv_path,), rounds=3)
+
+    benchmark.extra_info["tiles"] = TILES_PER_SIDE * TILES_PER_SIDE
+    assert (TILES_PER_SIDE, TILES_PER_SIDE) == grid.shape
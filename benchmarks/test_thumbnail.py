@@ -0,0 +1,34 @@
+import numpy as np
+import openslide
+import pytest
+
+from benchmarks.conftest import make_synthetic_tissue, write_aperio_pyramid
+from luna_pathology.common.preprocess import get_downscaled_thumbnail, get_best_level_for_downsample
+
+
+@pytest.fixture(scope="module", params=[3, 4], ids=["3_levels", "4_levels"])
+def pyramid_svs_slide(request, tmp_path_factory):
+    """Path to an 8192x8192 synthetic 40x Aperio slide with 3 or 4 levels, 4x downsampled each"""
+    path = tmp_path_factory.mktemp("slides") / f"synthetic_{request.param}_levels.svs"
+    write_aperio_pyramid(str(path), make_synthetic_tissue(8192, 8192), levels=request.param)
+    return str(path)
+
+
+def openslide_thumbnail(slide, scale_factor):
+    """OpenSlide.get_thumbnail, as get_downscaled_thumbnail made thumbnails before reading strips"""
+    return np.array(slide.get_thumbnail((slide.dimensions[0] // scale_factor, slide.dimensions[1] // scale_factor)))
+
+
+@pytest.mark.parametrize("scale_factor", [8, 32])
+@pytest.mark.parametrize("builder", ["get_thumbnail", "pyramid_strips"])
+def test_thumbnail(benchmark, pyramid_svs_slide, builder, scale_factor):
+    slide = openslide.OpenSlide(pyramid_svs_slide)
+    thumbnail_builder = openslide_thumbnail if builder == "get_thumbnail" else get_downscaled_thumbnail
+
+    thumbnail = benchmark.pedantic(thumbnail_builder, args=(slide, scale_factor), rounds=3)
+
+    level = get_best_level_for_downsample(slide, scale_factor)
+    benchmark.extra_info["levels"] = slide.level_count
+    benchmark.extra_info["level"] = level
+    benchmark.extra_info["level_dimensions"] = slide.level_dimensions[level]
+    assert (8192 // scale_factor, 8192 // scale_factor, 3) == thumbnail.shape
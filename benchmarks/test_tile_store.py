@@ -0,0 +1,49 @@
+import itertools
+import os
+
+import pytest
+import torch
+from torchvision.transforms import PILToTensor
+
+from luna_pathology.common.inference import get_tile_data_loader
+from luna_pathology.common.preprocess import iter_tile_bytes
+from luna_pathology.common.tile_store import TileStoreWriter, TileStoreReader
+
+TILE_SIZE = 128
+# default batch size of run_model
+BATCH_SIZE = 64
+
+
+@pytest.fixture(scope="module")
+def synthetic_tiles(synthetic_image_slide):
+    address_raster = list(itertools.product(range(1, 31), range(1, 31)))
+    return list(iter_tile_bytes(synthetic_image_slide, address_raster, TILE_SIZE, TILE_SIZE))
+
+
+def load_like_run_model(tile_store):
+    """Batches of every tile from get_tile_data_loader, as run_model reads them, with a minimal transform"""
+    data_loader = get_tile_data_loader(tile_store, PILToTensor(), torch.device("cpu"), batch_size=BATCH_SIZE)
+    return sum(batch.shape[0] * batch.shape[-1] for batch in data_loader)
+
+
+@pytest.mark.parametrize("encoding", ["raw", "jpeg", "webp"])
+def test_tile_store_decode(benchmark, synthetic_tiles, tmp_path, encoding):
+    writer = TileStoreWriter(str(tmp_path), len(synthetic_tiles), TILE_SIZE, encoding=encoding, quality=90)
+    df = writer.write_tiles(iter(synthetic_tiles))
+    writer.write_index(df)
+    tile_store = TileStoreReader(str(tmp_path))
+
+    benchmark.extra_info["encoding"] = encoding
+    benchmark.extra_info["data_bytes"] = os.path.getsize(writer.data_path)
+    benchmark.extra_info["bytes_per_tile"] = os.path.getsize(writer.data_path) / len(synthetic_tiles)
+    benchmark.extra_info["compression_ratio"] = writer.tile_length * len(synthetic_tiles) / os.path.getsize(writer.data_path)
+
+    assert len(synthetic_tiles) * TILE_SIZE == benchmark(load_like_run_model, tile_store)
+
+
+@pytest.mark.parametrize("encoding", ["raw", "jpeg", "webp"])
+def test_tile_store_write(benchmark, synthetic_tiles, tmp_path, encoding):
+    df = benchmark(lambda: TileStoreWriter(str(tmp_path), len(synthetic_tiles), TILE_SIZE, encoding=encoding)
+                           .write_tiles(iter(synthetic_tiles)))
+
+    assert len(synthetic_tiles) == len(df)
@@ -0,0 +1,83 @@
+import itertools
+
+import numpy as np
+import openslide
+import pandas as pd
+import pytest
+
+from luna_pathology.common.preprocess import iter_tile_bytes, coord_to_address, get_best_level_for_downsample
+from luna_pathology.common.tile_store import TileStoreWriter
+
+TILE_SIZE = 128
+
+
+def get_address_raster(tiles_per_side=32):
+    return list(itertools.product(range(1, tiles_per_side - 1), range(1, tiles_per_side - 1)))
+
+
+def legacy_loc_accumulation(tile_iterator, address_raster, tiles_file_path):
+    """Per-row DataFrame.loc writes, as pretile_scoring used to accumulate tile offsets"""
+    df = pd.DataFrame({"address": [coord_to_address(address, 20) for address in address_raster]}).set_index("address")
+    offset = 0
+    with open(tiles_file_path, "wb") as fp:
+        for index, (img_bytes, img_mode, img_size) in zip(df.index, tile_iterator):
+            fp.write(img_bytes)
+            df.loc[index, "tile_image_offset"]  = int(offset)
+            df.loc[index, "tile_image_length"]  = int(len(img_bytes))
+            df.loc[index, "tile_image_size_xy"] = int(img_size)
+            df.loc[index, "tile_image_mode"]    = img_mode
+            offset += len(img_bytes)
+    return df
+
+
+def test_write_tiles(benchmark, synthetic_image_slide, tmp_path):
+    address_raster = get_address_raster()
+    tiles = list(iter_tile_bytes(synthetic_image_slide, address_raster, TILE_SIZE, TILE_SIZE))
+
+    df = benchmark(lambda: TileStoreWriter(str(tmp_path), len(tiles), TILE_SIZE).write_tiles(iter(tiles)))
+
+    assert np.array_equal(np.diff(df["tile_image_offset"].values), df["tile_image_length"].values[1:])
+
+
+def test_legacy_loc_accumulation(benchmark, synthetic_image_slide, tmp_path):
+    address_raster = get_address_raster()
+    tiles = list(iter_tile_bytes(synthetic_image_slide, address_raster, TILE_SIZE, TILE_SIZE))
+
+    df = benchmark(lambda: legacy_loc_accumulation(iter(tiles), address_raster, str(tmp_path / "tiles.slice.pil")))
+
+    assert len(tiles) == len(df)
+
+
+def test_extract_and_write_tiles(benchmark, synthetic_image_slide, tmp_path):
+    address_raster = get_address_raster()
+
+    def extract_and_write():
+        tile_iterator = iter_tile_bytes(synthetic_image_slide, address_raster, TILE_SIZE, TILE_SIZE)
+        return TileStoreWriter(str(tmp_path), len(address_raster), TILE_SIZE).write_tiles(tile_iterator)
+
+    df = benchmark.pedantic(extract_and_write, rounds=3)
+
+    assert (len(address_raster), TILE_SIZE, TILE_SIZE, 3) == np.load(tmp_path / "tiles.slice.npy", mmap_mode="r").shape
+    assert (df["tile_image_mode"] == "RGB").all()
+
+
+@pytest.mark.parametrize("read_level", ["level_0", "best_level"])
+def test_pyramid_level_reads(benchmark, synthetic_svs_slide, read_level):
+    # 10x tiles from a 40x scan: 512px at full resolution, 128px at the 4x downsampled level
+    full_resolution_tile_size, requested_tile_size = 4 * TILE_SIZE, TILE_SIZE
+    address_raster = get_address_raster(tiles_per_side=4096 // full_resolution_tile_size)
+
+    slide = openslide.OpenSlide(synthetic_svs_slide)
+    level = 0 if read_level == "level_0" else get_best_level_for_downsample(slide, 4)
+    level_tile_size = int(round(full_resolution_tile_size / slide.level_downsamples[level]))
+
+    def extract():
+        return list(iter_tile_bytes(synthetic_svs_slide, address_raster, full_resolution_tile_size,
+                                    requested_tile_size, level=level))
+
+    tiles = benchmark.pedantic(extract, rounds=3)
+
+    benchmark.extra_info["level"] = level
+    benchmark.extra_info["bytes_decoded"] = len(address_raster) * level_tile_size * level_tile_size * 4
+    benchmark.extra_info["bytes_per_tile"] = level_tile_size * level_tile_size * 4
+    assert all(len(img_bytes) == requested_tile_size * requested_tile_size * 3 for img_bytes, _, _ in tiles)
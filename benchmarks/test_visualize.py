@@ -0,0 +1,46 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from skimage.draw import rectangle_perimeter
+
+from luna_pathology.common.preprocess import visualize_tiling_scores, get_tile_color, address_to_coord, coord_to_address
+
+TILE_SIZE = 16
+TILES_PER_SIDE = 128
+
+
+def make_tile_scores(seed=0):
+    """Scores and labels of every interior tile of a TILES_PER_SIDE x TILES_PER_SIDE raster"""
+    rng = np.random.default_rng(seed)
+    addresses = [coord_to_address(address, 20) for address in itertools.product(range(1, TILES_PER_SIDE - 1), repeat=2)]
+    return pd.DataFrame({
+        "address": addresses,
+        "otsu_score": rng.uniform(0.5, 1.0, len(addresses)),
+        "tumor_score": rng.uniform(size=len(addresses)),
+        "model_score": rng.choice(["Label-0", "Label-1", "Label-2", "Label-3"], len(addresses)),
+    }).set_index("address")
+
+
+def legacy_visualize_tiling_scores(df, thumbnail_img, tile_size, score_type_to_visualize):
+    """Per-tile rectangle_perimeter and get_tile_color loop, as visualize_tiling_scores used to paint tiles"""
+    for index, row in df[df["otsu_score"] > 0.5].iterrows():
+        address = address_to_coord(index)
+        start = (address[1] * tile_size, address[0] * tile_size)
+        rr, cc = rectangle_perimeter(start=start, extent=(tile_size, tile_size), shape=thumbnail_img.shape)
+        thumbnail_img[rr, cc] = get_tile_color(row[score_type_to_visualize])
+    return thumbnail_img
+
+
+@pytest.mark.parametrize("score_type", ["tumor_score", "model_score"])
+@pytest.mark.parametrize("renderer", ["vectorized", "legacy"])
+def test_visualize_tiling_scores(benchmark, renderer, score_type):
+    df = make_tile_scores()
+    thumbnail_img = np.full((TILES_PER_SIDE * TILE_SIZE, TILES_PER_SIDE * TILE_SIZE, 3), 240, dtype=np.uint8)
+    visualize = visualize_tiling_scores if renderer == "vectorized" else legacy_visualize_tiling_scores
+
+    res = benchmark.pedantic(lambda: visualize(df, thumbnail_img.copy(), TILE_SIZE, score_type), rounds=3)
+
+    benchmark.extra_info["tiles"] = len(df)
+    assert np.array_equal(legacy_visualize_tiling_scores(df, thumbnail_img.copy(), TILE_SIZE, score_type), res)
@@ -8,7 +8,9 @@ from luna_core.common.custom_logger   import init_logger
 from luna_core.common.DataStore       import DataStore_v2
 from luna_core.common.config          import ConfigSet
 
-import pandas as pd
+from luna_pathology.common.tile_store  import TileStoreReader
+from luna_pathology.common.tile_table  import to_tile_table
+
 import pyarrow.parquet as pq
 import pyarrow as pa
 
@@ -71,8 +73,6 @@ def collect_tile_with_datastore(app_config: str, datastore_id: str, method_data:
     slide_metadata_json    = os.path.join(pathlib.Path(slide_path).parent, "metadata.json")
 
     tile_path           = datastore.get(datastore_id, input_tile_data_id, "TileImages")
-    tile_image_path     = os.path.join(tile_path, "tiles.slice.pil")
-    tile_label_path     = os.path.join(tile_path, "address.slice.csv")
     tile_label_metadata_json = os.path.join(tile_path, "metadata.json")
 
     with open(tile_label_metadata_json, "r") as fp:
@@ -80,11 +80,12 @@ def collect_tile_with_datastore(app_config: str, datastore_id: str, method_data:
     with open(slide_metadata_json, "r") as fp:
         slide_properties = json.load(fp)
     try:
-        df = pd.read_csv(tile_label_path)
-        df.loc[:,"data_path"]     = tile_image_path
+        tile_store = TileStoreReader(tile_path)
+        df = tile_store.index.reset_index()
+        df.loc[:,"data_path"]     = tile_store.data_path
         if cfg.get_value(path='APP_CFG::OBJECT_STORE_ENABLED'):
             df.loc[:,"object_bucket"] = tile_properties['object_bucket']
-            df.loc[:,"object_path"]   = tile_properties['object_folder'] + "/tiles.slice.pil"
+            df.loc[:,"object_path"]   = tile_properties['object_folder'] + "/" + os.path.basename(tile_store.data_path)
 
         if slide_path and 'patient_id' in slide_properties:
             df.loc[:,"patient_id"]   = slide_properties['patient_id']
@@ -103,7 +104,7 @@ def collect_tile_with_datastore(app_config: str, datastore_id: str, method_data:
 
         output_file = os.path.join(output_dir, f"{datastore_id}.parquet")
 
-        pq.write_table(pa.Table.from_pandas(df), output_file)
+        pq.write_table(pa.Table.from_pandas(to_tile_table(df)), output_file)
 
         logger.info("Saved to : " + str(output_file))
 
@@ -1,7 +1,7 @@
 import click
 from decimal import Decimal
 import pandas as pd
-import json, geojson, ijson
+import json, geojson, ijson, orjson
 import yaml
 import copy
 import time, os
@@ -9,8 +9,9 @@ from PIL import Image
 import re
 import numpy as np
 
-from luna_pathology.cli.dsa.utils import get_color, get_continuous_color, \
+from luna_pathology.cli.dsa.utils import get_color, get_continuous_colors, \
     vectorize_np_array_bitmask_by_pixel_value
+from luna_pathology.common.tile_table import read_tile_table
 
 # Base DSA jsons
 base_dsa_polygon_element = {"fillColor": "rgba(0, 0, 0, 0)", "lineColor": "rgb(0, 0, 0)","lineWidth": 2,"type": "polyline","closed": True, "points": [], "label": {"value": ""}}
@@ -21,6 +22,9 @@ base_dsa_annotation  = {"description": "", "elements": [], "name": ""}
 QUPATH_MAG_FACTOR = 0.5011
 image_id_regex = "(.*).svs"
 
+# number of elements serialized at a time by save_dsa_annotation_elements
+ELEMENT_CHUNK_SIZE = 10000
+
 def check_filepaths_valid(filepaths):
     """Checks if all paths exist.
 
@@ -57,11 +61,7 @@ def save_dsa_annotation(base_annotation, elements, annotation_name, output_folde
 
     dsa_annotation["name"] = annotation_name
 
-    image_id = re.search(image_id_regex, image_filename).group(1)
-    annotation_name_replaced = annotation_name.replace(" ","_")
-
-    os.makedirs(output_folder, exist_ok=True)
-    outfile_name = os.path.join(output_folder, f"{annotation_name_replaced}_{image_id}.json")
+    outfile_name = get_dsa_annotation_path(annotation_name, output_folder, image_filename)
 
     try:
         with open(outfile_name, 'w') as outfile:
@@ -71,6 +71,61 @@ def save_dsa_annotation(base_annotation, elements, annotation_name, output_folde
         print("ERROR: write permissions needs to be enabled for: ", os.path.dirname(outfile_name))
         return None
 
+def save_dsa_annotation_elements(base_annotation, element_chunks, annotation_name, output_folder, image_filename):
+    """Helper function to stream annotation elements to a json file, one chunk of elements at a time.
+
+    Only one chunk of elements is held in memory, so the size of the annotation is not bounded by memory.
+
+    Args:
+        base_annotation (dict): base annotation structure for DSA
+        element_chunks (iterable): lists of annotation elements
+        annotation_name (string): annotation name for HistomicsUI
+        output_folder (string): path to a directory to save the annotation file
+        image_filename (string): name of the image in DSA e.g. 123.svs
+
+    Returns:
+        string: annotation file path. None if error in writing the file.
+    """
+    dsa_annotation = {**base_annotation, "name": annotation_name}
+    dsa_annotation.pop("elements", None)
+
+    outfile_name = get_dsa_annotation_path(annotation_name, output_folder, image_filename)
+
+    try:
+        with open(outfile_name, 'wb') as outfile:
+            # the annotation without its closing brace, followed by the elements array
+            outfile.write(orjson.dumps(dsa_annotation, option=orjson.OPT_SERIALIZE_NUMPY)[:-1])
+            outfile.write(b',"elements":[')
+            separator = b""
+            for elements in element_chunks:
+                if not len(elements):
+                    continue
+                outfile.write(separator)
+                outfile.write(orjson.dumps(elements, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1])
+                separator = b","
+            outfile.write(b"]}")
+        return outfile_name
+    except OSError as e:
+        print("ERROR: write permissions needs to be enabled for: ", os.path.dirname(outfile_name))
+        return None
+
+def get_dsa_annotation_path(annotation_name, output_folder, image_filename):
+    """Get the path of an annotation file, creating its output folder.
+
+    Args:
+        annotation_name (string): annotation name for HistomicsUI
+        output_folder (string): path to a directory to save the annotation file
+        image_filename (string): name of the image in DSA e.g. 123.svs
+
+    Returns:
+        string: annotation file path
+    """
+    image_id = re.search(image_id_regex, image_filename).group(1)
+    annotation_name_replaced = annotation_name.replace(" ","_")
+
+    os.makedirs(output_folder, exist_ok=True)
+    return os.path.join(output_folder, f"{annotation_name_replaced}_{image_id}.json")
+
 
 @click.command()
 @click.option("-d", "--data_config",
@@ -427,12 +482,13 @@ def heatmap(data_config):
     """Generate heatmap based on the tile scores
 
     Creates a heatmap for the given column, using the color palette `viridis` to set a fill value
-    - the color ranges from purple to yellow, for scores from 0 to 1.
+    - the color ranges from purple to yellow, for scores from 0 to 1. Elements are built and
+    written to the annotation file in chunks, see get_heatmap_elements.
 
     Args:
         data_config (string): path to your data config file that includes input/output parameters.
 
-        input (string): path to CSV with tile scores
+        input (string): path to tile table with tile scores, Parquet or legacy csv
         output_folder (string): directory where the DSA compatible annotation json file will be saved
         image_filename (string): name of the image file in DSA e.g. 123.svs
         annotation_name (string): name of the annotation to be displayed in DSA
@@ -452,37 +508,56 @@ def heatmap(data_config):
     print("Building annotation for image: {}".format(data['image_filename']))
     start = time.time()
 
-    df = pd.read_csv(data["input"])
+    # scores keep the dtype they were saved with, so labels match those of earlier annotations
+    df = read_tile_table(data["input"], score_dtype=None)
     scaled_tile_size = int(data["tile_size"]) * int(data.get("scale_factor", 1))
 
-    elements = []
-    for _, row in df.iterrows():
-        element = copy.deepcopy(base_dsa_polygon_element)
-        label_value = row[data["column"]]
-        element["label"]["value"] = str(label_value)
+    element_chunks = get_heatmap_elements(df["x"].to_numpy(), df["y"].to_numpy(), df[data["column"]],
+                                          scaled_tile_size)
 
-        # get label specific color and add to elements
-        line_color, fill_color = get_continuous_color(label_value)
-        element["fillColor"] = fill_color
-        element["lineColor"] = line_color
+    annotation_name = data["column"] + "_" + data["annotation_name"]
+    annotatation_filepath = save_dsa_annotation_elements(base_dsa_annotation, element_chunks, annotation_name,
+                                                         data["output_folder"], data["image_filename"])
+    print("Time to build annotation", time.time() - start)
+    return annotatation_filepath
 
-        # convert coordinate string to tuple using eval
-        x,y = eval(row["coordinates"])
 
-        pixel_x = x * scaled_tile_size
-        pixel_y = y * scaled_tile_size
+def get_heatmap_elements(tile_x, tile_y, scores, scaled_tile_size, chunk_size=ELEMENT_CHUNK_SIZE):
+    """Generate heatmap polygon elements, one chunk of elements at a time.
 
-        coords = [[pixel_x, pixel_y], [pixel_x+scaled_tile_size, pixel_y], [pixel_x+scaled_tile_size, pixel_y+scaled_tile_size], [pixel_x, pixel_y+scaled_tile_size],[pixel_x, pixel_y]]
-        for c in coords:
-            c.append(0)
-        element["points"] = coords
-        elements.append(element)
+    Points and colors are computed for a chunk of tiles at once, see get_continuous_colors,
+    so memory use is bounded by chunk_size, not by the number of tiles.
 
-    annotation_name = data["column"] + "_" + data["annotation_name"]
-    print("Time to build annotation", time.time() - start)
+    Args:
+        tile_x (np.array): tile x of every tile
+        tile_y (np.array): tile y of every tile
+        scores (pd.Series): score of every tile, in [0,1]
+        scaled_tile_size (int): size of tiles on the DSA image
+        chunk_size (int, optional): number of elements per chunk
 
-    annotatation_filepath = save_dsa_annotation(base_dsa_annotation, elements, annotation_name, data["output_folder"], data["image_filename"])
-    return annotatation_filepath
+    Returns:
+        iterator: lists of polygon elements
+    """
+    # closed square of every tile, in the order of base_dsa_polygon_element points
+    corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]])
+
+    for start in range(0, len(scores), chunk_size):
+        end = start + chunk_size
+        origins = np.stack([tile_x[start:end], tile_y[start:end]], axis=-1).astype(np.int64)
+        points = np.zeros((len(origins), len(corners), 3), dtype=np.int64)
+        points[..., :2] = (origins[:, None, :] + corners[None, :, :]) * scaled_tile_size
+
+        chunk_scores = scores.iloc[start:end]
+        line_colors, fill_colors = get_continuous_colors(chunk_scores.to_numpy(dtype=float, na_value=np.nan))
+        # shortest repr of the scores at their saved precision, e.g. float64 for csv tables
+        labels = chunk_scores.astype(str).to_numpy()
+
+        yield [{**base_dsa_polygon_element,
+                "fillColor": fill_color,
+                "lineColor": line_color,
+                "points": tile_points,
+                "label": {"value": label}}
+               for fill_color, line_color, tile_points, label in zip(fill_colors, line_colors, points, labels)]
 
 
 if __name__ == '__main__':
@@ -1,8 +1,15 @@
 from random import randint
+from functools import lru_cache
 
 import numpy as np
 from skimage import measure
-import seaborn as sns
+
+
+@lru_cache(maxsize=None)
+def get_viridis_palette():
+    """Get the viridis colormap, importing seaborn on first use."""
+    import seaborn as sns
+    return sns.color_palette("viridis", as_cmap=True)
 
 
 def get_color(name, line_colors={}, fill_colors={}, alpha = 100):
@@ -41,8 +48,7 @@ def get_continuous_color(value, outline_color='same_as_fill', alpha = 100):
     Returns:
         string: RGBA line and fill colors
     """
-    c = sns.color_palette("viridis", as_cmap=True)
-    r,g,b,a = c(value, bytes=True)
+    r,g,b,a = get_viridis_palette()(value, bytes=True)
 
     fill_color = "rgba({}, {}, {}, {})".format(r,g,b,alpha)
     if outline_color == 'same_as_fill':
@@ -56,6 +62,37 @@ def get_continuous_color(value, outline_color='same_as_fill', alpha = 100):
     return line_color, fill_color
 
 
+def get_continuous_colors(values, outline_color='same_as_fill', alpha = 100):
+    """Get RGBA line and fill colors for an array of values.
+
+    Vectorized get_continuous_color: the palette is looked up once for all values, and each
+    distinct color is formatted once.
+
+    Args:
+        values (np.array): continuous values in [0,1]
+        outline_color (string, optional): manages the color used to outline the border of the annotation.
+            by default, uses the same color as fill_color.
+        alpha (int, optional): alpha value for the fill color. 100 by default
+
+    Returns:
+        tuple: arrays of RGBA line and fill colors, one per value
+    """
+    rgb = get_viridis_palette()(np.asarray(values, dtype=float), bytes=True)[..., :3].reshape(-1, 3)
+    colors, color_index = np.unique(rgb, axis=0, return_inverse=True)
+    color_index = color_index.reshape(-1)
+
+    fill_colors = np.array(["rgba({}, {}, {}, {})".format(r,g,b,alpha) for r,g,b in colors], dtype=object)
+    if outline_color == 'same_as_fill':
+        line_colors = np.array(["rgb({}, {}, {})".format(r,g,b) for r,g,b in colors], dtype=object)
+    elif outline_color == 'black':
+        line_colors = np.array(["rgb({}, {}, {})".format(0,0,0)] * len(colors), dtype=object)
+    elif outline_color == 'white':
+        line_colors = np.array(["rgb({}, {}, {})".format(255,255,255)] * len(colors), dtype=object)
+    else:
+        return None,None
+    return line_colors[color_index], fill_colors[color_index]
+
+
 def vectorize_np_array_bitmask_by_pixel_value(bitmask_np,
                                               label_num = 255, polygon_tolerance = 1, contour_level = .5):
     """Get simplified contours from the bitmask
@@ -0,0 +1,104 @@
+# General imports
+import os, json, logging, itertools, importlib
+import click
+import yaml
+
+# From common
+from luna_core.common.custom_logger   import init_logger
+
+from luna_pathology.common.tile_store   import TileStoreReader
+
+@click.command()
+@click.option('-m', '--method_param_path', required=True,
+              help='json file with method parameters for exporting a saved model.')
+def cli(method_param_path):
+    """Export a tile classifier to a TorchScript artifact next to its checkpoint.
+
+    method_param_path - json file with method parameters for exporting a saved model.
+
+    - model_package: package to load your model e.g. luna_pathology.models.ov_tissuenet
+
+    - model: model details e.g. {
+          "checkpoint_path": "/path/to/checkpoint",
+          "n_classes": 4
+      }
+
+    - quantization: optional int8 quantization, none, dynamic or fx, none by default.
+      dynamic only quantizes nn.Linear layers, e.g. only the final fc layer of a ResNet,
+      so it barely speeds up convolutional networks. Use fx to quantize convolutions too
+
+    - tile_size: optional tile size used to trace the model, 128 by default
+
+    - tile_path: optional tile store directory, e.g. a TileImages/data directory. Its
+      tiles calibrate fx quantization and are used for the accuracy and throughput
+      report. Required for fx quantization
+
+    - calibration_batches: optional number of batches used for fx calibration, 8 by default
+
+    - batch_size: optional number of tiles per batch, 64 by default
+
+    - intra_op_threads: optional number of torch threads
+    """
+    init_logger()
+
+    with open(method_param_path, 'r') as yaml_file:
+        method_data = yaml.safe_load(yaml_file)
+    export_tile_classifier(method_data)
+
+def export_tile_classifier(method_data: dict) -> dict:
+    """Export a tile classifier, and report its accuracy and throughput against the eager model.
+
+    Args:
+        method_data (dict): method parameters, see cli
+
+    Returns:
+        dict: export properties, including the report if a tile_path is given
+    """
+    # torch is imported here rather than at module load, to keep the cli startup fast
+    import torch
+    from luna_pathology.common.inference    import get_tile_data_loader, prepare_classifier, set_cpu_threads
+    from luna_pathology.common.model_export import export_classifier, load_classifier_artifact, compare_classifiers, \
+        QUANTIZED_LAYERS
+
+    logger = logging.getLogger(__name__)
+
+    model_package = method_data["model_package"]
+    model_params  = method_data["model"]
+    quantization  = method_data.get("quantization", "none")
+    tile_path     = method_data.get("tile_path", None)
+    batch_size    = method_data.get("batch_size", 64)
+    device        = torch.device("cpu")
+
+    set_cpu_threads(method_data.get("intra_op_threads", None))
+
+    transform = importlib.import_module(model_package).get_transform()
+    data_loader = get_tile_data_loader(TileStoreReader(tile_path), transform, device, batch_size=batch_size) \
+        if tile_path is not None else None
+    calibration_batches = itertools.islice(data_loader, method_data.get("calibration_batches", 8)) \
+        if data_loader is not None else None
+
+    artifact_path = export_classifier(model_package, model_params, quantization=quantization,
+                                      tile_size=method_data.get("tile_size", 128), calibration_batches=calibration_batches)
+
+    properties = {
+        "data": artifact_path,
+        "model_package": model_package,
+        "quantization": quantization,
+        "quantized_layers": QUANTIZED_LAYERS[quantization],
+    }
+
+    if data_loader is not None:
+        eager_classifier = prepare_classifier(importlib.import_module(model_package).get_classifier(**model_params), device)
+        exported_classifier, _ = load_classifier_artifact(artifact_path)
+        properties["report"] = compare_classifiers(eager_classifier, prepare_classifier(exported_classifier, device),
+                                                   data_loader, device)
+        logger.info("Export report: %s", properties["report"])
+
+    with open(os.path.splitext(artifact_path)[0] + ".json", "w") as fp:
+        json.dump(properties, fp, indent=4)
+
+    return properties
+
+
+if __name__ == "__main__":
+    cli()
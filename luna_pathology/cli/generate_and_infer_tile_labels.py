@@ -0,0 +1,116 @@
+# General imports
+import os, json, logging
+import click
+import yaml
+
+# From common
+from luna_core.common.custom_logger   import init_logger
+from luna_core.common.DataStore       import DataStore_v2
+from luna_core.common.config          import ConfigSet
+
+# From radiology.common
+from luna_pathology.common.preprocess   import run_tile_pipeline
+
+@click.command()
+@click.option('-a', '--app_config', required=True,
+              help="application configuration yaml file. See config.yaml.template for details.")
+@click.option('-s', '--datastore_id', required=True,
+              help='datastore name. usually a slide id.')
+@click.option('-m', '--method_param_path', required=True,
+              help='json file with method parameters for tile generation and inference.')
+def cli(app_config, datastore_id, method_param_path):
+    """Generate tiles and infer tile labels in one streaming pass.
+
+    Tiles go straight from tile extraction to the model, without the disk round trip
+    between generate_tiles and infer_tiles. The outputs match those two CLIs.
+
+    app_config - application configuration yaml file. See config.yaml.template for details.
+
+    datastore_id - datastore name. usually a slide id.
+
+    method_param_path - json file with method parameters for tile generation and inference.
+
+    - input_wsi_tag: job tag used to load slides
+
+    - job_tag: job tag for the inference
+
+    - tile_job_tag: optional job tag for the persisted tiles, job_tag by default
+
+    - persist_tiles: optional, also save the tiles, as generate_tiles does, false by default
+
+    - queue_size: optional number of tiles waiting for the model, 256 by default
+
+    - tile_size, scale_factor, requested_magnification, filter, project_id, labelset,
+      annotation_table_path, tile_encoding: tile generation parameters, see generate_tiles
+
+    - tile_workers: optional number of worker processes used to extract tiles, 1 by default.
+      num_workers is not used here, as infer_tiles passes it to the DataLoader
+
+    - model_package, model, model_artifact, device, batch_size, intra_op_threads,
+      inter_op_threads, channels_last, bfloat16: inference parameters, see infer_tiles
+
+    - profile: optional profile of the job, chrome or pstats, see generate_tiles
+
+    - root_path: path to output directory
+    """
+    init_logger()
+
+    with open(method_param_path, 'r') as yaml_file:
+        method_data = yaml.safe_load(yaml_file)
+    generate_and_infer_tile_labels_with_datastore(app_config, datastore_id, method_data)
+
+def generate_and_infer_tile_labels_with_datastore(app_config: str, datastore_id: str, method_data: dict):
+    """Generate tiles and infer tile labels in one streaming pass.
+
+    Args:
+        app_config (string): path to application configuration file.
+        datastore_id (string): datastore name. usually a slide id.
+        method_data (dict): method parameters including input, output details.
+
+    Returns:
+        None
+    """
+    logger = logging.getLogger(f"[datastore={datastore_id}]")
+
+    # Do some setup
+    cfg = ConfigSet("APP_CFG", config_file=app_config)
+    datastore   = DataStore_v2(method_data.get("root_path"))
+    method_id   = method_data.get("job_tag", "none")
+    tile_method_id = method_data.get("tile_job_tag", method_id)
+
+    image_path  = datastore.get(datastore_id, method_data['input_wsi_tag'], "WholeSlideImage")
+    logger.info(f"Whole slide image path: {image_path}")
+
+    # get image_id
+    # TODO - allow -s to take in slide (datastore_id) id
+    image_id = datastore_id
+
+    try:
+        if image_path is None:
+            raise ValueError("Image node not found")
+
+        # Data just goes under namespace/name, as with generate_tiles and infer_tiles
+        tile_output_dir = os.path.join(method_data.get("root_path"), datastore_id, tile_method_id, "TileImages", "data")
+        output_dir = os.path.join(method_data.get("root_path"), datastore_id, method_id, "TileScores", "data")
+        if method_data.get("persist_tiles", False) and not os.path.exists(tile_output_dir): os.makedirs(tile_output_dir)
+        if not os.path.exists(output_dir): os.makedirs(output_dir)
+
+        logger.info(f"Writing to output dir: {output_dir}")
+        tile_properties, properties = run_tile_pipeline(image_path, tile_output_dir, output_dir,
+                                                        method_data.get("annotation_table_path"), method_data, image_id)
+
+    except Exception as e:
+        logger.exception (f"{e}, stopping job execution...")
+        raise e
+
+    # Save metadata
+    if tile_properties is not None:
+        with open(os.path.join(tile_output_dir, "metadata.json"), "w") as fp:
+            json.dump(tile_properties, fp)
+
+    with open(os.path.join(output_dir, "metadata.json"), "w") as fp:
+        json.dump(properties, fp)
+
+
+if __name__ == "__main__":
+    cli()
@@ -49,6 +49,32 @@ def cli(app_config, datastore_id, method_param_path):
     - labelset: optional annotation labelset name, if using regional annotations
 
     - annotation_table_path: optional path to the regional annotation table
+
+    - regional_label_mode: optional, polygon to label tiles contained in annotation polygons,
+      or raster to label them from annotations rasterized at thumbnail resolution, which also
+      adds regional_coverage_<label> columns, polygon by default
+
+    - regional_label_cells_per_tile: optional raster resolution in cells per tile side,
+      the thumbnail tile size by default
+
+    - num_workers: optional number of worker processes used to extract tiles, 1 by default
+
+    - tile_encoding: optional tile encoding, one of raw, jpeg, webp (lossless) or png, raw by default
+
+    - tile_encoding_quality: optional JPEG quality of jpeg encoded tiles, 90 by default
+
+    - checkpoint_interval: optional number of tiles between checkpoints of the tile store, 10000
+      by default, 0 to disable. An interrupted job resumes from its last checkpoint, and a slide
+      already tiled with the same parameters is skipped
+
+    - thumbnail_cache_dir: optional directory of a thumbnail cache shared across jobs, e.g. by
+      generate_tiles and visualize_tiles, no cache by default
+
+    - thumbnail_cache_size_mb: optional size limit of the thumbnail cache, 4096 by default
+
+    - profile: optional profile of the job saved next to its outputs, chrome for a Chrome trace
+      of the pipeline stages (profile.trace.json) or pstats for a cProfile file (profile.pstats).
+      The seconds and calls of every stage are saved in the metadata as timings either way
     """
     init_logger()
 
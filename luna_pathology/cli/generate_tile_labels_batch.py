@@ -0,0 +1,342 @@
+# General imports
+import os, json, logging, time, signal
+import multiprocessing
+from multiprocessing.connection import wait
+from typing import Dict, List, Union
+import click
+import yaml
+import pandas as pd
+
+# From common
+from luna_core.common.custom_logger   import init_logger
+from luna_core.common.dask            import dask_job
+
+from luna_pathology.cli.generate_tile_labels import generate_tile_labels_with_datastore
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks of the memory of local slide jobs
+MEMORY_POLL_SECONDS = 0.5
+
+@click.command()
+@click.option('-a', '--app_config', required=True,
+              help="application configuration yaml file. See config.yaml.template for details.")
+@click.option('-s', '--datastore_id', 'datastore_ids', multiple=True,
+              help='datastore name. usually a slide id. can be repeated.')
+@click.option('-t', '--slide_table', default=None,
+              help='csv or parquet table of slides, with a datastore_id or slide_id column.')
+@click.option('-m', '--method_param_path', required=True,
+              help='json file with method parameters for tile generation and filtering.')
+@click.option('-p', '--num_processes', default=4, show_default=True,
+              help='number of slides processed at the same time.')
+@click.option('--memory_limit_mb', default=None, type=int,
+              help='optional memory limit of each slide job in MB.')
+@click.option('--dask', 'use_dask', is_flag=True, default=False,
+              help='run the slide jobs on a dask cluster instead of a local process pool.')
+@click.option('--dask_scheduler', default=None,
+              help='optional dask scheduler address, a local cluster by default.')
+@click.option('-o', '--summary_path', default=None,
+              help='optional json file to save the batch summary to.')
+def cli(app_config, datastore_ids, slide_table, method_param_path, num_processes, memory_limit_mb,
+        use_dask, dask_scheduler, summary_path):
+    """Generate tile addresses, scores and optionally annotation labels for a batch of slides.
+
+    Slides are tiled in parallel by one process, with the modules and method parameters
+    loaded once, instead of one generate_tiles process per slide.
+
+    app_config - application configuration yaml file. See config.yaml.template for details.
+
+    datastore_id - datastore names, usually slide ids, and/or slide_table, a table of slides
+
+    method_param_path - json file with method parameters for tile generation and filtering,
+    see generate_tiles
+
+    num_processes - number of slides processed at the same time
+
+    memory_limit_mb - optional memory limit of each slide job, on the memory private to the
+    slide process and its worker processes. A slide job over the limit is killed, and fails
+    with a MemoryError without stopping the batch
+
+    dask - run the slide jobs with the luna_core dask_job decorator on a dask cluster, at
+    dask_scheduler or a local cluster of num_processes workers
+
+    summary_path - optional json file to save the batch summary to
+    """
+    init_logger()
+
+    with open(method_param_path, 'r') as yaml_file:
+        method_data = yaml.safe_load(yaml_file)
+
+    datastore_ids = list(datastore_ids)
+    if slide_table is not None:
+        datastore_ids += read_slide_ids(slide_table)
+    if not datastore_ids:
+        raise click.UsageError("Expected datastore ids or a slide table")
+
+    summary = generate_tile_labels_batch(app_config, datastore_ids, method_data, num_processes=num_processes,
+                                         memory_limit_mb=memory_limit_mb, use_dask=use_dask,
+                                         dask_scheduler=dask_scheduler)
+
+    if summary_path is not None:
+        with open(summary_path, "w") as fp:
+            json.dump(summary, fp, indent=4)
+
+    if summary["failed"]:
+        raise SystemExit(1)
+
+def read_slide_ids(slide_table: str) -> List[str]:
+    """Read the slide ids of a csv or parquet slide table.
+
+    Args:
+        slide_table (string): path to a csv or parquet table with a datastore_id or slide_id column.
+
+    Returns:
+        list[str]: slide ids, in table order
+    """
+    df = pd.read_parquet(slide_table) if slide_table.endswith(".parquet") else pd.read_csv(slide_table, dtype=str)
+    df = df.reset_index()
+
+    for column in ("datastore_id", "slide_id"):
+        if column in df.columns:
+            return df[column].astype(str).tolist()
+    raise ValueError(f"Expected a datastore_id or slide_id column in {slide_table}")
+
+def get_process_memory(pid: int) -> int:
+    """Get the memory private to a process, its resident pages not shared with other processes.
+
+    Forked processes share the pages of their parent until they write to them, so their
+    resident memory overstates what a job uses. Reads /proc/<pid>/smaps_rollup, or the
+    resident memory in /proc/<pid>/statm on kernels without it.
+
+    Args:
+        pid (int): process id
+
+    Returns:
+        int: private memory in bytes, 0 if the process has exited
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fp:
+            return sum(int(line.split()[1]) << 10 for line in fp if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except FileNotFoundError:
+        if not os.path.exists(f"/proc/{pid}"): return 0
+    except ProcessLookupError:
+        return 0
+    try:
+        with open(f"/proc/{pid}/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (FileNotFoundError, ProcessLookupError):
+        return 0
+
+def get_child_pids() -> Dict[int, List[int]]:
+    """Get the child process ids of every process, from the parent ids in /proc/<pid>/stat.
+
+    Returns:
+        dict: child process ids by parent process id
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit(): continue
+        try:
+            with open(f"/proc/{name}/stat") as fp:
+                # the parent id follows the state, after the parenthesized command name
+                ppid = int(fp.read().rsplit(")", 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+def get_job_memory(pid: int, children: Dict[int, List[int]]) -> int:
+    """Get the private memory of a slide job process and its descendants, e.g. tile reading workers.
+
+    Args:
+        pid (int): slide job process id
+        children (dict): child process ids by parent process id, see get_child_pids
+
+    Returns:
+        int: private memory in bytes
+    """
+    pids, memory = [pid], 0
+    while pids:
+        pid = pids.pop()
+        memory += get_process_memory(pid)
+        pids += children.get(pid, [])
+    return memory
+
+def kill_job(process: multiprocessing.Process):
+    """Kill a slide job process and its worker processes.
+
+    Args:
+        process (multiprocessing.Process): slide job process, see run_local_slide_job
+
+    Returns:
+        None
+    """
+    try:
+        # the job leads its own process group once started, see run_local_slide_job
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    process.join()
+
+def run_slide_job(app_config: str, datastore_id: str, method_data: dict) -> dict:
+    """Generate tiles for one slide, and report its status instead of raising.
+
+    Args:
+        app_config (string): path to application configuration file.
+        datastore_id (string): datastore name. usually a slide id.
+        method_data (dict): method parameters including input, output details.
+
+    Returns:
+        dict: datastore_id, status (succeeded or failed), seconds and error
+    """
+    start = time.perf_counter()
+    try:
+        generate_tile_labels_with_datastore(app_config, datastore_id, method_data)
+        status, error = "succeeded", None
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+
+    return {"datastore_id": datastore_id, "status": status, "seconds": time.perf_counter() - start, "error": error}
+
+@dask_job("generate_tile_labels")
+def generate_tile_labels_job(datastore_id: str, app_config: str, method_data: dict) -> dict:
+    """Generate tiles for one slide as a dask job, see run_slide_job."""
+    return run_slide_job(app_config, datastore_id, method_data)
+
+def run_local_slide_job(sender: multiprocessing.connection.Connection, app_config: str, datastore_id: str,
+        method_data: dict):
+    """Generate tiles for one slide in a forked process, and send its status back, see run_slide_job.
+
+    The process leads a new process group, so the job and the worker processes it starts,
+    e.g. to read tiles in parallel, can be killed together.
+    """
+    os.setpgrp()
+    sender.send(run_slide_job(app_config, datastore_id, method_data))
+    sender.close()
+
+def run_local_slide_jobs(app_config: str, datastore_ids: List[str], method_data: dict, num_processes: int,
+        memory_limit_mb: Union[int, None], report):
+    """Generate tiles for slides in forked processes, one process per slide, see generate_tile_labels_batch.
+
+    Slide processes are not daemonic, so a slide job can start its own worker processes.
+    Jobs are killed if the private memory of their processes goes over memory_limit_mb,
+    checked every MEMORY_POLL_SECONDS.
+
+    Args:
+        app_config (string): path to application configuration file.
+        datastore_ids (list[str]): datastore names. usually slide ids.
+        method_data (dict): method parameters including input, output details.
+        num_processes (int): number of slides processed at the same time.
+        memory_limit_mb (int): optional memory limit of each slide job in MB.
+        report (callable): called with the result of every slide job
+
+    Returns:
+        None
+    """
+    context = multiprocessing.get_context("fork")
+    pending = list(datastore_ids)
+    jobs = {}
+
+    try:
+        while pending or jobs:
+            while pending and len(jobs) < num_processes:
+                datastore_id = pending.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=run_local_slide_job, name=f"slide-{datastore_id}",
+                                          args=(sender, app_config, datastore_id, method_data))
+                process.start()
+                sender.close()
+                jobs[receiver] = (process, datastore_id, time.perf_counter())
+
+            # a receiver is ready when its job sent a result, or its process exited without one
+            for receiver in wait(list(jobs), timeout=MEMORY_POLL_SECONDS):
+                process, datastore_id, start = jobs.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    process.join()
+                    result = {"datastore_id": datastore_id, "status": "failed", "seconds": time.perf_counter() - start,
+                              "error": f"slide process exited with code {process.exitcode}"}
+                receiver.close()
+                process.join()
+                report(result)
+
+            if memory_limit_mb is None or not jobs: continue
+            children = get_child_pids()
+            for receiver, (process, datastore_id, start) in list(jobs.items()):
+                memory = get_job_memory(process.pid, children)
+                if memory <= memory_limit_mb << 20 or receiver.poll(): continue
+                kill_job(process)
+                receiver.close()
+                del jobs[receiver]
+                report({"datastore_id": datastore_id, "status": "failed", "seconds": time.perf_counter() - start,
+                        "error": f"MemoryError: {memory >> 20} MB over the memory limit of {memory_limit_mb} MB"})
+    finally:
+        for receiver, (process, _, _) in jobs.items():
+            kill_job(process)
+            receiver.close()
+
+def generate_tile_labels_batch(app_config: str, datastore_ids: List[str], method_data: dict, num_processes: int = 4,
+        memory_limit_mb: Union[int, None] = None, use_dask: bool = False, dask_scheduler: Union[str, None] = None) -> dict:
+    """Generate tile addresses, scores and optionally annotation labels for a batch of slides.
+
+    Local slide jobs run in forked processes, which inherit the imported modules and parsed
+    method parameters. Each process handles a single slide under the memory limit, so the
+    memory of a slide is released when its job ends, see run_local_slide_jobs.
+
+    Args:
+        app_config (string): path to application configuration file.
+        datastore_ids (list[str]): datastore names. usually slide ids.
+        method_data (dict): method parameters including input, output details.
+        num_processes (int): number of slides processed at the same time.
+        memory_limit_mb (int): optional memory limit of each slide job in MB.
+        use_dask (bool): run the slide jobs on a dask cluster, see generate_tile_labels_job.
+        dask_scheduler (string): optional dask scheduler address, a local cluster by default.
+
+    Returns:
+        dict: batch summary with the number of slides, succeeded and failed slides, the
+            errors of failed slides and the status of every slide
+    """
+    start = time.perf_counter()
+    results = []
+
+    def report(result):
+        results.append(result)
+        logger.info("[%s/%s] %s %s in %.1fs%s", len(results), len(datastore_ids), result["datastore_id"],
+                    result["status"], result["seconds"], f": {result['error']}" if result["error"] else "")
+
+    if use_dask:
+        from dask.distributed import Client, as_completed
+
+        memory_limit = f"{memory_limit_mb}MB" if memory_limit_mb is not None else "auto"
+        client = Client(dask_scheduler) if dask_scheduler is not None else \
+            Client(n_workers=num_processes, threads_per_worker=1, memory_limit=memory_limit)
+        namespace = method_data.get("job_tag", "none")
+        futures = [client.submit(generate_tile_labels_job, namespace, datastore_id, app_config, method_data)
+                   for datastore_id in datastore_ids]
+        for future in as_completed(futures):
+            report(future.result())
+        client.close()
+    else:
+        run_local_slide_jobs(app_config, datastore_ids, method_data, num_processes, memory_limit_mb, report)
+
+    positions = {datastore_id: position for position, datastore_id in enumerate(datastore_ids)}
+    failures = {result["datastore_id"]: result["error"] for result in results if result["status"] == "failed"}
+    summary = {
+        "slides": len(datastore_ids),
+        "succeeded": len(results) - len(failures),
+        "failed": len(failures),
+        "seconds": time.perf_counter() - start,
+        "failures": failures,
+        "results": sorted(results, key=lambda result: positions[result["datastore_id"]]),
+    }
+    logger.info("Tiled %s of %s slides in %.1fs, %s failed", summary["succeeded"], summary["slides"],
+                summary["seconds"], summary["failed"])
+    return summary
+
+
+if __name__ == "__main__":
+    cli()
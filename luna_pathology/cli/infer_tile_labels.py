@@ -38,7 +38,29 @@ def cli(app_config, datastore_id, method_param_path):
           "n_classes": 4
       }
 
+    - model_artifact: optional path to a classifier exported with export_tiles_model, used
+      instead of building the model from its checkpoint
+
     - root_path: path to output directory
+
+    - device: optional torch device to run the model on, cpu, cuda, cuda:1 or auto, auto
+      (cuda if available, cpu otherwise) by default
+
+    - batch_size: optional number of tiles scored at once, 64 by default
+
+    - num_workers: optional number of DataLoader worker processes reading tiles, 0 by default
+
+    - num_threads: optional number of threads decoding encoded tiles
+
+    - intra_op_threads, inter_op_threads: optional number of torch threads on cpu
+
+    - channels_last: optional, use the channels_last memory format, false by default
+
+    - bfloat16: optional, run the model under bfloat16 autocast, false by default
+
+    - profile: optional profile of the job saved next to its outputs, chrome for a Chrome trace
+      of the pipeline stages (profile.trace.json) or pstats for a cProfile file (profile.pstats).
+      The seconds and calls of every stage are saved in the metadata as timings either way
     """
     init_logger()
 
@@ -68,9 +90,6 @@ def infer_tile_labels_with_datastore(app_config: str, datastore_id: str, method_
     if tile_path is None:
         raise ValueError("Tile path not found")
 
-    tile_image_path     = os.path.join(tile_path, "tiles.slice.pil")
-    tile_label_path     = os.path.join(tile_path, "address.slice.csv")
-
     # get image_id
     # TODO - allow -s to take in slide (container) id
 
@@ -80,7 +99,7 @@ def infer_tile_labels_with_datastore(app_config: str, datastore_id: str, method_
         output_dir = os.path.join(method_data.get("root_path"), datastore_id, method_id, "TileScores", "data")
         if not os.path.exists(output_dir): os.makedirs(output_dir)
 
-        properties = run_model(tile_image_path, tile_label_path, output_dir, method_data)
+        properties = run_model(tile_path, output_dir, method_data)
 
     except Exception as e:
         logger.exception (f"{e}, stopping job execution...")
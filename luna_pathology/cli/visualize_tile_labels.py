@@ -12,6 +12,7 @@ from luna_core.common.DataStore       import DataStore_v2
 from luna_core.common.config          import ConfigSet
 
 from luna_pathology.common.preprocess   import create_tile_thumbnail_image
+from luna_pathology.common.tile_table   import find_tile_table
 
 
 @click.command()
@@ -49,6 +50,20 @@ def cli(app_config, datastore_id, method_param_path):
         }
 
     - root_path: path to output directory
+
+    - thumbnail_cache_dir: optional directory of a thumbnail cache shared across jobs, e.g. by
+      generate_tiles and visualize_tiles, no cache by default
+
+    - thumbnail_cache_size_mb: optional size limit of the thumbnail cache, 4096 by default
+
+    - fill_tiles: optional, fill the tiles with their score color instead of drawing their
+      borders, false by default
+
+    - score_raster_encoding: optional encoding of the tile-grid score rasters saved with the
+      visualizations, float16 (default) or uint8, null to skip them
+
+    - heatmap_dzi: optional, also save a deep zoom (.dzi) pyramid of every score heatmap over
+      the slide, down to the requested magnification, false by default
     """
     init_logger()
 
@@ -87,7 +102,7 @@ def visualize_tile_labels_with_datastore(app_config: str, datastore_id: str, met
 
     label_path  = datastore.get(datastore_id, method_data['input_label_tag'], "TileScores")
     label_metadata_path = os.path.join(label_path, "metadata.json")
-    label_path = os.path.join(label_path, "tile_scores_and_labels_pytorch_inference.csv")
+    label_path = find_tile_table(label_path, "tile_scores_and_labels_pytorch_inference")
     with open(label_metadata_path, "r") as fp:
         label_properties = json.load(fp)
 
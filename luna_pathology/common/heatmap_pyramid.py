@@ -0,0 +1,190 @@
+"""
+Deep zoom pyramid of tile score heatmaps
+
+HeatmapDeepZoomGenerator serves the tiles of a score heatmap composited over the slide,
+as openslide.deepzoom.DeepZoomGenerator serves slide tiles, so any Deep Zoom viewer can
+pan and zoom a heatmap of a whole slide. A heatmap tile is rendered on request from the
+slide tile and the tile-grid score raster, see luna_pathology.common.score_raster,
+without rendering the heatmap at full resolution. Encoded tiles are kept in an
+in-process LRU cache, so panning back and forth over a slide does not render them again.
+
+write_dzi saves a .dzi pyramid of the heatmap for static viewers.
+"""
+import os, io, logging, threading
+from collections import OrderedDict
+from typing import Tuple, Union
+
+import numpy as np
+import pandas as pd
+import openslide
+from openslide.deepzoom import DeepZoomGenerator
+from PIL import Image
+
+from luna_pathology.common.preprocess import get_tile_colors
+from luna_pathology.common.score_raster import read_score_raster
+
+logger = logging.getLogger(__name__)
+
+HEATMAP_TILE_FORMATS = ("jpeg", "png")
+
+
+class HeatmapDeepZoomGenerator:
+    """Deep zoom tiles of a score heatmap over a slide
+
+    Args:
+        slide (openslide.OpenSlide): slide the scores were computed on
+        scores (np.ndarray): tile-grid scores, float scores in [0,1] or labels, NaN or
+            None where there is no tile, see read_score_raster
+        full_resolution_tile_size (int): size of a score tile at full resolution
+        tile_size (int): deep zoom tile width and height, without overlap
+        overlap (int): number of extra pixels on each side of deep zoom tiles
+        alpha (float): opacity of the heatmap over the slide
+        cache_size (int): number of encoded tiles kept in the LRU cache
+    """
+    def __init__(self, slide: openslide.OpenSlide, scores: np.ndarray, full_resolution_tile_size: int,
+                 tile_size: int = 254, overlap: int = 1, alpha: float = 0.5, cache_size: int = 1024):
+        self.slide_generator = DeepZoomGenerator(slide, tile_size=tile_size, overlap=overlap)
+        self.full_resolution_tile_size = full_resolution_tile_size
+        self.color_grid = get_heatmap_color_grid(scores, alpha)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock  = threading.Lock()
+
+    @classmethod
+    def from_score_raster(cls, slide_file_path: str, score_raster_path: str, **kwargs) -> "HeatmapDeepZoomGenerator":
+        """Heatmap generator of a score raster saved by save_score_rasters"""
+        scores, metadata = read_score_raster(score_raster_path)
+        return cls(openslide.OpenSlide(slide_file_path), scores, metadata["full_resolution_tile_size"], **kwargs)
+
+    @property
+    def level_count(self) -> int:
+        return self.slide_generator.level_count
+
+    @property
+    def level_tiles(self) -> Tuple[Tuple[int, int], ...]:
+        return self.slide_generator.level_tiles
+
+    @property
+    def level_dimensions(self) -> Tuple[Tuple[int, int], ...]:
+        return self.slide_generator.level_dimensions
+
+    @property
+    def tile_count(self) -> int:
+        return self.slide_generator.tile_count
+
+    def get_dzi(self, format: str) -> str:
+        """DZI xml of the heatmap pyramid, see DeepZoomGenerator.get_dzi"""
+        return self.slide_generator.get_dzi(format)
+
+    def get_tile(self, level: int, address: Tuple[int, int]) -> Image.Image:
+        """Render a heatmap tile
+
+        Args:
+            level (int): deep zoom level
+            address (Tuple[int, int]): column and row of the tile in the level
+
+        Returns:
+            Image.Image: RGB heatmap tile composited over the slide tile
+        """
+        tile = np.array(self.slide_generator.get_tile(level, address).convert("RGB"), dtype=np.float32)
+
+        # score tile of every pixel, from the full resolution location of the pixel center
+        (l0_x, l0_y), _, _ = self.slide_generator.get_tile_coordinates(level, address)
+        downsample = 2 ** (self.level_count - 1 - level)
+        height, width = tile.shape[:2]
+        grid_rows = ((l0_y + (np.arange(height) + 0.5) * downsample) // self.full_resolution_tile_size).astype(int)
+        grid_cols = ((l0_x + (np.arange(width) + 0.5) * downsample) // self.full_resolution_tile_size).astype(int)
+        grid_rows = np.minimum(grid_rows, self.color_grid.shape[0] - 1)
+        grid_cols = np.minimum(grid_cols, self.color_grid.shape[1] - 1)
+
+        colors = self.color_grid[grid_rows[:, None], grid_cols[None, :]]
+        alpha = colors[..., 3:] / 255
+        tile = tile * (1 - alpha) + colors[..., :3] * alpha
+        return Image.fromarray(np.round(tile).astype(np.uint8))
+
+    def get_tile_bytes(self, level: int, address: Tuple[int, int], format: str = "jpeg", quality: int = 75) -> bytes:
+        """Encoded heatmap tile, from the LRU cache if it was rendered recently
+
+        Args:
+            level (int): deep zoom level
+            address (Tuple[int, int]): column and row of the tile in the level
+            format (str): jpeg or png
+            quality (int): JPEG quality
+
+        Returns:
+            bytes: encoded tile
+        """
+        if format not in HEATMAP_TILE_FORMATS:
+            raise ValueError(f"Expected format in {HEATMAP_TILE_FORMATS} but got {format}")
+
+        key = (level, tuple(address), format, quality)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        buffer = io.BytesIO()
+        self.get_tile(level, address).save(buffer, format=format, quality=quality)
+        tile_bytes = buffer.getvalue()
+
+        with self._lock:
+            self._cache[key] = tile_bytes
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tile_bytes
+
+    def write_dzi(self, dzi_path: str, format: str = "jpeg", quality: int = 75,
+                  max_level: Union[int, None] = None) -> str:
+        """Save the heatmap pyramid as a .dzi file and its _files tile directory
+
+        Args:
+            dzi_path (str): output .dzi path
+            format (str): tile format, jpeg or png
+            quality (int): JPEG quality
+            max_level (int): highest level to save, all levels by default. Viewers zoom
+                past the highest saved level by upscaling it
+
+        Returns:
+            str: the .dzi path
+        """
+        if format not in HEATMAP_TILE_FORMATS:
+            raise ValueError(f"Expected format in {HEATMAP_TILE_FORMATS} but got {format}")
+
+        tiles_dir = os.path.splitext(dzi_path)[0] + "_files"
+        max_level = self.level_count - 1 if max_level is None else max_level
+
+        for level in range(max_level + 1):
+            level_dir = os.path.join(tiles_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            columns, rows = self.level_tiles[level]
+            for column in range(columns):
+                for row in range(rows):
+                    tile = self.get_tile(level, (column, row))
+                    tile.save(os.path.join(level_dir, f"{column}_{row}.{format}"), format=format, quality=quality)
+
+        with open(dzi_path, "w") as fp:
+            fp.write(self.get_dzi(format))
+        logger.info("Saved %s heatmap levels at %s", max_level + 1, dzi_path)
+        return dzi_path
+
+
+def get_heatmap_color_grid(scores: np.ndarray, alpha: float = 0.5) -> np.ndarray:
+    """RGBA heatmap color of every score tile
+
+    Args:
+        scores (np.ndarray): tile-grid scores, float scores in [0,1] or labels, NaN or
+            None where there is no tile
+        alpha (float): opacity of tiles with a score
+
+    Returns:
+        np.ndarray: uint8 array of shape scores.shape + (4,), transparent where there is
+            no tile, with tile colors of get_tile_colors
+    """
+    flat_scores = pd.Series(scores.ravel())
+    has_score = flat_scores.notna().to_numpy()
+
+    colors, valid = get_tile_colors(flat_scores[has_score])
+    color_grid = np.zeros((len(flat_scores), 4), dtype=np.uint8)
+    color_grid[np.flatnonzero(has_score)[valid], :3] = colors[valid]
+    color_grid[np.flatnonzero(has_score)[valid], 3] = round(255 * alpha)
+    return color_grid.reshape(scores.shape + (4,))
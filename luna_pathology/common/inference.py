@@ -0,0 +1,265 @@
+"""
+Batched tile classifier inference
+
+A TileDataset exposes a tile store to a torch DataLoader, which reads and transforms
+batches of tiles, optionally in worker processes, while the classifier scores the
+previous batch. Softmax scores and labels are computed for a whole batch at once and
+collected in preallocated arrays.
+
+A TileBatchQueue instead streams tiles straight from tile extraction to the classifier,
+without a round trip through a tile store on disk.
+
+Inference runs on CUDA or on CPU, where thread counts, the channels_last memory format
+and bfloat16 autocast can be tuned per node.
+"""
+import logging, queue, threading
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from luna_pathology.common.profiling import stage
+from luna_pathology.common.tile_store import TileStoreReader, TileStoreWriter
+
+logger = logging.getLogger(__name__)
+
+
+class TileDataset(Dataset):
+    """Dataset of the tiles of a tile store
+
+    Tiles are returned in tile store order, as transformed PIL images. Batches are read
+    with TileStoreReader.read_tiles, i.e. one zero-copy read of raw tiles or a threaded
+    decode of encoded tiles per batch.
+
+    Args:
+        tile_store (TileStoreReader): tile store to read the tiles from
+        transform (Callable): transform from a PIL image to a tensor, e.g. the
+            get_transform() of a model package
+    """
+    def __init__(self, tile_store: TileStoreReader, transform: Callable):
+        self.tile_store = tile_store
+        self.transform  = transform
+
+    def __len__(self) -> int:
+        return len(self.tile_store)
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        return self.transform(Image.fromarray(np.asarray(self.tile_store[index])))
+
+    def __getitems__(self, indices: List[int]) -> List[torch.Tensor]:
+        with stage("load"):
+            tiles = self.tile_store.read_tiles(indices)
+        with stage("transform"):
+            return [self.transform(Image.fromarray(tile)) for tile in tiles]
+
+
+class TileBatchQueue:
+    """Batches of tiles streamed from tile extraction through a bounded queue
+
+    A background thread reads tiles from a tile iterator, optionally writes them to a
+    tile store, transforms them and puts them on a queue of at most queue_size tiles,
+    from which batches are taken while the classifier scores the previous batch. Tiles
+    are batched in iterator order. A TileBatchQueue is iterated once.
+
+    Args:
+        tile_iterator (Iterator[tuple[bytes, str, int]]): raw image bytes, PIL image mode
+            and tile size of each tile, see iter_tile_bytes
+        transform (Callable): transform from a PIL image to a tensor
+        batch_size (int): number of tiles per batch
+        queue_size (int): maximum number of transformed tiles waiting for the classifier
+        tile_store (TileStoreWriter): optional tile store to write the tiles to
+
+    Attributes:
+        df_tile_images (pd.DataFrame): tile image columns of the written tile store, see
+            TileStoreWriter.write_tiles, once iterated with a tile store
+    """
+    _END = object()
+
+    def __init__(self, tile_iterator: Iterator[Tuple[bytes, str, int]], transform: Callable, batch_size: int = 64,
+            queue_size: int = 256, tile_store: Union[TileStoreWriter, None] = None):
+        self.tile_iterator  = tile_iterator
+        self.transform      = transform
+        self.batch_size     = batch_size
+        self.tile_store     = tile_store
+        self.df_tile_images = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop  = threading.Event()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _transform_tiles(self) -> Iterator[Tuple[bytes, str, int]]:
+        for img_bytes, img_mode, img_size in self.tile_iterator:
+            with stage("transform"):
+                tile = self.transform(Image.frombytes(img_mode, (img_size, img_size), img_bytes))
+            if not self._put(tile):
+                return
+            yield img_bytes, img_mode, img_size
+
+    def _produce(self):
+        try:
+            if self.tile_store is not None:
+                self.df_tile_images = self.tile_store.write_tiles(self._transform_tiles())
+            else:
+                for _ in self._transform_tiles(): pass
+        except Exception as e:
+            self._put(e)
+        self._put(self._END)
+
+    def __iter__(self) -> Iterator[torch.Tensor]:
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+
+        try:
+            batch = []
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    yield torch.stack(batch)
+                    batch = []
+
+            if batch:
+                yield torch.stack(batch)
+        finally:
+            self._stop.set()
+            producer.join()
+
+
+def get_device(device: str = "auto") -> torch.device:
+    """get the torch device to run inference on
+
+    Args:
+        device (str): torch device name, e.g. cpu, cuda or cuda:1, or auto for cuda if
+            available and cpu otherwise
+
+    Returns:
+        torch.device: the device
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    device = torch.device(device)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        raise ValueError(f"Requested device {device} but CUDA is not available")
+    return device
+
+
+def set_cpu_threads(intra_op_threads: Union[int, None] = None, inter_op_threads: Union[int, None] = None):
+    """set the number of threads torch uses for CPU inference
+
+    torch only allows setting the inter-op threads before the first parallel work
+    starts, so a later change is logged and skipped.
+
+    Args:
+        intra_op_threads (int): threads within an operator, e.g. a convolution, torch
+            default if None
+        inter_op_threads (int): threads running independent operators, torch default if None
+    """
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+
+    if inter_op_threads is not None and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            logger.warning("Could not set inter-op threads to %s after parallel work started, using %s",
+                           inter_op_threads, torch.get_num_interop_threads())
+
+    logger.info("Using %s intra-op and %s inter-op threads", torch.get_num_threads(), torch.get_num_interop_threads())
+
+
+def prepare_classifier(classifier: torch.nn.Module, device: torch.device, channels_last: bool = False) -> torch.nn.Module:
+    """put a classifier in eval mode on the inference device
+
+    Args:
+        classifier (torch.nn.Module): tile classifier
+        device (torch.device): inference device
+        channels_last (bool): use the channels_last memory format, which is faster for
+            convolutions on most CPUs
+
+    Returns:
+        torch.nn.Module: the classifier, ready for predict_tiles
+    """
+    classifier.eval()
+    return classifier.to(device, memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+
+def get_tile_data_loader(tile_store: TileStoreReader, transform: Callable, device: torch.device,
+        batch_size: int = 64, num_workers: int = 0) -> DataLoader:
+    """get a DataLoader of batches of tiles in tile store order
+
+    Args:
+        tile_store (TileStoreReader): tile store to read the tiles from
+        transform (Callable): transform from a PIL image to a tensor
+        device (torch.device): inference device, batches are pinned for CUDA devices
+        batch_size (int): number of tiles per batch
+        num_workers (int): number of DataLoader worker processes, 0 reads in this process
+
+    Returns:
+        DataLoader: loader of (batch_size, C, H, W) tensors
+    """
+    return DataLoader(TileDataset(tile_store, transform), batch_size=batch_size, shuffle=False,
+                      num_workers=num_workers, pin_memory=device.type == "cuda")
+
+
+def predict_tiles(classifier: torch.nn.Module, data_loader: Iterable[torch.Tensor], device: torch.device,
+        channels_last: bool = False, bfloat16: bool = False, n_tiles: Union[int, None] = None) -> Dict[str, np.ndarray]:
+    """score all tiles of a data loader with a classifier
+
+    Args:
+        classifier (torch.nn.Module): tile classifier, see prepare_classifier
+        data_loader (Iterable[torch.Tensor]): batches of tiles, e.g. a DataLoader, see
+            get_tile_data_loader, or a TileBatchQueue
+        device (torch.device): inference device
+        channels_last (bool): pass batches in the channels_last memory format
+        bfloat16 (bool): run the classifier under bfloat16 autocast, scores are computed
+            in float32
+        n_tiles (int): number of tiles, by default the length of the DataLoader dataset
+
+    Returns:
+        dict: label (argmax class index), tumor_score (class 0 probability) and
+            label_score (max class probability) arrays with one entry per tile
+    """
+    if n_tiles is None:
+        n_tiles = len(data_loader.dataset)
+    label       = np.empty(n_tiles, dtype=np.int64)
+    tumor_score = np.empty(n_tiles, dtype=np.float64)
+    label_score = np.empty(n_tiles, dtype=np.float64)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    start = 0
+    with torch.inference_mode(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=bfloat16):
+        for batch in data_loader:
+            # asynchronous CUDA kernels are waited for in postprocess, when copying scores
+            with stage("forward"):
+                output = classifier(batch.to(device, memory_format=memory_format, non_blocking=True))
+
+            end = start + len(batch)
+            if end > n_tiles:
+                raise ValueError(f"Expected {n_tiles} tiles but the data loader produced more")
+            with stage("postprocess"):
+                scores = torch.softmax(output.float(), dim=1)
+                max_scores, max_labels = scores.max(dim=1)
+                label[start:end]       = max_labels.cpu().numpy()
+                tumor_score[start:end] = scores[:, 0].cpu().numpy()
+                label_score[start:end] = max_scores.cpu().numpy()
+            if end // 1000 > start // 1000: logger.info("Proccessing tiles [%s,%s]", end, n_tiles)
+            start = end
+
+    if start != n_tiles:
+        raise ValueError(f"Expected {n_tiles} tiles but the data loader produced {start}")
+    return {"label": label, "tumor_score": tumor_score, "label_score": label_score}
@@ -0,0 +1,166 @@
+"""
+Export of tile classifiers to TorchScript artifacts
+
+The model packages build an eager nn.Module from a checkpoint. export_classifier
+traces that module, optionally quantized to int8, into a TorchScript artifact next to
+the checkpoint, which run_model loads directly with torch.jit.load. The artifact keeps
+the model package and export settings as an extra file, so the model package is only
+needed for its transform.
+
+Quantization modes:
+    none: float32 TorchScript
+    dynamic: dynamic int8 quantization of the nn.Linear layers only. Convolutions stay
+        float32, so convolutional networks gain little, e.g. only the final fc layer of a
+        ResNet is quantized. Use fx to quantize them
+    fx: static int8 quantization of the whole network with FX graph mode, calibrated
+        on batches of tiles
+"""
+import os, json, logging, time, importlib
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from luna_pathology.common.inference import predict_tiles
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "dynamic", "fx")
+
+# layers quantized to int8 by each quantization mode, saved in the export metadata
+QUANTIZED_LAYERS = {"none": "none", "dynamic": "linear", "fx": "all"}
+
+# name of the TorchScript extra file describing the export
+EXPORT_METADATA = "luna_pathology_export.json"
+
+
+def get_artifact_path(checkpoint_path: str, quantization: str = "none") -> str:
+    """get the artifact path next to a checkpoint, e.g. 4.ckpt -> 4.dynamic_int8.pt"""
+    suffix = "torchscript" if quantization == "none" else f"{quantization}_int8"
+    return f"{os.path.splitext(checkpoint_path)[0]}.{suffix}.pt"
+
+
+def quantize_classifier(classifier: torch.nn.Module, quantization: str, example_inputs: Tuple[torch.Tensor],
+        calibration_batches: Union[Iterable[torch.Tensor], None] = None) -> torch.nn.Module:
+    """quantize a classifier to int8 for CPU inference
+
+    Args:
+        classifier (torch.nn.Module): classifier in eval mode
+        quantization (str): one of QUANTIZATION_MODES
+        example_inputs (tuple): example inputs of the classifier
+        calibration_batches (Iterable[torch.Tensor]): batches of tiles to calibrate
+            activation ranges, required for fx quantization
+
+    Returns:
+        torch.nn.Module: the quantized classifier
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Expected quantization in {QUANTIZATION_MODES} but got {quantization}")
+
+    if quantization == "dynamic":
+        return torch.ao.quantization.quantize_dynamic(classifier, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if quantization == "fx":
+        if calibration_batches is None:
+            raise ValueError("fx quantization needs calibration tiles")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        prepared = prepare_fx(classifier, get_default_qconfig_mapping("x86"), example_inputs)
+        with torch.inference_mode():
+            for batch in calibration_batches:
+                prepared(batch)
+        return convert_fx(prepared)
+
+    return classifier
+
+
+def export_classifier(model_package: str, model_params: dict, quantization: str = "none", tile_size: int = 128,
+        calibration_batches: Union[Iterable[torch.Tensor], None] = None, artifact_path: Union[str, None] = None) -> str:
+    """export a tile classifier to a TorchScript artifact
+
+    Args:
+        model_package (str): model package, e.g. luna_pathology.models.eng_tissuenet
+        model_params (dict): get_classifier arguments, including checkpoint_path
+        quantization (str): one of QUANTIZATION_MODES
+        tile_size (int): tile size of the example input used for tracing
+        calibration_batches (Iterable[torch.Tensor]): batches of transformed tiles, see
+            quantize_classifier
+        artifact_path (str): output path, by default next to the checkpoint, see
+            get_artifact_path
+
+    Returns:
+        str: path of the saved artifact
+    """
+    if artifact_path is None:
+        artifact_path = get_artifact_path(model_params["checkpoint_path"], quantization)
+
+    classifier = importlib.import_module(model_package).get_classifier(**model_params).eval()
+    if quantization == "dynamic":
+        linear_parameters = sum(parameter.numel() for module in classifier.modules()
+                                if isinstance(module, torch.nn.Linear) for parameter in module.parameters())
+        logger.warning("dynamic quantization only quantizes nn.Linear layers, %.1f%% of the parameters of %s, "
+                       "use fx quantization to quantize convolutions too", 100 * linear_parameters /
+                       max(1, sum(parameter.numel() for parameter in classifier.parameters())), model_package)
+    example_inputs = (torch.rand(1, 3, tile_size, tile_size),)
+    classifier = quantize_classifier(classifier, quantization, example_inputs, calibration_batches)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(classifier, example_inputs)
+
+    metadata = {"model_package": model_package, "model": model_params, "quantization": quantization,
+                "quantized_layers": QUANTIZED_LAYERS[quantization], "tile_size": tile_size}
+    torch.jit.save(traced, artifact_path, _extra_files={EXPORT_METADATA: json.dumps(metadata)})
+
+    logger.info("Exported %s classifier with quantization=%s to %s", model_package, quantization, artifact_path)
+    return artifact_path
+
+
+def load_classifier_artifact(artifact_path: str) -> Tuple[torch.jit.ScriptModule, dict]:
+    """load an exported classifier and its export metadata
+
+    Args:
+        artifact_path (str): path of an artifact saved by export_classifier
+
+    Returns:
+        Tuple[torch.jit.ScriptModule, dict]: the classifier on cpu and the export metadata
+    """
+    extra_files = {EXPORT_METADATA: ""}
+    classifier = torch.jit.load(artifact_path, map_location="cpu", _extra_files=extra_files)
+    return classifier, json.loads(extra_files[EXPORT_METADATA])
+
+
+def compare_classifiers(reference: torch.nn.Module, candidate: torch.nn.Module, data_loader: DataLoader,
+        device: torch.device) -> dict:
+    """compare the predictions and throughput of two classifiers on the same tiles
+
+    Args:
+        reference (torch.nn.Module): reference classifier, e.g. the eager model
+        candidate (torch.nn.Module): optimized classifier, e.g. an exported artifact
+        data_loader (DataLoader): loader of batches of tiles, see get_tile_data_loader
+        device (torch.device): inference device
+
+    Returns:
+        dict: label agreement, score deltas and tiles per second of both classifiers
+    """
+    predictions, tiles_per_sec = {}, {}
+    for name, classifier in [("reference", reference), ("candidate", candidate)]:
+        start = time.perf_counter()
+        predictions[name] = predict_tiles(classifier, data_loader, device)
+        tiles_per_sec[name] = len(data_loader.dataset) / (time.perf_counter() - start)
+
+    reference_predictions, candidate_predictions = predictions["reference"], predictions["candidate"]
+    tumor_score_delta = np.abs(reference_predictions["tumor_score"] - candidate_predictions["tumor_score"])
+    label_score_delta = np.abs(reference_predictions["label_score"] - candidate_predictions["label_score"])
+
+    return {
+        "tiles": len(data_loader.dataset),
+        "label_agreement": float(np.mean(reference_predictions["label"] == candidate_predictions["label"])),
+        "max_tumor_score_delta": float(tumor_score_delta.max()),
+        "mean_tumor_score_delta": float(tumor_score_delta.mean()),
+        "max_label_score_delta": float(label_score_delta.max()),
+        "reference_tiles_per_sec": tiles_per_sec["reference"],
+        "candidate_tiles_per_sec": tiles_per_sec["candidate"],
+        "speedup": tiles_per_sec["candidate"] / tiles_per_sec["reference"],
+    }
@@ -6,12 +6,14 @@
 Various utility and processing methods for pathology
 """
 
-import os, itertools, logging, re
+import os, logging, re, hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
 
-from typing import Union, Tuple, List, Dict
+from typing import Union, Tuple, List, Dict, Callable, Iterator, TYPE_CHECKING
 import numpy  as np
 import pandas as pd
-import seaborn as sns
 
 import json 
 from pathlib import Path
@@ -24,22 +26,39 @@ from openslide.deepzoom import DeepZoomGenerator
 
 from skimage.color   import rgb2gray
 from skimage.filters import threshold_otsu
-from skimage.draw import rectangle_perimeter, rectangle
+from skimage.draw import rectangle, polygon as draw_polygon
 
-import requests
 import importlib
 
+import shapely
 from shapely.geometry import shape, Point, Polygon
 
-from luna_core.common.DataStore import DataStore_v2
-from random import randint
-import torch
+from luna_pathology.common.tile_store import TileStoreWriter, TileStoreReader
+from luna_pathology.common.thumbnail_cache import ThumbnailCache, get_slide_key
+from luna_pathology.common.score_raster import save_score_rasters
+from luna_pathology.common.tile_table import to_tile_table, write_tile_table, read_tile_table, get_tile_grid_coordinates
+from luna_pathology.common.profiling import StageTimer, stage, get_active_timer, profile_stages, get_profile_path
+
+# torch, through luna_pathology.common.inference and model_export, and seaborn are
+# imported on first use, so that tiling and visualization don't pay their import time
+if TYPE_CHECKING:
+    import torch
 
 logger = logging.getLogger(__name__)
 
 
-palette = sns.color_palette("viridis",as_cmap=True)
-categorial = sns.color_palette("Set1", 8)
+@lru_cache(maxsize=None)
+def get_palettes() -> Tuple[Callable, list]:
+    """get the continuous viridis and categorical Set1 tile color palettes"""
+    import seaborn as sns
+    return sns.color_palette("viridis",as_cmap=True), sns.color_palette("Set1", 8)
+
+def __getattr__(name: str):
+    # palette and categorial were module attributes, built when importing seaborn
+    if name == "palette": return get_palettes()[0]
+    if name == "categorial": return get_palettes()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 categorical_colors = {}
 
 def get_tile_color(score:Union[str, float]) -> Union[float, None]:
@@ -55,6 +74,8 @@ def get_tile_color(score:Union[str, float]) -> Union[float, None]:
             else None
 
     """
+    palette, categorial = get_palettes()
+
     # categorical
     if isinstance(score, str):
         if score in categorical_colors:
@@ -144,6 +165,90 @@ def get_full_resolution_generator(slide: openslide.OpenSlide, tile_size:int) ->
     assert generator.level_dimensions[generator_level] == slide.dimensions
     return generator, generator_level
 
+# Registry of block-reduction tile scorers, keyed by score column name
+tile_scorers = {}
+
+def register_tile_scorer(name:str, source:str="rgb") -> Callable:
+    """register tile scorer
+
+    registers a block-reduction scoring function under a score column name. A scoring
+    function receives a (tiles_y, tiles_x, tile_size, tile_size, ...) block view of a
+    thumbnail and returns a (tiles_y, tiles_x) array with one score per tile.
+    Registered scorers are computed by pretile_scoring.
+
+    Args:
+        name (str): name of the score column e.g. otsu_score
+        source (str): thumbnail to score, either 'rgb' or 'otsu'
+
+    Returns:
+        Callable: decorator registering the scoring function
+    """
+    if source not in ("rgb", "otsu"):
+        raise ValueError(f"Expected scorer source to be 'rgb' or 'otsu' but got {source}")
+
+    def decorator(scorer: Callable) -> Callable:
+        tile_scorers[name] = (scorer, source)
+        return scorer
+
+    return decorator
+
+def get_tile_block_view(img:np.ndarray, tile_size:int) -> np.ndarray:
+    """get tile block view
+
+    returns a read-only (tiles_y, tiles_x, tile_size, tile_size, ...) view of an image
+    without copying it. Partial tiles at the right and bottom edges are left out.
+
+    Args:
+        img (np.ndarray): input image with shape (height, width, ...)
+        tile_size (int): width and height of a single tile
+
+    Returns:
+        np.ndarray: block view of the image
+    """
+    tiles_y, tiles_x = img.shape[0] // tile_size, img.shape[1] // tile_size
+    shape   = (tiles_y, tiles_x, tile_size, tile_size) + img.shape[2:]
+    strides = (img.strides[0] * tile_size, img.strides[1] * tile_size) + img.strides
+    return np.lib.stride_tricks.as_strided(img, shape=shape, strides=strides, writeable=False)
+
+def get_block_scores(address_raster:list, img:np.ndarray, tile_size:int,
+        scorer:Callable) -> List[float]:
+    """compute block scores
+
+    scores every tile of the image with a block-reduction scorer in a single pass, then
+    selects the scores of the requested tiles
+
+    Args:
+        address_raster (list): the raster address of tiles to score
+        img (np.ndarray): input array to score
+        tile_size (int): size of input tiles
+        scorer (Callable): block-reduction scoring function, see register_tile_scorer
+
+    Returns:
+        list[float]: a list of scores in the order of address_raster
+    """
+    score_grid = scorer(get_tile_block_view(img, tile_size))
+
+    addresses = np.array(list(address_raster), dtype=int).reshape(-1, 2)
+    x, y = addresses[:, 0], addresses[:, 1]
+    if np.any(x >= score_grid.shape[1]) or np.any(y >= score_grid.shape[0]) or np.any(addresses < 0):
+        raise ValueError(f"Tile addresses exceed the {score_grid.shape[1]}x{score_grid.shape[0]} tile grid")
+
+    return score_grid[y, x].tolist()
+
+@register_tile_scorer("otsu_score", source="otsu")
+def otsu_block_scorer(blocks:np.ndarray) -> np.ndarray:
+    """fraction of foreground pixels in each tile of an otsu-thresholded image"""
+    return blocks.mean(axis=(2, 3))
+
+@register_tile_scorer("purple_score", source="rgb")
+def purple_block_scorer(blocks:np.ndarray) -> np.ndarray:
+    """fraction of purple pixels in each tile of an RGB image"""
+    r, g, b = blocks[..., 0], blocks[..., 1], blocks[..., 2]
+    # cond1 = r > 75
+    # cond2 = b > 90
+    # score = np.sum(cond1 & cond2)
+    return ((r > (g + 10)) & (b > (g + 10))).mean(axis=(2, 3))
+
 # USED -> generate cli
 def get_otsu_scores(address_raster:list, otsu_img:np.ndarray, otsu_tile_size:int) -> List[float]:
     """compute otsu score
@@ -159,13 +264,7 @@ def get_otsu_scores(address_raster:list, otsu_img:np.ndarray, otsu_tile_size:int
     Returns:
         list[float]: a list of otsu scores 
     """
-    otsu_slide = array_to_slide(otsu_img)
-    otsu_generator, otsu_generator_level = get_full_resolution_generator(otsu_slide, tile_size=otsu_tile_size)
-    otsu_score_results = []
-    for address in address_raster:
-        otsu_tile = np.array(otsu_generator.get_tile(otsu_generator_level, address))
-        otsu_score_results.append( otsu_tile.mean().item() )
-    return otsu_score_results
+    return get_block_scores(address_raster, otsu_img, otsu_tile_size, otsu_block_scorer)
 
 # USED -> generate cli
 def get_purple_scores(address_raster:list, rgb_img:np.ndarray, rgb_tile_size:int) -> List[float]:
@@ -181,20 +280,7 @@ def get_purple_scores(address_raster:list, rgb_img:np.ndarray, rgb_tile_size:int
     Returns:
         list[float]: a list of purple scores    
     """
-
-    rgb_slide = array_to_slide(rgb_img)
-    rgb_generator, rgb_generator_level = get_full_resolution_generator(rgb_slide, tile_size=rgb_tile_size)   
-    purple_score_results = []
-    for address in address_raster:
-        rgb_tile = np.array(rgb_generator.get_tile(rgb_generator_level, address))
-        r, g, b = rgb_tile[..., 0], rgb_tile[..., 1], rgb_tile[..., 2]
-        # cond1 = r > 75
-        # cond2 = b > 90
-        # score = np.sum(cond1 & cond2)
-        score = np.mean((r > (g + 10)) & (b > (g + 10)))
-        purple_score_results.append(score)  
-
-    return purple_score_results
+    return get_block_scores(address_raster, rgb_img, rgb_tile_size, purple_block_scorer)
 
 # USED -> utils
 def coord_to_address(s:Tuple[int, int], magnification:int)->str:
@@ -230,21 +316,48 @@ def address_to_coord(s:str) -> Tuple[int, int]:
     return (x,y)
 
 # USED -> utils
-def get_downscaled_thumbnail(slide:openslide.OpenSlide, scale_factor:int)-> np.ndarray:
+def get_downscaled_thumbnail(slide:openslide.OpenSlide, scale_factor:int, num_threads:Union[int, None]=None,
+        strip_height:int=512)-> np.ndarray:
     """get downscaled thumbnail
 
-    yields a thumbnail image of a whole slide rescaled by a specified scale factor
+    yields a thumbnail image of a whole slide rescaled by a specified scale factor. The
+    thumbnail is resized in one step from the lowest resolution pyramid level at least
+    as detailed as the thumbnail, see get_best_level_for_downsample, which is read in
+    horizontal strips with a thread pool.
 
     Args:
         slide (openslide.OpenSlide): slide object
         scale_factor (int): integer scaling factor to resize the whole slide by
+        num_threads (int): number of threads reading strips, by default chosen by
+            ThreadPoolExecutor
+        strip_height (int): height of the strips read at the pyramid level
     
     Returns:    
         np.ndarray: downsized whole slie thumbnail 
     """
     new_width  = slide.dimensions[0] // scale_factor
     new_height = slide.dimensions[1] // scale_factor
-    img = slide.get_thumbnail((new_width, new_height))
+
+    level = get_best_level_for_downsample(slide, scale_factor)
+    level_width, level_height = slide.level_dimensions[level]
+    level_downsample = slide.level_downsamples[level]
+    bg_color = '#' + slide.properties.get(openslide.PROPERTY_NAME_BACKGROUND_COLOR, 'ffffff')
+
+    level_img = np.empty((level_height, level_width, 3), dtype=np.uint8)
+
+    def read_strip(y):
+        height = min(strip_height, level_height - y)
+        # rounded rather than truncated to a level-0 row, which avoids one-pixel seams
+        # between strips of levels with a non-integer downsample
+        strip = slide.read_region((0, round(y * level_downsample)), level, (level_width, height))
+        # apply on solid background, as OpenSlide.get_thumbnail does
+        level_img[y:y + height] = np.asarray(Image.composite(strip, Image.new('RGB', strip.size, bg_color), strip).convert('RGB'))
+
+    with ThreadPoolExecutor(num_threads) as pool:
+        list(pool.map(read_strip, range(0, level_height, strip_height)))
+
+    img = Image.fromarray(level_img)
+    img.thumbnail((new_width, new_height), Image.LANCZOS)
     return np.array(img)
 
 # USED -> generate tiles
@@ -266,6 +379,48 @@ def make_otsu(img: np.ndarray, scale:int=1) -> np.ndarray:
     threshold = threshold_otsu(_img)
     return (_img < (threshold * scale)).astype(float)
 
+def get_thumbnail_images(slide_file_path: str, slide: openslide.OpenSlide, scale_factor: int,
+        params: dict) -> Tuple[np.ndarray, np.ndarray, float]:
+    """get thumbnail images
+
+    gets the RGB thumbnail of a slide, its grayscale image and Otsu threshold, see
+    make_otsu, from the thumbnail cache in params["thumbnail_cache_dir"] if set
+
+    Args:
+        slide_file_path (str): whole slide file path
+        slide (openslide.OpenSlide): slide object
+        scale_factor (int): integer scaling factor to resize the whole slide by
+        params (dict): optional thumbnail_cache_dir and thumbnail_cache_size_mb, the
+            size limit of the cache, 4096 by default
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, float]: RGB thumbnail, grayscale thumbnail and
+            Otsu threshold of the grayscale thumbnail
+    """
+    def compute():
+        with stage("thumbnail"):
+            rgb = get_downscaled_thumbnail(slide, scale_factor)
+        with stage("otsu"):
+            gray = rgb2gray(rgb)
+            otsu_threshold = float(threshold_otsu(gray))
+        return {"rgb": rgb, "gray": gray}, {"otsu_threshold": otsu_threshold}
+
+    cache_dir = params.get("thumbnail_cache_dir", None)
+    if cache_dir:
+        cache = ThumbnailCache(cache_dir, max_bytes=params.get("thumbnail_cache_size_mb", 4096) << 20)
+        key = get_slide_key(slide_file_path, scale_factor)
+        entry = cache.get(key)
+        if entry is not None:
+            arrays, metadata = entry
+        else:
+            arrays, metadata = compute()
+            # float32 halves the size of the cached grayscale thumbnail, the computed one is returned as is
+            cache.put(key, {**arrays, "gray": arrays["gray"].astype(np.float32)}, metadata)
+    else:
+        arrays, metadata = compute()
+
+    return arrays["rgb"], arrays["gray"], metadata["otsu_threshold"]
+
 def build_shapely_polygons_from_geojson(annotation_geojson:Dict[str, any])-> Tuple[list,
         list]:
     """Build shapely polygons from geojson
@@ -305,73 +460,356 @@ def build_shapely_polygons_from_geojson(annotation_geojson:Dict[str, any])-> Tup
     return annotation_polygons,annotation_labels
 
 
+def get_tile_rectangles(address_raster:list, tile_size:int, slide_dimensions:Tuple[int, int]) -> np.ndarray:
+    """get the full resolution rectangles of tiles
+
+    Tiles at the right and bottom edges of the slide are clipped to the slide, like
+    the tiles of get_full_resolution_generator.
+
+    Args:
+        address_raster (list): raster coordinates for tiles
+        tile_size (int): full resolution tile size
+        slide_dimensions (Tuple[int, int]): full resolution slide width and height
+
+    Returns:
+        np.ndarray: (n, 4) array of minx, miny, maxx, maxy per tile
+    """
+    tile_min = np.asarray(list(address_raster), dtype=np.int64).reshape(-1, 2) * tile_size
+    tile_max = np.minimum(tile_min + tile_size, np.asarray(slide_dimensions, dtype=np.int64))
+    return np.hstack([tile_min, tile_max])
+
+
 def get_regional_labels(address_raster:list, annotation_polygons:list,
-        annotation_labels:list, full_generator:DeepZoomGenerator, full_level:int)->list:
+        annotation_labels:list, tile_size:int, slide_dimensions:Tuple[int, int])->list:
     """get regional labels
 
     Returns annotation labels for tiles that contain annotations
-    If the tile doesn't contain annotation, set label to None.
+    If the tile doesn't contain annotation, set label to None. A tile contained in
+    several annotations gets the label of the first one.
+
+    Candidate annotations of every tile are found with an STRtree of the annotation
+    polygons, and containment is tested against the prepared polygons.
 
     Args:
         address_raster (list): raster coordinates for tiles 
         annotation_polygons (list): list of shapely Polygon objects
         annotation_labels (list): list of annotation label names
-        full_generator (DeepZoomGenerator): whole slide full resolution generator
-        param full_level (int): full res level for full_generator
+        tile_size (int): full resolution tile size
+        slide_dimensions (Tuple[int, int]): full resolution slide width and height
     
     Returns:
         list: list of annotation labels for each polygon 
     """
-    regional_label_results = []
+    tile_polygons = shapely.box(*get_tile_rectangles(address_raster, tile_size, slide_dimensions).T)
+    annotation_polygons = np.asarray(annotation_polygons, dtype=object)
+    shapely.prepare(annotation_polygons)
 
+    # candidate (tile, annotation) pairs with overlapping bounding boxes
+    tile_index, annotation_index = shapely.STRtree(annotation_polygons).query(tile_polygons)
+    contained = shapely.contains(annotation_polygons[annotation_index], tile_polygons[tile_index])
+
+    # first containing annotation of each tile, len(annotation_polygons) if there is none
+    first_annotation = np.full(len(tile_polygons), len(annotation_polygons), dtype=np.int64)
+    np.minimum.at(first_annotation, tile_index[contained], annotation_index[contained])
+
+    labels = list(annotation_labels) + [None]
+    return [labels[index] for index in first_annotation]
+
+def rasterize_polygon(polygon:Polygon, window_origin:Tuple[int, int], window_shape:Tuple[int, int],
+        cell_size:float) -> np.ndarray:
+    """rasterize a polygon to a window of a grid of cells
+
+    A cell is inside the polygon if its center is inside the polygon exterior and
+    outside its holes.
+
+    Args:
+        polygon (Polygon): polygon in full resolution coordinates
+        window_origin (Tuple[int, int]): column and row of the first cell of the window
+        window_shape (Tuple[int, int]): rows and columns of the window
+        cell_size (float): full resolution width and height of a cell
+
+    Returns:
+        np.ndarray: boolean mask of the window
+    """
+    mask = np.zeros(window_shape, dtype=bool)
+    for ring, inside in [(polygon.exterior, True)] + [(interior, False) for interior in polygon.interiors]:
+        # cell (row, col) is centered at ((col + 0.5) * cell_size, (row + 0.5) * cell_size)
+        ring_coords = np.asarray(ring.coords) / cell_size - np.asarray(window_origin) - 0.5
+        rows, cols = draw_polygon(ring_coords[:, 1], ring_coords[:, 0], shape=window_shape)
+        mask[rows, cols] = inside
+    return mask
+
+
+def get_rasterized_regional_labels(address_raster:list, annotation_polygons:list, annotation_labels:list,
+        tile_size:int, slide_dimensions:Tuple[int, int], cells_per_tile:int) -> pd.DataFrame:
+    """get regional labels and label coverage from rasterized annotations
+
+    Rasterized alternative to get_regional_labels. Every annotation polygon is burned
+    once to a grid of cells_per_tile x cells_per_tile cells per tile, within its
+    bounding box. A tile is contained in a polygon if all of its cells are, i.e. if the
+    block minimum of the polygon mask is 1, and gets the label of the first containing
+    polygon as in get_regional_labels. Cells outside the slide are ignored. The label
+    coverage of a tile is the fraction of its cells inside any polygon with that label.
+
+    Args:
+        address_raster (list): raster coordinates for tiles
+        annotation_polygons (list): list of shapely Polygon objects
+        annotation_labels (list): list of annotation label names
+        tile_size (int): full resolution tile size
+        slide_dimensions (Tuple[int, int]): full resolution slide width and height
+        cells_per_tile (int): raster resolution, e.g. the thumbnail tile size
+
+    Returns:
+        pd.DataFrame: regional_label and a regional_coverage_<label> column per
+            annotation label, with one row per tile of address_raster
+    """
+    tiles_x, tiles_y = (int(np.ceil(dimension / tile_size)) for dimension in slide_dimensions)
+    cell_size = tile_size / cells_per_tile
+
+    # cells with centers inside the slide
+    cell_centers_x = (np.arange(tiles_x * cells_per_tile) + 0.5) * cell_size
+    cell_centers_y = (np.arange(tiles_y * cells_per_tile) + 0.5) * cell_size
+    valid = (cell_centers_y[:, None] < slide_dimensions[1]) & (cell_centers_x[None, :] < slide_dimensions[0])
+
+    first_annotation = np.full((tiles_y, tiles_x), len(annotation_polygons), dtype=np.int64)
+    label_masks = {label: np.zeros(valid.shape, dtype=bool) for label in dict.fromkeys(annotation_labels)}
+
+    for index, (polygon, label) in enumerate(zip(annotation_polygons, annotation_labels)):
+        minx, miny, maxx, maxy = polygon.bounds
+        tile_x0, tile_y0 = max(int(minx // tile_size), 0), max(int(miny // tile_size), 0)
+        tile_x1, tile_y1 = min(int(maxx // tile_size) + 1, tiles_x), min(int(maxy // tile_size) + 1, tiles_y)
+        if tile_x0 >= tile_x1 or tile_y0 >= tile_y1: continue
+
+        window = np.s_[tile_y0 * cells_per_tile:tile_y1 * cells_per_tile, tile_x0 * cells_per_tile:tile_x1 * cells_per_tile]
+        mask = rasterize_polygon(polygon, (tile_x0 * cells_per_tile, tile_y0 * cells_per_tile),
+                                 valid[window].shape, cell_size)
+        label_masks[label][window] |= mask
+
+        # block minimum over the valid cells of each tile
+        contained = get_tile_block_view(mask | ~valid[window], cells_per_tile).all(axis=(2, 3))
+        first_window = first_annotation[tile_y0:tile_y1, tile_x0:tile_x1]
+        first_window[contained & (first_window == len(annotation_polygons))] = index
+
+    address_raster = np.asarray(list(address_raster), dtype=np.int64).reshape(-1, 2)
+    tile_x, tile_y = address_raster[:, 0], address_raster[:, 1]
+    if ((tile_x >= tiles_x) | (tile_y >= tiles_y) | (address_raster < 0).any(axis=1)).any():
+        raise ValueError(f"Tile addresses exceed the {tiles_x}x{tiles_y} tile grid of the slide")
+
+    labels = np.asarray(list(annotation_labels) + [None], dtype=object)
+    regional_labels = {"regional_label": labels[first_annotation[tile_y, tile_x]]}
+
+    valid_cells = get_tile_block_view(valid, cells_per_tile).sum(axis=(2, 3))
+    for label, label_mask in label_masks.items():
+        coverage = get_tile_block_view(label_mask & valid, cells_per_tile).sum(axis=(2, 3)) / valid_cells
+        regional_labels[f"regional_coverage_{label}"] = coverage[tile_y, tile_x]
+
+    return pd.DataFrame(regional_labels)
+
+# allows for pyramid level downsamples stored as e.g. 4.0003 instead of 4
+LEVEL_DOWNSAMPLE_TOLERANCE = 1.01
+
+def get_best_level_for_downsample(slide: openslide.OpenSlide, downsample:float) -> int:
+    """get best level for downsample
+
+    Return the lowest resolution pyramid level that is at least as detailed as the
+    requested downsample, so tiles read at that level only need to be resized by the
+    residual factor.
+
+    Args:
+        slide (openslide.OpenSlide): slide object
+        downsample (float): requested downsample relative to full resolution
+
+    Returns:
+        int: pyramid level of the slide
+    """
+    return max(level for level, level_downsample in enumerate(slide.level_downsamples)
+               if level_downsample <= downsample * LEVEL_DOWNSAMPLE_TOLERANCE)
+
+def read_tile(slide: openslide.OpenSlide, address:Tuple[int, int], full_resolution_tile_size:int,
+        requested_tile_size:int, level:int) -> Image.Image:
+    """read tile
+
+    reads a tile directly from a pyramid level of the slide, applies it on the slide
+    background color and resizes the residual difference to the requested tile size.
+    Read at level 0, the tile is identical to the full resolution DeepZoomGenerator
+    tile of the same address resized to the requested tile size.
+
+    Args:
+        slide (openslide.OpenSlide): slide object
+        address (tuple[int, int]): raster coordinates of the tile
+        full_resolution_tile_size (int): tile size at full resolution
+        requested_tile_size (int): width and height of the returned tile
+        level (int): pyramid level to read from, see get_best_level_for_downsample
+
+    Returns:
+        Image.Image: RGB tile
+    """
+    level_tile_size = int(round(full_resolution_tile_size / slide.level_downsamples[level]))
+    location = (address[0] * full_resolution_tile_size, address[1] * full_resolution_tile_size)
+    with stage("read"):
+        tile = slide.read_region(location, level, (level_tile_size, level_tile_size))
+
+        # apply on solid background, as DeepZoomGenerator does
+        bg_color = '#' + slide.properties.get(openslide.PROPERTY_NAME_BACKGROUND_COLOR, 'ffffff')
+        tile = Image.composite(tile, Image.new('RGB', tile.size, bg_color), tile)
+
+    with stage("resize"):
+        return tile.resize((requested_tile_size, requested_tile_size))
+
+def read_tile_bytes(slide: openslide.OpenSlide, address_raster:list, full_resolution_tile_size:int,
+        requested_tile_size:int, level:int) -> List[Tuple[bytes, str, int]]:
+    """read tile bytes
+
+    reads tiles from a pyramid level of the slide, see read_tile
+
+    Args:
+        slide (openslide.OpenSlide): slide object
+        address_raster (list): raster coordinates of tiles to read
+        full_resolution_tile_size (int): tile size at full resolution
+        requested_tile_size (int): width and height of the returned tiles
+        level (int): pyramid level to read from
+
+    Returns:
+        list[tuple[bytes, str, int]]: raw image bytes, PIL image mode and tile size of
+            each tile, in the order of address_raster
+    """
+    tiles = []
     for address in address_raster:
-        tile_contains_annotation = False
-        tile,_,tile_size = full_generator.get_tile_coordinates(full_level, address)
+        img_pil = read_tile(slide, address, full_resolution_tile_size, requested_tile_size, level)
+        tiles.append((img_pil.tobytes(), img_pil.mode, img_pil.size[0]))
+    return tiles
+
+# slide opened once by each tile extraction worker process
+_worker_slide = None
+
+def _init_tile_worker(slide_file_path:str):
+    global _worker_slide
+    _worker_slide = openslide.open_slide(str(slide_file_path))
+
+def _read_tile_chunk(address_raster:list, full_resolution_tile_size:int, requested_tile_size:int,
+        level:int) -> Tuple[List[Tuple[bytes, str, int]], Dict[str, dict]]:
+    # stages are timed in the worker, and merged into the timer of the main process
+    with StageTimer().activate() as timer:
+        tiles = read_tile_bytes(_worker_slide, address_raster, full_resolution_tile_size, requested_tile_size, level)
+    return tiles, timer.stages
+
+def iter_tile_bytes(slide_file_path:str, address_raster:list, full_resolution_tile_size:int,
+        requested_tile_size:int, num_workers:int=1, chunk_size:int=64,
+        level:Union[int, None]=None) -> Iterator[Tuple[bytes, str, int]]:
+    """iterate tile bytes
+
+    extracts tiles from a whole slide, optionally with a pool of worker processes that
+    each open their own OpenSlide handle and read a contiguous chunk of addresses.
+    Tiles are always yielded in the order of address_raster, so the output does not
+    depend on the number of workers.
+
+    Tiles are read from the lowest resolution pyramid level that still covers the
+    requested magnification instead of full resolution, so e.g. 20x tiles of a 40x
+    scan with a 4x downsampled level decode a quarter of the pixels.
 
-        tile_x, tile_y = tile
-        tile_size_x, tile_size_y = tile_size
+    Args:
+        slide_file_path (str): input whole slide file path, or an image file that
+            openslide.open_slide can open
+        address_raster (list): raster coordinates of tiles to extract
+        full_resolution_tile_size (int): tile size at full resolution
+        requested_tile_size (int): width and height of the extracted tiles
+        num_workers (int): number of worker processes, tiles are read in this process
+            if 1 or less
+        chunk_size (int): number of tiles read by a worker per task
+        level (Union[int, None]): pyramid level to read from, by default the best level
+            for the requested tile size
 
-        tile_polygon = Polygon([
-            (tile_x,               tile_y),
-            (tile_x,               tile_y+tile_size_y),
-            (tile_x+tile_size_x,   tile_size_y + tile_y),
-            (tile_x + tile_size_x, tile_y),
-            ])
+    Returns:
+        Iterator[tuple[bytes, str, int]]: raw image bytes, PIL image mode and tile size
+    """
+    address_raster = list(address_raster)
+    chunks = [address_raster[i:i+chunk_size] for i in range(0, len(address_raster), chunk_size)]
+
+    slide = openslide.open_slide(str(slide_file_path))
+    if level is None:
+        level = get_best_level_for_downsample(slide, full_resolution_tile_size / requested_tile_size)
+    logger.info("Reading tiles from level %s with downsample %s", level, slide.level_downsamples[level])
+
+    if num_workers <= 1:
+        for chunk in chunks:
+            yield from read_tile_bytes(slide, chunk, full_resolution_tile_size, requested_tile_size, level)
+        return
+
+    read_chunk = partial(_read_tile_chunk, full_resolution_tile_size=full_resolution_tile_size,
+                         requested_tile_size=requested_tile_size, level=level)
+    with multiprocessing.Pool(num_workers, initializer=_init_tile_worker, initargs=(slide_file_path,)) as pool:
+        for tiles, stages in pool.imap(read_chunk, chunks):
+            if get_active_timer() is not None: get_active_timer().merge(stages)
+            yield from tiles
+
+def get_candidate_raster(tile_x_count:int, tile_y_count:int, score_grids:Dict[str, np.ndarray],
+        filter:Union[Dict[str, float], None]=None, annotation_polygons:Union[list, None]=None,
+        tile_size:Union[int, None]=None) -> np.ndarray:
+    """get the addresses of the tiles that can pass the tile filter
+
+    Predicate pushdown for score_tiles. Score filters are applied to the score grids of
+    the whole slide at once, and with annotations only tiles overlapping the bounding box
+    of an annotation polygon are kept, as no other tile can get a regional label. Tiles
+    at the edge of the slide are excluded, as in the full raster.
 
-        for annotation_polygon, annotation_label in zip(annotation_polygons,annotation_labels):
-            if annotation_polygon.contains(tile_polygon):
-                tile_contains_annotation = True
-                regional_label_results.append (annotation_label)
-                break
-        if not tile_contains_annotation:
-            regional_label_results.append (None)
+    Args:
+        tile_x_count (int): number of tile columns of the slide
+        tile_y_count (int): number of tile rows of the slide
+        score_grids (dict[str, np.ndarray]): (rows, columns) score of every tile by
+            score name, see register_tile_scorer
+        filter (dict[str, float]): minimum score by column name, filters on other
+            columns are not pushed down
+        annotation_polygons (list): optional list of shapely Polygon objects
+        tile_size (int): full resolution tile size, required with annotation_polygons
 
-    return regional_label_results
+    Returns:
+        np.ndarray: (n, 2) array of x, y tile addresses, ordered by x then y like
+            itertools.product
+    """
+    # indexed [x, y], so that the nonzero addresses are ordered by x then y
+    candidates = np.zeros((tile_x_count, tile_y_count), dtype=bool)
+    candidates[1:-1, 1:-1] = True
 
-### MAIN ENTRY METHOD -> pretile
-def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path: str,
-        params: dict, image_id: str) -> dict:
-    """preform tiling operations and score tiles 
+    for score_name, score_grid in score_grids.items():
+        if score_grid.shape[1] < tile_x_count - 1 or score_grid.shape[0] < tile_y_count - 1:
+            raise ValueError(f"The {score_grid.shape[1]}x{score_grid.shape[0]} {score_name} grid does not cover "
+                             f"the {tile_x_count}x{tile_y_count} tile raster")
 
-    Generate tiles and scores. to_mag_scale_factor tells us how much to scale to get from
-    full resolution to desired magnification. to_thumbnail_scale_factor tells us how much to 
-    scale to get from desired magnification to the desired thumbnail downscale, relative
-    to the requested mag. The tile size is defined at the requested mag, so it's bigger at 
-    full resolution and smaller for the thumbnail to_mag_scale_factor and to_thumbnail_scale_factor
-    both need to be event integers, i.e. the scale factors are multiples 
-    of the the scanned magnficiation
+    for column, threshold in (filter or {}).items():
+        if column not in score_grids: continue
+        passed = np.zeros_like(candidates)
+        passed[:-1, :-1] = score_grids[column].T[:tile_x_count - 1, :tile_y_count - 1] >= threshold
+        candidates &= passed
+
+    if annotation_polygons is not None:
+        in_bounding_box = np.zeros_like(candidates)
+        for minx, miny, maxx, maxy in shapely.bounds(np.asarray(annotation_polygons, dtype=object)).reshape(-1, 4):
+            in_bounding_box[max(int(minx // tile_size), 0):max(int(maxx // tile_size) + 1, 0),
+                            max(int(miny // tile_size), 0):max(int(maxy // tile_size) + 1, 0)] = True
+        candidates &= in_bounding_box
+
+    return np.argwhere(candidates)
+
+
+def score_tiles(slide_file_path: str, annotation_table_path: str, params: dict,
+        image_id: str) -> Tuple[pd.DataFrame, dict]:
+    """score and filter the tiles of a slide
+
+    Scores every tile of a slide on a thumbnail, optionally labels tiles with regional
+    annotations, and filters them, as the first step of pretile_scoring.
 
     Args:
         slide_file_path (str): input whole slide file path
-        output_dir (str): directory to save files
         annotation_table_path (str): path to annotation table
         params (dict): parameter dict consisting of tile_size, magnification,
-            project_id, label_set, filter and scale factor
-        image_id (str): input image id 
+            project_id, label_set, filter, scale factor and optionally
+            regional_label_mode, polygon or raster, see get_rasterized_regional_labels,
+            regional_label_cells_per_tile and thumbnail_cache_dir, see get_thumbnail_images
+        image_id (str): input image id
 
     Returns:
-        dict: a dictionary of properties specifying parameters used to generate tiles
-            and save output files
+        Tuple[pd.DataFrame, dict]: tiles to extract indexed by address, and the tiling
+            properties of the slide
     """
 
     requested_tile_size       = params.get("tile_size")
@@ -380,6 +818,9 @@ def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path
     # optional arguments related to slideviewer annotations
     project_id               = params.get("project_id", None)
     labelset                  = params.get("labelset", None)
+    regional_label_mode       = params.get("regional_label_mode", "polygon")
+    if regional_label_mode not in ("polygon", "raster"):
+        raise ValueError(f"Expected regional_label_mode polygon or raster but got {regional_label_mode}")
     filter                    = params.get("filter")
 
     logger.info("Processing slide %s", slide_file_path)
@@ -403,8 +844,9 @@ def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path
     logger.info("Requested tile size=%s, tile size at full magnficiation=%s, tile size at thumbnail=%s", requested_tile_size, full_resolution_tile_size, thumbnail_tile_size)
 
     # Create thumbnail image for scoring
-    rbg_thumbnail  = get_downscaled_thumbnail(slide, to_thumbnail_scale_factor)
-    otsu_thumbnail = make_otsu(rbg_thumbnail)
+    rbg_thumbnail, gray_thumbnail, otsu_threshold = get_thumbnail_images(slide_file_path, slide, to_thumbnail_scale_factor, params)
+    with stage("otsu"):
+        otsu_thumbnail = (gray_thumbnail < otsu_threshold).astype(float)
 
     # get DeepZoomGenerator, level
     full_generator, full_level = get_full_resolution_generator(slide, tile_size=full_resolution_tile_size)
@@ -412,18 +854,8 @@ def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path
     tile_x_count, tile_y_count = full_generator.level_tiles[full_level]
     logger.info("tiles x %s, tiles y %s", tile_x_count, tile_y_count)
 
-    # populate address, coordinates
-    address_raster = [{"address": coord_to_address(address, requested_magnification), "coordinates": address}
-                      for address in itertools.product(range(1, tile_x_count-1), range(1, tile_y_count-1))]
-    logger.info("Number of tiles in raster: %s", len(address_raster))
-
-    df = pd.DataFrame(address_raster).set_index("address")
-
-    # TODO custom scoring
-    df.loc[:, "otsu_score"  ] = get_otsu_scores   (df['coordinates'], otsu_thumbnail, thumbnail_tile_size)
-    df.loc[:, "purple_score"] = get_purple_scores (df['coordinates'], rbg_thumbnail,  thumbnail_tile_size)
-
     # get pathology annotations for slide only if valid parameters
+    annotation_polygons = None
     if project_id != None and project_id != "" and labelset != None and labelset != "":
         # from get_pathology_annotations
         regional_annotation_table = read_table(annotation_table_path, columns=["geojson_path"],
@@ -438,68 +870,233 @@ def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path
                 annotation_geojson = json.loads(json.load(geojson_file))
 
             annotation_polygons, annotation_labels = build_shapely_polygons_from_geojson(annotation_geojson)
-            df.loc[:, "regional_label"] = get_regional_labels (df['coordinates'], annotation_polygons, annotation_labels, full_generator, full_level)
 
-    fp = open(f"{output_dir}/tiles.slice.pil",'wb')
-    offset = 0
-    counter = 0
+    # score every tile with every registered scorer, see register_tile_scorer
+    with stage("scoring"):
+        scoring_thumbnails = {"rgb": rbg_thumbnail, "otsu": otsu_thumbnail}
+        score_grids = {score_name: scorer(get_tile_block_view(scoring_thumbnails[source], thumbnail_tile_size))
+                       for score_name, (scorer, source) in tile_scorers.items()}
+
+        # only populate tiles that can pass the score filters and get a regional label
+        candidate_raster = get_candidate_raster(tile_x_count, tile_y_count, score_grids, filter,
+                                                annotation_polygons, full_resolution_tile_size)
+        logger.info("Number of tiles in raster: %s, candidate tiles: %s",
+                    max(tile_x_count - 2, 0) * max(tile_y_count - 2, 0), len(candidate_raster))
+
+        # populate address, coordinates, scores
+        tile_x, tile_y = candidate_raster[:, 0], candidate_raster[:, 1]
+        coordinates = list(zip(tile_x.tolist(), tile_y.tolist()))
+        df = pd.DataFrame({"address": [coord_to_address(address, requested_magnification) for address in coordinates],
+                           "coordinates": pd.Series(coordinates, dtype=object)}).set_index("address")
+        for score_name, score_grid in score_grids.items():
+            df.loc[:, score_name] = score_grid[tile_y, tile_x]
+
+    if annotation_polygons is not None:
+        with stage("labeling"):
+            if regional_label_mode == "raster":
+                df_regional_labels = get_rasterized_regional_labels(df['coordinates'], annotation_polygons, annotation_labels,
+                                                                    full_resolution_tile_size, slide.dimensions,
+                                                                    params.get("regional_label_cells_per_tile", thumbnail_tile_size))
+                df = df.assign(**{column: df_regional_labels[column].values for column in df_regional_labels.columns})
+            else:
+                df.loc[:, "regional_label"] = get_regional_labels (df['coordinates'], annotation_polygons, annotation_labels,
+                                                                   full_resolution_tile_size, slide.dimensions)
 
     # filter tiles based on user provided criteria
-    # This line isn't neccessary if we don't do inplace operations on df_tiles_to_process
     df_tiles_to_process = df
-   
+
     if filter is not None:
         for column, threshold in filter.items():
             df_tiles_to_process = df_tiles_to_process[df_tiles_to_process[column] >= threshold]
 
-    for index, row in df_tiles_to_process.iterrows():
-        counter += 1
-        if counter % 10000 == 0: logger.info( "Proccessing tiles [%s,%s]", counter, len(df_tiles_to_process))
-
-        img_pil     = full_generator.get_tile(full_level, address_to_coord(index)).resize((requested_tile_size,requested_tile_size))
-        img_bytes   = img_pil.tobytes()
-
-        fp.write( img_bytes )
-
-        df_tiles_to_process.loc[index, "tile_image_offset"]   = int(offset)
-        df_tiles_to_process.loc[index, "tile_image_length"]   = int(len(img_bytes))
-        df_tiles_to_process.loc[index, "tile_image_size_xy"]  = int(img_pil.size[0])
-        df_tiles_to_process.loc[index, "tile_image_mode"]     = img_pil.mode
-
-        offset += len(img_bytes)
-
-    fp.close()
+    # drop tiles with missing scores or labels before extracting them
+    df_tiles_to_process = df_tiles_to_process.dropna()
 
-    # drop null columns
-    df_tiles_to_process.dropna() \
-        .to_csv(f"{output_dir}/address.slice.csv")
-
-    properties = {
-        "data": f"{output_dir}/tiles.slice.pil",
-        "aux" : f"{output_dir}/address.slice.csv",
-        "tiles": len(df_tiles_to_process.dropna()),
+    tiling = {
         "tile_magnification": requested_magnification,
         "full_resolution_magnification": requested_magnification * to_mag_scale_factor,
         "tile_size": requested_tile_size,
         "full_resolution_tile_size": full_resolution_tile_size,
         "image_filename": Path(slide_file_path).name,
         "available_labels": list(df.columns),
-        "pil_image_bytes_mode": img_pil.mode,
-        "pil_image_bytes_size": img_pil.size[0],
-        "pil_image_bytes_length": len(img_bytes)
     }
 
+    return df_tiles_to_process, tiling
+
+
+def write_tile_index(tile_store: TileStoreWriter, df_tiles: pd.DataFrame, df_tile_images: pd.DataFrame) -> pd.DataFrame:
+    """save the index of a written tile store
+
+    Args:
+        tile_store (TileStoreWriter): tile store the tiles were written to
+        df_tiles (pd.DataFrame): scored tiles indexed by address, see score_tiles
+        df_tile_images (pd.DataFrame): tile image columns, see TileStoreWriter.write_tiles
+
+    Returns:
+        pd.DataFrame: the saved index
+    """
+    # single columnar assignment of the tile image properties
+    df_tiles = df_tiles.assign(**{column: df_tile_images[column].values for column in df_tile_images.columns})
+
+    # typed x and y columns instead of coordinates, see to_tile_table
+    df_tile_index = to_tile_table(df_tiles)
+    tile_store.write_index(df_tile_index)
+    return df_tile_index
+
+
+def get_tile_store_properties(tile_store: TileStoreWriter, tiling: dict) -> dict:
+    """properties of a written tile store, see pretile_scoring"""
+    return {
+        "data": tile_store.data_path,
+        "aux" : tile_store.index_path,
+        "tiles": tile_store.n_written,
+        **tiling,
+        "pil_image_bytes_mode": tile_store.mode,
+        "pil_image_bytes_size": tiling["tile_size"],
+        "pil_image_bytes_length": tile_store.tile_length,
+        "tile_encoding": tile_store.encoding
+    }
+
+
+# parameters that change how tiles are generated, not which tiles are generated
+EXECUTION_PARAMS = ("num_workers", "tile_workers", "checkpoint_interval", "thumbnail_cache_dir", "thumbnail_cache_size_mb", "profile")
+
+def get_tiling_params_hash(slide_file_path: str, params: dict, image_id: str) -> str:
+    """hash of the slide and the parameters that determine the tiles of a tile store
+
+    Args:
+        slide_file_path (str): input whole slide file path
+        params (dict): tiling parameters, see pretile_scoring
+        image_id (str): input image id
+
+    Returns:
+        str: sha256 hex digest
+    """
+    tiling_params = {
+        "slide": Path(slide_file_path).name,
+        "slide_size": os.path.getsize(slide_file_path),
+        "image_id": image_id,
+        "params": {key: value for key, value in params.items() if key not in EXECUTION_PARAMS},
+    }
+    return hashlib.sha256(json.dumps(tiling_params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_completed_tile_store_properties(output_dir: str, params_hash: str) -> Union[dict, None]:
+    """properties of a complete tile store in output_dir, generated with the same parameters
+
+    Args:
+        output_dir (str): tile store directory, with the metadata.json of a previous job
+        params_hash (str): tiling parameters hash, see get_tiling_params_hash
+
+    Returns:
+        dict: the saved properties, or None if the tile store has to be generated
+    """
+    metadata_path = os.path.join(output_dir, "metadata.json")
+    if not os.path.exists(metadata_path):
+        return None
+
+    with open(metadata_path) as fp:
+        properties = json.load(fp)
+
+    if properties.get("params_hash") != params_hash or not os.path.exists(properties.get("data", "")) \
+            or not os.path.exists(properties.get("aux", "")):
+        return None
+    return properties
+
+
+def add_timings(properties: dict, timer: StageTimer, output_dir: str, profile: Union[str, None]) -> dict:
+    """add the stage timings of a pipeline run, and the path of its profile if any, to its properties
+
+    Args:
+        properties (dict): properties of the run outputs
+        timer (StageTimer): timer of the run, see profile_stages
+        output_dir (str): directory the profile is saved to
+        profile (str): profile format of the run, or None
+
+    Returns:
+        dict: the properties with timings, seconds and calls by stage, and profile
+    """
+    properties["timings"] = timer.to_dict()
+    if profile is not None:
+        properties["profile"] = get_profile_path(output_dir, profile)
+    return properties
+
+
+### MAIN ENTRY METHOD -> pretile
+def pretile_scoring(slide_file_path: str, output_dir: str, annotation_table_path: str,
+        params: dict, image_id: str) -> dict:
+    """preform tiling operations and score tiles 
+
+    Generate tiles and scores. to_mag_scale_factor tells us how much to scale to get from
+    full resolution to desired magnification. to_thumbnail_scale_factor tells us how much to 
+    scale to get from desired magnification to the desired thumbnail downscale, relative
+    to the requested mag. The tile size is defined at the requested mag, so it's bigger at 
+    full resolution and smaller for the thumbnail to_mag_scale_factor and to_thumbnail_scale_factor
+    both need to be event integers, i.e. the scale factors are multiples 
+    of the the scanned magnficiation. Tiles are read from the pyramid level closest
+    to the requested magnification, see iter_tile_bytes
+
+    The tile store is checkpointed every checkpoint_interval tiles, and an interrupted
+    job resumes from its checkpoint. A slide already tiled in output_dir with the same
+    parameters, according to its metadata.json, is skipped.
+
+    Args:
+        slide_file_path (str): input whole slide file path
+        output_dir (str): directory to save files
+        annotation_table_path (str): path to annotation table
+        params (dict): parameter dict consisting of tile_size, magnification,
+            project_id, label_set, filter, scale factor and optionally num_workers,
+            tile_encoding (raw, jpeg, webp or png), tile_encoding_quality,
+            checkpoint_interval (10000 tiles by default, 0 to disable checkpoints)
+            and profile (chrome or pstats, see profile_stages)
+        image_id (str): input image id 
+
+    Returns:
+        dict: a dictionary of properties specifying parameters used to generate tiles
+            and save output files
+    """
+
+    num_workers               = params.get("num_workers", 1)
+    tile_encoding             = params.get("tile_encoding", "raw")
+    tile_encoding_quality     = params.get("tile_encoding_quality", 90)
+    checkpoint_interval       = params.get("checkpoint_interval", 10000)
+
+    params_hash = get_tiling_params_hash(slide_file_path, params, image_id)
+    properties = get_completed_tile_store_properties(output_dir, params_hash)
+    if properties is not None:
+        logger.info("Tiles of %s are already saved at %s, skipping", slide_file_path, output_dir)
+        return properties
+
+    with profile_stages(output_dir, params.get("profile")) as timer:
+        df_tiles_to_process, tiling = score_tiles(slide_file_path, annotation_table_path, params, image_id)
+
+        # resumes after the tiles committed by an interrupted job, if any
+        tile_store = TileStoreWriter(output_dir, len(df_tiles_to_process), tiling["tile_size"],
+                                     encoding=tile_encoding, quality=tile_encoding_quality,
+                                     checkpoint_interval=checkpoint_interval, fingerprint=params_hash)
+
+        logger.info("Extracting tiles with %s worker(s)", num_workers)
+        tile_iterator = iter_tile_bytes(slide_file_path, [address_to_coord(index) for index in df_tiles_to_process.index[tile_store.n_written:]],
+                                        tiling["full_resolution_tile_size"], tiling["tile_size"], num_workers=num_workers)
+        df_tile_images = tile_store.write_tiles(tile_iterator)
+
+        write_tile_index(tile_store, df_tiles_to_process, df_tile_images)
+
+    properties = get_tile_store_properties(tile_store, tiling)
+    properties["params_hash"] = params_hash
+    add_timings(properties, timer, output_dir, params.get("profile"))
+
     logger.info ("Saved tile scores and images at %s", output_dir)
 
     return properties
 
 
 ### MAIN ENTRY METHOD -> pretile
-def run_model(pil_file_path: str, csv_file_path: str, output_dir: str, params: dict) -> dict:
-    """runs a tile classifier model on a tile data frame/csv
+def run_model(tile_store_path: str, output_dir: str, params: dict) -> dict:
+    """runs a tile classifier model on a tile store and its tile table index
     
     Loads a PyTorch model and runs inference on a set of tiles in an input dataframe. 
-    The results are saved to an output csv. 
+    The results are saved to an output Parquet tile table, see write_tile_table. 
 
     to_mag_scale_factor tells us how much to scale to get from full resolution to
     desired magnification. to_thumbnail_scale_factor tells us how much to scale to get
@@ -510,94 +1107,213 @@ def run_model(pil_file_path: str, csv_file_path: str, output_dir: str, params: d
     magnficiation
 
     Args:
-        pil_file_path (str): file path to the input whole slide 
-        csv_file_path (str): input tile csv/dataframe 
+        tile_store_path (str): directory of the input tile store, see TileStoreReader
         output_dir (str): destination to save inference results to 
-        params (dict): configuration dictionary consisting of model_package, which
-            properties of the tile classifier model 
+        params (dict): configuration dictionary consisting of model_package and model,
+            the properties of the tile classifier model, or model_artifact, an exported
+            classifier, see export_classifier, and optionally device (cpu, cuda or
+            auto), batch_size, num_workers, num_threads, intra_op_threads, inter_op_threads,
+            channels_last and bfloat16, see luna_pathology.common.inference, and profile,
+            see profile_stages
 
     Returns:
         properties (dict): a properties dictionary with return values 
         
     """ 
-    model_package             = params.get("model_package")
+    from luna_pathology.common.inference import get_device, set_cpu_threads, get_tile_data_loader, predict_tiles
 
-    # load csv
-    df_tiles_to_process = pd.read_csv(csv_file_path)
+    device                    = get_device(params.get("device", "auto"))
+    batch_size                = params.get("batch_size", 64)
+    num_workers               = params.get("num_workers", 0)
+    channels_last             = params.get("channels_last", False)
+    bfloat16                  = params.get("bfloat16", False)
 
-    logger.info(f"BUILDING MODEL FROM {model_package}..")
-    
-    tile_model = importlib.import_module(model_package)
-    classifier = tile_model.get_classifier ( **params['model'] )
-    transform  = tile_model.get_transform ()
+    if device.type == "cpu":
+        set_cpu_threads(params.get("intra_op_threads", None), params.get("inter_op_threads", None))
 
-    classifier.eval()
-    classifier.cuda()
+    with profile_stages(output_dir, params.get("profile")) as timer:
+        # load tile store, encoded tiles are decoded a batch at a time with a thread pool
+        tile_store = TileStoreReader(tile_store_path, num_threads=params.get("num_threads", None))
 
-    logger.info( classifier )
+        classifier, transform = load_tile_classifier(params, device)
 
-    logger.info("RUNNING MODEL...")
+        logger.info("RUNNING MODEL ON %s, batch size=%s, workers=%s, channels_last=%s, bfloat16=%s...",
+                    device, batch_size, num_workers, channels_last, bfloat16)
 
-    counter = 0
-    model_scores = []
-    tumor_score  = []
-    label_score = []
+        data_loader = get_tile_data_loader(tile_store, transform, device, batch_size=batch_size, num_workers=num_workers)
+        predictions = predict_tiles(classifier, data_loader, device, channels_last=channels_last, bfloat16=bfloat16)
 
-    fp = open(pil_file_path, "rb")
+        properties = save_tile_predictions(tile_store.index.reset_index(), predictions, output_dir, Path(tile_store.data_path).name)
 
-    with torch.no_grad():
+    return add_timings(properties, timer, output_dir, params.get("profile"))
 
-        for index, row in df_tiles_to_process.iterrows():
-            counter += 1
-            if counter % 1000 == 0: logger.info( "Proccessing tiles [%s,%s]", counter, len(df_tiles_to_process))
 
-            # TODO load tiles from pil
-            fp.seek(int (row.tile_image_offset))
-            img = Image.frombytes(row.tile_image_mode,
-                                  (int (row.tile_image_size_xy), int (row.tile_image_size_xy)),
-                                  fp.read(int (row.tile_image_length)))
+def load_tile_classifier(params: dict, device: "torch.device") -> Tuple["torch.nn.Module", Callable]:
+    """load the tile classifier of run_model parameters onto a device
 
-            output = classifier(transform(img).unsqueeze(0).cuda())
-            scores = output.exp() / output.exp().sum()
+    Args:
+        params (dict): run_model parameters, model_package and model, or model_artifact,
+            and optionally channels_last
+        device (torch.device): inference device
 
-            model_scores.append( 'Label-' + str( scores.argmax(1).item()) )
-            tumor_score.append( scores.flatten()[0].item() )
-            label_score.append( scores.max().item() )
-            
-    
-    df_tiles_to_process.loc[:, "model_score"] =  model_scores
-    df_tiles_to_process.loc[:, "tumor_score"] =  tumor_score
-    df_tiles_to_process.loc[:, "label_score"] =  label_score
+    Returns:
+        Tuple[torch.nn.Module, Callable]: classifier in eval mode and its transform
+    """
+    from luna_pathology.common.inference import prepare_classifier
+    from luna_pathology.common.model_export import load_classifier_artifact
+
+    model_package             = params.get("model_package")
+    model_artifact            = params.get("model_artifact", None)
+
+    if model_artifact is not None:
+        # exported TorchScript classifier, the model package only provides the transform
+        logger.info(f"LOADING MODEL FROM {model_artifact}..")
+        classifier, export_metadata = load_classifier_artifact(model_artifact)
+        model_package = model_package or export_metadata["model_package"]
+        if export_metadata["quantization"] != "none" and device.type != "cpu":
+            raise ValueError(f"Quantized model {model_artifact} only runs on cpu, not on {device}")
+        transform  = importlib.import_module(model_package).get_transform ()
+    else:
+        logger.info(f"BUILDING MODEL FROM {model_package}..")
+
+        tile_model = importlib.import_module(model_package)
+        classifier = tile_model.get_classifier ( **params['model'] )
+        transform  = tile_model.get_transform ()
+
+    classifier = prepare_classifier(classifier, device, channels_last=params.get("channels_last", False))
+
+    logger.info( classifier )
+
+    return classifier, transform
 
-    logger.info(df_tiles_to_process)
 
-    output_file = os.path.join(output_dir, "tile_scores_and_labels_pytorch_inference.csv")
-    df_tiles_to_process.to_csv(output_file)
+def save_tile_predictions(df_tiles: pd.DataFrame, predictions: Dict[str, np.ndarray], output_dir: str,
+        image_filename: str) -> dict:
+    """save tile classifier predictions to the inference tile table
+
+    Args:
+        df_tiles (pd.DataFrame): tile table, row i describing tile i of the predictions
+        predictions (dict): predictions, see predict_tiles
+        output_dir (str): destination to save inference results to
+        image_filename (str): file name of the tile images
+
+    Returns:
+        dict: a properties dictionary with return values, see run_model
+    """
+    df_tiles = df_tiles.assign(
+        model_score = np.char.add("Label-", predictions["label"].astype(str)),
+        tumor_score = predictions["tumor_score"],
+        label_score = predictions["label_score"])
+
+    logger.info(df_tiles)
+
+    output_file = os.path.join(output_dir, "tile_scores_and_labels_pytorch_inference.parquet")
+    write_tile_table(df_tiles.set_index("address"), output_file)
 
     logger.info ("Saved tile inference data at %s", output_file)
 
     properties = {
         "data": output_file,
-        "total_tiles": len(df_tiles_to_process),
-        "image_filename": Path(pil_file_path).name,
-        "available_labels": list(df_tiles_to_process.columns)
+        "total_tiles": len(df_tiles),
+        "image_filename": image_filename,
+        "available_labels": list(df_tiles.columns)
     }
 
-    return properties 
+    return properties
+
+
+### MAIN ENTRY METHOD -> pretile and run_model
+def run_tile_pipeline(slide_file_path: str, tile_output_dir: Union[str, None], output_dir: str,
+        annotation_table_path: str, params: dict, image_id: str) -> Tuple[Union[dict, None], dict]:
+    """stream tiles from tile extraction to the tile classifier
+
+    Fuses pretile_scoring and run_model. Tiles are scored and extracted as in
+    pretile_scoring, and fed through a bounded queue to the classifier, which scores
+    them in batches as in run_model, without reading the tiles back from disk. Tiles
+    are saved to a tile store only with persist_tiles, in which case both outputs are
+    the same as those of pretile_scoring and run_model. Otherwise the inference table has
+    no tile_image_* columns and its image_filename is the slide file name.
+
+    Args:
+        slide_file_path (str): input whole slide file path
+        tile_output_dir (str): directory to save the tile store to, with persist_tiles
+        output_dir (str): destination to save inference results to
+        annotation_table_path (str): path to annotation table
+        params (dict): pretile_scoring and run_model parameters, with optionally tile_workers,
+            the number of tile extraction processes, persist_tiles and queue_size, the number
+            of tiles waiting for the classifier
+        image_id (str): input image id
+
+    Returns:
+        Tuple[dict, dict]: properties of the tile store, or None if tiles are not
+            persisted, and properties of the inference results
+    """
+    from luna_pathology.common.inference import get_device, set_cpu_threads, predict_tiles, TileBatchQueue
+
+    tile_workers              = params.get("tile_workers", 1)
+    persist_tiles             = params.get("persist_tiles", False)
+    queue_size                = params.get("queue_size", 256)
+    device                    = get_device(params.get("device", "auto"))
+    batch_size                = params.get("batch_size", 64)
+    channels_last             = params.get("channels_last", False)
+    bfloat16                  = params.get("bfloat16", False)
+
+    if device.type == "cpu":
+        set_cpu_threads(params.get("intra_op_threads", None), params.get("inter_op_threads", None))
+
+    with profile_stages(output_dir, params.get("profile")) as timer:
+        df_tiles_to_process, tiling = score_tiles(slide_file_path, annotation_table_path, params, image_id)
+
+        classifier, transform = load_tile_classifier(params, device)
+
+        tile_store = TileStoreWriter(tile_output_dir, len(df_tiles_to_process), tiling["tile_size"],
+                                     encoding=params.get("tile_encoding", "raw"),
+                                     quality=params.get("tile_encoding_quality", 90)) if persist_tiles else None
+
+        logger.info("Streaming tiles from %s extraction worker(s) to the model on %s, batch size=%s, queue size=%s, persist tiles=%s",
+                    tile_workers, device, batch_size, queue_size, persist_tiles)
+        tile_iterator = iter_tile_bytes(slide_file_path, [address_to_coord(index) for index in df_tiles_to_process.index],
+                                        tiling["full_resolution_tile_size"], tiling["tile_size"], num_workers=tile_workers)
+        tile_batches = TileBatchQueue(tile_iterator, transform, batch_size=batch_size, queue_size=queue_size, tile_store=tile_store)
+        predictions = predict_tiles(classifier, tile_batches, device, channels_last=channels_last, bfloat16=bfloat16,
+                                    n_tiles=len(df_tiles_to_process))
+
+        if persist_tiles:
+            df_tile_index = write_tile_index(tile_store, df_tiles_to_process, tile_batches.df_tile_images)
+            tile_properties = get_tile_store_properties(tile_store, tiling)
+            tile_properties["params_hash"] = get_tiling_params_hash(slide_file_path, params, image_id)
+            image_filename = Path(tile_store.data_path).name
+        else:
+            df_tile_index = to_tile_table(df_tiles_to_process)
+            tile_properties = None
+            image_filename = tiling["image_filename"]
+
+        properties = save_tile_predictions(df_tile_index.reset_index(), predictions, output_dir, image_filename)
+
+    add_timings(properties, timer, output_dir, params.get("profile"))
+    if persist_tiles:
+        tile_properties["timings"] = properties["timings"]
+
+    return tile_properties, properties
 
 def create_tile_thumbnail_image(slide_file_path: str, scores_file_path: str, output_dir:
         str, params: dict)-> dict:
     """creates thumbnail images for score visualizations
     
     creates a thumbnail image for score visualizations (otsu, purple, model scores, etc.) and
-    saves the result to an output directory. 
+    saves the result to an output directory, along with a tile-grid raster of every score,
+    see save_score_rasters.
 
     Args:
         slide_file_path (str): file path of slide to visualize
-        scores_file_path (str): file path of score .csv file to visualize
+        scores_file_path (str): file path of score .parquet, or legacy .csv, file to visualize
         output_dir (str): destination to save thumbnail image to 
         params (dict): parmater dictionary consisting of tile_size, magnification,
-            and scale_factor
+            scale_factor and optionally thumbnail_cache_dir, see get_thumbnail_images,
+            fill_tiles, to fill the tiles instead of drawing their borders, and
+            score_raster_encoding, float16 (default), uint8 or None to skip the score
+            rasters, see luna_pathology.common.score_raster, and heatmap_dzi, to also
+            save a deep zoom heatmap of every score raster, see heatmap_pyramid
 
     Returns:
         dict: a properties dictionary with return values 
@@ -627,8 +1343,8 @@ def create_tile_thumbnail_image(slide_file_path: str, scores_file_path: str, out
     logger.info("Requested tile size=%s, tile size at full magnficiation=%s, tile size at thumbnail=%s", requested_tile_size, full_resolution_tile_size, thumbnail_tile_size)
 
     # Create thumbnail image for scoring
-    rbg_thumbnail  = get_downscaled_thumbnail(slide, to_thumbnail_scale_factor)
-    df_scores      = pd.read_csv(scores_file_path).set_index("address")
+    rbg_thumbnail, _, _ = get_thumbnail_images(slide_file_path, slide, to_thumbnail_scale_factor, params)
+    df_scores      = read_tile_table(scores_file_path)
 
     # only visualize tile scores that were able to be computed
     all_score_types = {"tumor_score", "model_score", "label_score", "purple_score", "otsu_score", "regional_label"}
@@ -637,28 +1353,109 @@ def create_tile_thumbnail_image(slide_file_path: str, scores_file_path: str, out
     for score_type_to_visualize in score_types_to_visualize:
         output_file = os.path.join(output_dir, "tile_scores_and_labels_visualization_{}.png".format(score_type_to_visualize))
 
-        thumbnail_overlayed = visualize_tiling_scores(df_scores, rbg_thumbnail, thumbnail_tile_size, score_type_to_visualize)
+        # every score type is painted on a copy of the same thumbnail
+        thumbnail_overlayed = visualize_tiling_scores(df_scores, rbg_thumbnail.copy(), thumbnail_tile_size,
+                                                      score_type_to_visualize, fill=params.get("fill_tiles", False))
         thumbnail_overlayed = Image.fromarray(thumbnail_overlayed)
         thumbnail_overlayed.save(output_file)
 
         logger.info ("Saved %s visualization at %s", score_type_to_visualize, output_file)
 
+    # score grids at tile resolution, one pixel per tile
+    score_raster_encoding = params.get("score_raster_encoding", "float16")
+    if score_raster_encoding is not None:
+        full_generator, full_level = get_full_resolution_generator(slide, tile_size=full_resolution_tile_size)
+        tile_x_count, tile_y_count = full_generator.level_tiles[full_level]
+        score_rasters = save_score_rasters(df_scores, sorted(score_types_to_visualize), output_dir, (tile_y_count, tile_x_count),
+                                           encoding=score_raster_encoding,
+                                           properties={"tile_size": requested_tile_size,
+                                                       "tile_magnification": requested_magnification,
+                                                       "full_resolution_tile_size": int(full_resolution_tile_size)})
+        logger.info ("Saved %s score rasters at %s", len(score_rasters), output_dir)
+
+    # deep zoom heatmaps down to the requested magnification, rendered from the score rasters
+    heatmap_dzis = {}
+    if params.get("heatmap_dzi", False) and score_raster_encoding is not None:
+        from luna_pathology.common.heatmap_pyramid import HeatmapDeepZoomGenerator
+
+        for score_type, score_raster_path in score_rasters.items():
+            generator = HeatmapDeepZoomGenerator.from_score_raster(slide_file_path, score_raster_path)
+            heatmap_dzis[score_type] = generator.write_dzi(
+                os.path.join(output_dir, f"tile_scores_heatmap_{score_type}.dzi"),
+                max_level=generator.level_count - 1 - int(np.log2(to_mag_scale_factor)))
+
     properties = {'data': output_dir}
+    if score_raster_encoding is not None:
+        properties['score_rasters'] = score_rasters
+    if heatmap_dzis:
+        properties['heatmap_dzis'] = heatmap_dzis
 
     return properties
 
 
+def get_score_lut() -> np.ndarray:
+    """get the 256 tile colors of the continuous palette, indexed by 256 * score
+
+    Returns:
+        np.ndarray: uint8 array with shape (256, 3), the colors of get_tile_color
+    """
+    palette, _ = get_palettes()
+    return (255 * palette(np.arange(palette.N))[:, :3]).astype(np.uint8)
+
+
+def get_tile_colors(scores: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """get the colors of a column of tile scores
+
+    Vectorized get_tile_color. Float scores in [0,1] are mapped through the 256 entry
+    palette lookup table, and categorical scores, e.g. labels, get the categorical
+    color of each unique value.
+
+    Args:
+        scores (pd.Series): float scores in [0,1] or string labels
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: uint8 colors with shape (n, 3), and a mask of
+            the scores with a valid color
+    """
+    colors = np.zeros((len(scores), 3), dtype=np.uint8)
+
+    if not pd.api.types.is_numeric_dtype(scores):
+        codes, categories = pd.factorize(scores)
+        valid = np.array([isinstance(category, str) for category in categories], dtype=bool)
+        category_colors = np.array([get_tile_color(category) if is_valid else (0, 0, 0)
+                                    for category, is_valid in zip(categories, valid)]).reshape(-1, 3)
+        mask = codes >= 0
+        mask[mask] = valid[codes[mask]]
+        colors[mask] = category_colors[codes[mask]].astype(np.uint8)
+    else:
+        values = scores.to_numpy(dtype=float, na_value=np.nan)
+        mask = (values >= 0.0) & (values <= 1.0)
+        lut = get_score_lut()
+        colors[mask] = lut[np.minimum((values[mask] * len(lut)).astype(int), len(lut) - 1)]
+
+    if not mask.all():
+        logger.warning("Skipping %s tiles with invalid %s scores", np.count_nonzero(~mask), scores.name)
+    return colors, mask
+
+
+# number of tiles whose borders are painted at once by visualize_tiling_scores
+VISUALIZE_CHUNK_TILES = 16384
+
 def visualize_tiling_scores(df:pd.DataFrame, thumbnail_img:np.ndarray,
-        tile_size:int, score_type_to_visualize:str) -> np.ndarray:
+        tile_size:int, score_type_to_visualize:str, fill:bool = False) -> np.ndarray:
     """visualize tile scores
     
-    draws colored boxes around tiles to indicate the value of the score 
+    draws colored boxes around tiles, or fills the tiles, to indicate the value of the
+    score. Borders are painted by indexing the thumbnail with the border pixels of a chunk
+    of tiles at once. Filled tiles are painted as a color grid with one pixel per tile,
+    upscaled to the thumbnail.
 
     Args:
         df (pd.DataFrame): input dataframe
-        thumbnail_img (np.ndarray): input tile 
+        thumbnail_img (np.ndarray): input tile, painted in place
         tile_size (int): tile width/length
         score_type_to_visualize (str): column name from data frame
+        fill (bool): fill the tiles instead of drawing their borders
     
     Returns:
         np.ndarray: new thumbnail image with boxes around tiles passing indicating the
@@ -666,25 +1463,44 @@ def visualize_tiling_scores(df:pd.DataFrame, thumbnail_img:np.ndarray,
     """
 
     assert isinstance(thumbnail_img, np.ndarray) and isinstance(tile_size, int)
-    thumbnail = array_to_slide(thumbnail_img)
-    generator, generator_level = get_full_resolution_generator(thumbnail, tile_size=tile_size)
 
     df_tiles_to_process = df[ (df["otsu_score"] > 0.5) &  (df["otsu_score"] > 0.1) ]
+    if 'regional_label' in df_tiles_to_process:
+        df_tiles_to_process = df_tiles_to_process[df_tiles_to_process['regional_label'].notna()]
+
+    colors, valid = get_tile_colors(df_tiles_to_process[score_type_to_visualize])
+    tile_x, tile_y = get_tile_grid_coordinates(df_tiles_to_process.index)
+    tile_x, tile_y, colors = tile_x[valid], tile_y[valid], colors[valid]
+    height, width = thumbnail_img.shape[:2]
+
+    if fill:
+        # tiles don't overlap, so each tile is one pixel of a grid of tiles
+        grid_shape = (-(-height // tile_size), -(-width // tile_size))
+        inside = (tile_y < grid_shape[0]) & (tile_x < grid_shape[1])
+        color_grid = np.zeros(grid_shape + (3,), dtype=np.uint8)
+        painted = np.zeros(grid_shape, dtype=bool)
+        color_grid[tile_y[inside], tile_x[inside]] = colors[inside]
+        painted[tile_y[inside], tile_x[inside]] = True
+
+        painted = painted.repeat(tile_size, axis=0).repeat(tile_size, axis=1)[:height, :width]
+        color_grid = color_grid.repeat(tile_size, axis=0).repeat(tile_size, axis=1)[:height, :width]
+        thumbnail_img[painted] = color_grid[painted]
+        return thumbnail_img
+
+    # the pixels just outside the tile, as skimage.draw.rectangle_perimeter
+    side = np.arange(-1, tile_size + 1)
+    edge = np.full(len(side), -1)
+    offset_rr = np.concatenate([edge, edge + tile_size + 1, side, side])
+    offset_cc = np.concatenate([side, side, edge, edge + tile_size + 1])
+
+    # tiles are painted in order, later tiles over the borders of earlier tiles
+    for start in range(0, len(colors), VISUALIZE_CHUNK_TILES):
+        end = start + VISUALIZE_CHUNK_TILES
+        rr = (tile_y[start:end, None] * tile_size + offset_rr[None, :]).ravel()
+        cc = (tile_x[start:end, None] * tile_size + offset_cc[None, :]).ravel()
+        pixel_colors = np.repeat(colors[start:end], len(offset_rr), axis=0)
+        inside = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+        thumbnail_img[rr[inside], cc[inside]] = pixel_colors[inside]
 
-    for index, row in df_tiles_to_process.iterrows():
-        address = address_to_coord(index)
-
-        if 'regional_label' in row and pd.isna(row.regional_label): continue
-
-        extent = generator.get_tile_dimensions(generator_level, address)
-        start = (address[1] * tile_size, address[0] * tile_size)  # flip because OpenSlide uses
-                                                                    # (column, row), but skimage
-                                                                    # uses (row, column)
-        rr, cc = rectangle_perimeter(start=start, extent=extent, shape=thumbnail_img.shape)
-        
-        # set color based on intensity of value instead of black border (1)
-        score = row[score_type_to_visualize]
-        thumbnail_img[rr, cc] = get_tile_color(score)
-    
     return thumbnail_img
 
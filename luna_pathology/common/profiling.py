@@ -0,0 +1,131 @@
+"""
+Per-stage timers for the tiling and inference pipelines
+
+Pipeline functions wrap their stages, e.g. thumbnail, read or forward, in stage(name).
+Stages are recorded by the active StageTimer, and are no-ops otherwise, so library
+functions can be timed without passing a timer around. The timer is shared by the
+threads of a process. Worker processes time their stages with their own timer and
+return its stages to be merged, see iter_tile_bytes.
+
+profile_stages activates a timer for a pipeline run, and optionally saves a Chrome
+trace of every timed stage, viewable in chrome://tracing or Perfetto, or a cProfile
+pstats file of the whole run.
+"""
+import os, json, logging, threading, time, cProfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, Union
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FORMATS = ("chrome", "pstats")
+
+_active_timers = []
+
+
+class StageTimer:
+    """Accumulated wall time and number of calls of named stages
+
+    Args:
+        trace (bool): also keep every timed stage as a Chrome trace event
+    """
+    def __init__(self, trace: bool = False):
+        self.stages = {}
+        self.events = [] if trace else None
+        self.origin = time.perf_counter()
+        self._lock  = threading.Lock()
+
+    def add(self, name: str, seconds: float, calls: int = 1, start: Union[float, None] = None):
+        """Record calls of a stage that took seconds in total, starting at perf_counter start"""
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"]   += calls
+            if self.events is not None and start is not None:
+                self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                    "ts": (start - self.origin) * 1e6, "dur": seconds * 1e6})
+
+    def merge(self, stages: Dict[str, dict]):
+        """Add the stages of another timer, e.g. of a worker process"""
+        for name, stage in stages.items():
+            self.add(name, stage["seconds"], stage["calls"])
+
+    def to_dict(self) -> Dict[str, dict]:
+        """Seconds and calls by stage, in the order the stages first ran"""
+        with self._lock:
+            return {name: {"seconds": round(stage["seconds"], 6), "calls": stage["calls"]}
+                    for name, stage in self.stages.items()}
+
+    @contextmanager
+    def activate(self) -> Iterator["StageTimer"]:
+        """Record the stages of this process in this timer"""
+        _active_timers.append(self)
+        try:
+            yield self
+        finally:
+            _active_timers.remove(self)
+
+    def save_chrome_trace(self, path: str):
+        """Save the timed stages as a Chrome trace"""
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": self.events or [], "displayTimeUnit": "ms"}, fp)
+
+
+def get_active_timer() -> Union[StageTimer, None]:
+    """The timer recording stages, if any"""
+    return _active_timers[-1] if _active_timers else None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage with the active timer, if any"""
+    timer = get_active_timer()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start, start=start)
+
+
+def get_profile_path(output_dir: str, profile: Union[str, None]) -> Union[str, None]:
+    """Path of the profile saved by profile_stages, if any"""
+    if profile == "chrome":
+        return os.path.join(output_dir, "profile.trace.json")
+    if profile == "pstats":
+        return os.path.join(output_dir, "profile.pstats")
+    return None
+
+
+@contextmanager
+def profile_stages(output_dir: str, profile: Union[str, None] = None) -> Iterator[StageTimer]:
+    """Time the stages of a pipeline run, and optionally save a profile to output_dir
+
+    Args:
+        output_dir (str): directory to save the profile to
+        profile (str): optional profile format, chrome for a profile.trace.json Chrome
+            trace of the stages, or pstats for a profile.pstats cProfile file
+
+    Returns:
+        Iterator[StageTimer]: the active timer of the run
+    """
+    if profile is not None and profile not in PROFILE_FORMATS:
+        raise ValueError(f"Expected profile in {PROFILE_FORMATS} but got {profile}")
+
+    timer = StageTimer(trace=profile == "chrome")
+    profiler = cProfile.Profile() if profile == "pstats" else None
+
+    with timer.activate():
+        if profiler is not None: profiler.enable()
+        try:
+            yield timer
+        finally:
+            if profiler is not None: profiler.disable()
+
+    if profile == "chrome":
+        timer.save_chrome_trace(get_profile_path(output_dir, profile))
+    elif profile == "pstats":
+        profiler.dump_stats(get_profile_path(output_dir, profile))
+    logger.info("Stage timings: %s", timer.to_dict())
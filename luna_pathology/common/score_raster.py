@@ -0,0 +1,151 @@
+"""
+Tile-grid score rasters
+
+A score raster holds one score column of a tile table as a 2D array with one pixel per
+tile, the score of tile (x, y) at row y and column x, so a slide's whole score map loads
+in one read instead of re-parsing the tile table. Rasters are tiled, zlib compressed
+TIFFs, with a JSON image description recording how scores are encoded:
+
+- float16: scores as float16, NaN where there is no tile
+- uint8: scores linearly quantized to 0-254 over value_range, 255 where there is no tile
+- labels: categorical scores, e.g. regional labels, as uint8 indices into labels, 255
+  where there is no tile
+
+read_score_raster decodes a raster back to float32 scores or labels.
+"""
+import os, json
+from typing import Dict, Iterable, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import tifffile
+
+from luna_pathology.common.tile_table import get_tile_grid_coordinates
+
+SCORE_RASTER_ENCODINGS = ("float16", "uint8")
+SCORE_RASTER_NODATA = 255
+SCORE_RASTER_CHUNK_SIZE = 256
+
+
+def encode_score_grid(scores: pd.Series, tile_x: np.ndarray, tile_y: np.ndarray, grid_shape: Tuple[int, int],
+                      encoding: str = "float16") -> Tuple[np.ndarray, dict]:
+    """Rasterize a column of tile scores onto the tile grid
+
+    Args:
+        scores (pd.Series): float scores, or labels
+        tile_x (np.ndarray): tile x of every score
+        tile_y (np.ndarray): tile y of every score
+        grid_shape (Tuple[int, int]): number of tile rows and columns of the slide
+        encoding (str): float16 or uint8 encoding of float scores, labels are always
+            encoded as uint8 label indices
+
+    Returns:
+        Tuple[np.ndarray, dict]: the score grid and its encoding metadata
+    """
+    if encoding not in SCORE_RASTER_ENCODINGS:
+        raise ValueError(f"Expected encoding in {SCORE_RASTER_ENCODINGS} but got {encoding}")
+    if len(tile_x) and (tile_y.max() >= grid_shape[0] or tile_x.max() >= grid_shape[1]):
+        raise ValueError(f"Tiles of {scores.name} are outside of a {grid_shape} tile grid")
+
+    if not pd.api.types.is_numeric_dtype(scores):
+        codes, labels = pd.factorize(scores)
+        if len(labels) >= SCORE_RASTER_NODATA:
+            raise ValueError(f"Expected less than {SCORE_RASTER_NODATA} labels in {scores.name} but got {len(labels)}")
+        grid = np.full(grid_shape, SCORE_RASTER_NODATA, dtype=np.uint8)
+        grid[tile_y, tile_x] = np.where(codes >= 0, codes, SCORE_RASTER_NODATA)
+        return grid, {"encoding": "labels", "nodata": SCORE_RASTER_NODATA, "labels": [str(label) for label in labels]}
+
+    values = scores.to_numpy(dtype=np.float32, na_value=np.nan)
+    if encoding == "float16":
+        grid = np.full(grid_shape, np.nan, dtype=np.float16)
+        grid[tile_y, tile_x] = values
+        return grid, {"encoding": "float16"}
+
+    # quantize over [0, 1], or the range of the scores if wider
+    valid = ~np.isnan(values)
+    low  = float(min(0.0, values[valid].min())) if valid.any() else 0.0
+    high = float(max(1.0, values[valid].max())) if valid.any() else 1.0
+    quantized = np.full(len(values), SCORE_RASTER_NODATA, dtype=np.uint8)
+    quantized[valid] = np.round((values[valid] - low) / (high - low) * (SCORE_RASTER_NODATA - 1))
+    grid = np.full(grid_shape, SCORE_RASTER_NODATA, dtype=np.uint8)
+    grid[tile_y, tile_x] = quantized
+    return grid, {"encoding": "uint8", "nodata": SCORE_RASTER_NODATA, "value_range": [low, high]}
+
+
+def decode_score_grid(grid: np.ndarray, metadata: dict) -> np.ndarray:
+    """Decode a score grid to float32 scores, NaN where there is no tile, or labels, None where there is no tile
+
+    Args:
+        grid (np.ndarray): encoded score grid, see encode_score_grid
+        metadata (dict): encoding metadata of the grid
+
+    Returns:
+        np.ndarray: float32 scores or object array of labels
+    """
+    if metadata["encoding"] == "float16":
+        return grid.astype(np.float32)
+
+    nodata = grid == metadata["nodata"]
+    if metadata["encoding"] == "labels":
+        labels = np.array(metadata["labels"] + [None], dtype=object)
+        return labels[np.where(nodata, len(metadata["labels"]), grid)]
+
+    low, high = metadata["value_range"]
+    scores = low + grid.astype(np.float32) * np.float32((high - low) / (metadata["nodata"] - 1))
+    scores[nodata] = np.nan
+    return scores
+
+
+def write_score_raster(path: str, grid: np.ndarray, metadata: dict, chunk_size: int = SCORE_RASTER_CHUNK_SIZE):
+    """Write a score grid as a tiled, zlib compressed TIFF
+
+    Args:
+        path (str): output TIFF path
+        grid (np.ndarray): encoded score grid, see encode_score_grid
+        metadata (dict): metadata saved as JSON in the image description
+        chunk_size (int): TIFF tile width and height, a multiple of 16
+    """
+    tifffile.imwrite(path, grid, tile=(chunk_size, chunk_size), compression="zlib",
+                     description=json.dumps(metadata), metadata=None)
+
+
+def read_score_raster(path: str, decode: bool = True) -> Tuple[np.ndarray, dict]:
+    """Read a score raster
+
+    Args:
+        path (str): score raster TIFF path, see write_score_raster
+        decode (bool): decode the grid, see decode_score_grid
+
+    Returns:
+        Tuple[np.ndarray, dict]: the score grid and its metadata
+    """
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        grid, metadata = page.asarray(), json.loads(page.description)
+    return (decode_score_grid(grid, metadata) if decode else grid), metadata
+
+
+def save_score_rasters(df_scores: pd.DataFrame, score_columns: Iterable[str], output_dir: str,
+                       grid_shape: Tuple[int, int], encoding: str = "float16",
+                       properties: Union[dict, None] = None) -> Dict[str, str]:
+    """Save score rasters of the score columns of a tile table indexed by tile address
+
+    Args:
+        df_scores (pd.DataFrame): tile table indexed by tile address
+        score_columns (Iterable[str]): columns to save
+        output_dir (str): directory to save tile_scores_raster_<column>.tif files to
+        grid_shape (Tuple[int, int]): number of tile rows and columns of the slide
+        encoding (str): float16 or uint8 encoding of float scores
+        properties (dict): optional tiling properties, e.g. tile size, saved with every raster
+
+    Returns:
+        Dict[str, str]: raster path by column
+    """
+    tile_x, tile_y = get_tile_grid_coordinates(df_scores.index)
+
+    paths = {}
+    for column in score_columns:
+        grid, metadata = encode_score_grid(df_scores[column], tile_x, tile_y, grid_shape, encoding)
+        paths[column] = os.path.join(output_dir, f"tile_scores_raster_{column}.tif")
+        write_score_raster(paths[column], grid, {"column": column, **(properties or {}), **metadata})
+    return paths
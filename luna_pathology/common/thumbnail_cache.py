@@ -0,0 +1,134 @@
+"""
+On-disk cache of slide thumbnails
+
+Tiling and visualization jobs score and draw on a downscaled thumbnail of the slide,
+and the same slide is thumbnailed again for every tile size, job tag and visualization
+run. The cache keeps the RGB thumbnail, its grayscale image and Otsu threshold of a
+slide at a scale factor in one entry directory, shared by all jobs pointed at the same
+cache directory.
+
+Entries are content-addressed: the key hashes the slide file size and its first and
+last bytes with the scale factor and THUMBNAIL_VERSION, so a copied or re-registered
+slide hits the same entry while a rewritten one, or a thumbnail computed by an older
+algorithm, does not. Entries are evicted least recently used first once the cache grows
+over its size limit, and corrupt entries are evicted when read.
+"""
+import os, json, logging, hashlib, shutil, tempfile
+from typing import Callable, Dict, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bytes read from each end of the slide file for the cache key
+SLIDE_KEY_SAMPLE_BYTES = 1 << 20
+
+THUMBNAIL_CACHE_METADATA = "metadata.json"
+
+# version of the cached thumbnails, bump when get_downscaled_thumbnail or the cached
+# arrays change so that stale entries are not reused
+THUMBNAIL_VERSION = 2
+
+
+def get_slide_key(slide_file_path: str, scale_factor: int, version: int = THUMBNAIL_VERSION) -> str:
+    """content-addressed cache key of a slide thumbnail
+
+    Args:
+        slide_file_path (str): whole slide file path
+        scale_factor (int): thumbnail scale factor relative to full resolution
+        version (int): version of the thumbnail algorithm
+
+    Returns:
+        str: sha256 hex digest
+    """
+    slide_hash = hashlib.sha256()
+    size = os.path.getsize(slide_file_path)
+    slide_hash.update(f"{size}:{scale_factor}:v{version}".encode())
+
+    with open(slide_file_path, "rb") as fp:
+        slide_hash.update(fp.read(SLIDE_KEY_SAMPLE_BYTES))
+        fp.seek(max(size - SLIDE_KEY_SAMPLE_BYTES, 0))
+        slide_hash.update(fp.read(SLIDE_KEY_SAMPLE_BYTES))
+
+    return slide_hash.hexdigest()
+
+
+class ThumbnailCache:
+    """Size-bounded LRU cache of thumbnail arrays
+
+    Each entry is a directory of .npy arrays and a metadata.json file, written to a
+    temporary directory and renamed into place, so concurrent jobs never read a partial
+    entry. Reading an entry marks it as recently used.
+
+    Args:
+        cache_dir (str): cache directory, created if missing
+        max_bytes (int): total size of the entries kept after eviction
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 4 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Union[Tuple[Dict[str, np.ndarray], dict], None]:
+        """Arrays and metadata of an entry, or None on a cache miss
+
+        A corrupt entry, e.g. a truncated array, is evicted and counts as a miss.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            with open(os.path.join(entry_dir, THUMBNAIL_CACHE_METADATA)) as fp:
+                metadata = json.load(fp)
+            arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy")) for name in metadata["arrays"]}
+            os.utime(entry_dir)
+        except (OSError, ValueError, KeyError, EOFError) as err:
+            logger.warning("Evicting corrupt thumbnail cache entry %s: %s", entry_dir, err)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return arrays, metadata["metadata"]
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], metadata: dict):
+        """Save an entry, then evict least recently used entries over max_bytes"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+        with open(os.path.join(tmp_dir, THUMBNAIL_CACHE_METADATA), "w") as fp:
+            json.dump({"arrays": list(arrays), "metadata": metadata}, fp)
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # saved by a concurrent job
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Tuple[Dict[str, np.ndarray], dict]]) \
+            -> Tuple[Dict[str, np.ndarray], dict]:
+        """Arrays and metadata of an entry, computed and saved on a cache miss"""
+        entry = self.get(key)
+        if entry is not None:
+            logger.info("Thumbnail cache hit for %s", key)
+            return entry
+
+        logger.info("Thumbnail cache miss for %s", key)
+        arrays, metadata = compute()
+        self.put(key, arrays, metadata)
+        return arrays, metadata
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith(".tmp-"): continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes: break
+            logger.info("Evicting thumbnail cache entry %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
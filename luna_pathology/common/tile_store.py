@@ -0,0 +1,381 @@
+"""
+Tile store for the tiles of a whole slide
+
+A tile store keeps every tile of a slide in one fixed-stride uint8 array of shape
+(N, H, W, C), saved as a .npy file and opened with np.lib.format.open_memmap, next to
+a Parquet tile table index, see luna_pathology.common.tile_table, with one row per
+tile. Row i of the index describes tile i, so any
+tile or batch of tiles is a zero-copy slice of the memory-mapped array. The index
+describes the store in its schema metadata.
+
+Tiles can instead be stored encoded as JPEG, WebP or PNG, concatenated in a single
+data file with the offset and length of every tile in the index. Encoded tiles are
+decoded on read, batches of tiles with a thread pool.
+
+While tiles are written, the writer can checkpoint the committed length of the data
+file and the partial index to a tiles.slice.checkpoint.parquet file. A writer created
+over a matching checkpoint truncates the data file to the committed length and
+continues after the last committed tile, so an interrupted job does not start over.
+"""
+import os, json, logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+
+from luna_pathology.common.profiling import stage
+from luna_pathology.common.tile_table import to_tile_table, read_tile_table
+
+logger = logging.getLogger(__name__)
+
+TILE_STORE_DATA  = "tiles.slice.npy"
+TILE_STORE_INDEX = "tiles.slice.parquet"
+
+# legacy layout, concatenated PIL image bytes with a csv index
+LEGACY_TILE_DATA  = "tiles.slice.pil"
+LEGACY_TILE_INDEX = "address.slice.csv"
+
+# partial index of an unfinished tile store, see TileStoreWriter
+TILE_STORE_CHECKPOINT = "tiles.slice.checkpoint.parquet"
+
+# Parquet schema metadata key of the tile store description
+TILE_STORE_METADATA_KEY = b"luna_pathology.tile_store"
+TILE_STORE_CHECKPOINT_KEY = b"luna_pathology.tile_store_checkpoint"
+
+# PIL save arguments of the supported tile encodings, besides raw
+TILE_ENCODINGS = {
+    "jpeg": {"format": "JPEG"},
+    "webp": {"format": "WEBP", "lossless": True},
+    "png":  {"format": "PNG"},
+}
+
+
+class TileStoreWriter:
+    """Tile store writer
+
+    Streams tiles into a tile store. For raw tiles the .npy header is written up front,
+    so tiles are appended in order and the data file is a valid array once all tiles
+    are written. Encoded tiles are appended to a tiles.slice.<encoding> data file.
+
+    With a checkpoint_interval, the writer resumes from a checkpoint of the same store
+    and fingerprint, see n_written, and checkpoints every checkpoint_interval tiles.
+
+    Args:
+        output_dir (str): directory to save the tile store to
+        n_tiles (int): number of tiles that will be written
+        tile_size (int): width and height of the tiles
+        mode (str): PIL image mode of the tiles
+        encoding (str): raw, or one of the TILE_ENCODINGS, e.g. jpeg
+        quality (int): JPEG quality of jpeg encoded tiles
+        checkpoint_interval (int): optional number of tiles between checkpoints
+        fingerprint (str): identifies the tiles of the store, e.g. a hash of the tiling
+            parameters, a checkpoint with another fingerprint is discarded
+    """
+    def __init__(self, output_dir: str, n_tiles: int, tile_size: int, mode: str = "RGB",
+            encoding: str = "raw", quality: int = 90, checkpoint_interval: Union[int, None] = None,
+            fingerprint: str = ""):
+        if encoding != "raw" and encoding not in TILE_ENCODINGS:
+            raise ValueError(f"Expected tile encoding raw or one of {list(TILE_ENCODINGS)} but got {encoding}")
+
+        self.data_filename = TILE_STORE_DATA if encoding == "raw" else f"tiles.slice.{encoding}"
+        self.data_path   = os.path.join(output_dir, self.data_filename)
+        self.index_path  = os.path.join(output_dir, TILE_STORE_INDEX)
+        self.checkpoint_path = os.path.join(output_dir, TILE_STORE_CHECKPOINT)
+        self.checkpoint_interval = checkpoint_interval
+        self.fingerprint = fingerprint
+        self.mode        = mode
+        self.encoding    = encoding
+        self.quality     = quality
+        self.shape       = (n_tiles, tile_size, tile_size, Image.getmodebands(mode))
+        self.tile_length = int(np.prod(self.shape[1:]))
+        self.n_written   = 0
+        self._tile_image_offset = np.zeros(n_tiles, dtype=np.int64)
+        self._tile_image_length = np.zeros(n_tiles, dtype=np.int64)
+
+        if checkpoint_interval and self._resume():
+            logger.info("Resuming tile store %s after %s of %s tiles", self.data_path, self.n_written, n_tiles)
+            return
+
+        self._fp = open(self.data_path, "wb")
+        if encoding == "raw":
+            np.lib.format.write_array_header_1_0(self._fp, {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                "fortran_order": False,
+                "shape": self.shape,
+            })
+        self.header_length = self._fp.tell()
+
+    def _get_checkpoint_metadata(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "data": self.data_filename,
+            "shape": list(self.shape),
+            "mode": self.mode,
+            "encoding": self.encoding,
+            "quality": self.quality,
+        }
+
+    def _resume(self) -> bool:
+        """Continue from a matching checkpoint, truncating uncommitted tiles from the data file"""
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.data_path):
+            return False
+
+        table = pq.read_table(self.checkpoint_path)
+        checkpoint = json.loads(table.schema.metadata[TILE_STORE_CHECKPOINT_KEY])
+        if checkpoint["store"] != self._get_checkpoint_metadata() \
+                or os.path.getsize(self.data_path) < checkpoint["data_length"]:
+            logger.info("Discarding tile store checkpoint %s", self.checkpoint_path)
+            return False
+
+        self.n_written     = checkpoint["n_written"]
+        self.header_length = checkpoint["header_length"]
+        self._tile_image_offset[:self.n_written] = table.column("tile_image_offset").to_numpy()
+        self._tile_image_length[:self.n_written] = table.column("tile_image_length").to_numpy()
+
+        self._fp = open(self.data_path, "r+b")
+        self._fp.truncate(checkpoint["data_length"])
+        self._fp.seek(checkpoint["data_length"])
+        return True
+
+    def checkpoint(self):
+        """Commit the written tiles, and save the committed data length and partial index"""
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+        table = pa.table({
+            "tile_image_offset": self._tile_image_offset[:self.n_written],
+            "tile_image_length": self._tile_image_length[:self.n_written],
+        })
+        checkpoint = {
+            "store": self._get_checkpoint_metadata(),
+            "n_written": self.n_written,
+            "header_length": self.header_length,
+            "data_length": self._fp.tell(),
+        }
+        table = table.replace_schema_metadata({TILE_STORE_CHECKPOINT_KEY: json.dumps(checkpoint).encode()})
+
+        # replaced atomically, so an interrupted checkpoint leaves the previous one
+        pq.write_table(table, self.checkpoint_path + ".tmp")
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def encode(self, img_bytes: bytes) -> bytes:
+        """Encode raw image bytes with the encoding of the store"""
+        if self.encoding == "raw":
+            return img_bytes
+
+        save_args = dict(TILE_ENCODINGS[self.encoding])
+        if self.encoding == "jpeg":
+            save_args["quality"] = self.quality
+
+        buffer = BytesIO()
+        Image.frombytes(self.mode, self.shape[1:3][::-1], img_bytes).save(buffer, **save_args)
+        return buffer.getvalue()
+
+    def write(self, img_bytes: bytes, img_mode: str) -> Tuple[int, int]:
+        """Append a tile to the data file
+
+        Args:
+            img_bytes (bytes): raw image bytes, e.g. from PIL.Image.tobytes()
+            img_mode (str): PIL image mode of the tile
+
+        Returns:
+            Tuple[int, int]: byte offset and length of the stored tile in the data file
+        """
+        if img_mode != self.mode or len(img_bytes) != self.tile_length:
+            raise ValueError(f"Expected {self.mode} tiles of {self.tile_length} bytes but got "
+                             f"a {img_mode} tile of {len(img_bytes)} bytes")
+        if self.n_written == self.shape[0]:
+            raise ValueError(f"Tile store is full with {self.n_written} tiles")
+
+        offset = self._fp.tell()
+        tile_bytes = self.encode(img_bytes)
+        self._fp.write(tile_bytes)
+        self._tile_image_offset[self.n_written] = offset
+        self._tile_image_length[self.n_written] = len(tile_bytes)
+        self.n_written += 1
+        return offset, len(tile_bytes)
+
+    def write_tiles(self, tile_iterator: Iterator[Tuple[bytes, str, int]]) -> pd.DataFrame:
+        """Write all tiles and close the data file
+
+        Args:
+            tile_iterator (Iterator[tuple[bytes, str, int]]): raw image bytes, PIL image
+                mode and tile size of each tile not written yet, i.e. after the first
+                n_written tiles of a resumed store
+
+        Returns:
+            pd.DataFrame: tile_image_offset, tile_image_length, tile_image_size_xy and
+                tile_image_mode columns with one row per tile
+        """
+        n_tiles = self.shape[0]
+
+        for img_bytes, img_mode, img_size in tile_iterator:
+            with stage("write"):
+                self.write(img_bytes, img_mode)
+            if self.n_written % 10000 == 0: logger.info("Proccessing tiles [%s,%s]", self.n_written, n_tiles)
+            if self.checkpoint_interval and self.n_written % self.checkpoint_interval == 0: self.checkpoint()
+
+        self.close()
+
+        return pd.DataFrame({
+            "tile_image_offset":  self._tile_image_offset,
+            "tile_image_length":  self._tile_image_length,
+            "tile_image_size_xy": np.full(n_tiles, self.shape[1], dtype=np.int64),
+            "tile_image_mode":    np.full(n_tiles, self.mode, dtype=object),
+        })
+
+    def close(self):
+        """Close the data file, after checking that every tile was written"""
+        self._fp.close()
+        if self.n_written != self.shape[0]:
+            raise ValueError(f"Expected {self.shape[0]} tiles but wrote {self.n_written}")
+
+    def write_index(self, df: pd.DataFrame):
+        """Save the tile index, row i describing tile i, as a typed tile table, see to_tile_table
+
+        Args:
+            df (pd.DataFrame): tile table with one row per written tile, including the
+                tile_image_offset and tile_image_length columns of encoded tiles
+        """
+        if len(df) != self.n_written:
+            raise ValueError(f"Expected an index of {self.n_written} rows but got {len(df)}")
+
+        table = pa.Table.from_pandas(to_tile_table(df))
+        store_metadata = {
+            "data": self.data_filename,
+            "shape": list(self.shape),
+            "dtype": "uint8",
+            "mode": self.mode,
+            "encoding": self.encoding,
+        }
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[TILE_STORE_METADATA_KEY] = json.dumps(store_metadata).encode()
+        pq.write_table(table.replace_schema_metadata(schema_metadata), self.index_path)
+
+        # the store is complete
+        if os.path.exists(self.checkpoint_path): os.remove(self.checkpoint_path)
+
+
+class TileStoreReader:
+    """Tile store reader
+
+    Opens a tile store, or a legacy tiles.slice.pil and address.slice.csv pair with
+    fixed-stride tiles, from a directory. The data file is memory-mapped on first
+    access, so reading only the index does not need the data file.
+
+    Args:
+        store_dir (str): directory of the tile store
+        num_threads (int): number of threads decoding batches of encoded tiles, by
+            default chosen by ThreadPoolExecutor
+    """
+    def __init__(self, store_dir: str, num_threads: Union[int, None] = None):
+        index_path = os.path.join(store_dir, TILE_STORE_INDEX)
+        legacy_index_path = os.path.join(store_dir, LEGACY_TILE_INDEX)
+
+        if os.path.exists(index_path):
+            table = pq.read_table(index_path)
+            self.metadata   = json.loads(table.schema.metadata[TILE_STORE_METADATA_KEY])
+            self.index      = to_tile_table(table.to_pandas())
+            self.index_path = index_path
+            self.data_path  = os.path.join(store_dir, self.metadata["data"])
+        elif os.path.exists(legacy_index_path):
+            self.index      = read_tile_table(legacy_index_path)
+            self.index_path = legacy_index_path
+            self.data_path  = os.path.join(store_dir, LEGACY_TILE_DATA)
+            self.metadata   = self._get_legacy_metadata(self.index)
+        else:
+            raise FileNotFoundError(f"No tile store found in {store_dir}")
+
+        self.mode        = self.metadata["mode"]
+        self.shape       = tuple(self.metadata["shape"])
+        self.encoding    = self.metadata.get("encoding", "raw")
+        self.num_threads = num_threads
+        self._tiles = None
+        self._data  = None
+
+    @staticmethod
+    def _get_legacy_metadata(index: pd.DataFrame) -> dict:
+        if len(index) == 0:
+            return {"shape": [0, 0, 0, 3], "dtype": "uint8", "mode": "RGB", "offset": 0}
+
+        tile_size   = int(index["tile_image_size_xy"].iloc[0])
+        tile_length = int(index["tile_image_length"].iloc[0])
+        mode        = index["tile_image_mode"].iloc[0]
+        offsets     = index["tile_image_offset"].values.astype(np.int64)
+        if not np.array_equal(offsets, offsets[0] + np.arange(len(index)) * tile_length):
+            raise ValueError("Legacy tiles are not stored with a fixed stride in index order")
+
+        return {"shape": [len(index), tile_size, tile_size, Image.getmodebands(mode)],
+                "dtype": "uint8", "mode": mode, "offset": int(offsets[0])}
+
+    @property
+    def tiles(self) -> np.ndarray:
+        """Read-only (N, H, W, C) array of all tiles of a raw tile store"""
+        if self.encoding != "raw":
+            raise ValueError(f"Tiles of a {self.encoding} tile store are decoded on read, use read_tiles()")
+
+        if self._tiles is None:
+            if self.shape[0] == 0:
+                self._tiles = np.empty(self.shape, dtype=np.uint8)
+            elif self.data_path.endswith(".npy"):
+                self._tiles = np.lib.format.open_memmap(self.data_path, mode="r")
+            else:
+                self._tiles = np.memmap(self.data_path, dtype=np.uint8, mode="r",
+                                        offset=self.metadata["offset"], shape=self.shape)
+        return self._tiles
+
+    def __getstate__(self) -> dict:
+        # memory maps are reopened after unpickling, e.g. in DataLoader workers, rather than copied
+        return dict(self.__dict__, _tiles=None, _data=None)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Tile or batch of tiles by position, zero-copy for integers and slices of raw tiles"""
+        if self.encoding == "raw":
+            return self.tiles[key]
+        if isinstance(key, (int, np.integer)):
+            return self._decode(key)
+        return self.read_tiles(np.arange(len(self))[key])
+
+    def _decode(self, position: int) -> np.ndarray:
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+
+        offset = int(self.index["tile_image_offset"].iat[position])
+        length = int(self.index["tile_image_length"].iat[position])
+        with Image.open(BytesIO(self._data[offset:offset + length])) as img:
+            return np.asarray(img.convert(self.mode)).reshape(self.shape[1:])
+
+    def read_tiles(self, positions) -> np.ndarray:
+        """Batch of tiles by position, decoded with a thread pool for encoded tiles
+
+        Args:
+            positions (array-like): positions of the tiles to read
+
+        Returns:
+            np.ndarray: (len(positions), H, W, C) array of tiles
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.encoding == "raw":
+            return self.tiles[positions]
+
+        batch = np.empty((len(positions),) + self.shape[1:], dtype=np.uint8)
+        with ThreadPoolExecutor(self.num_threads) as pool:
+            for i, tile in enumerate(pool.map(self._decode, positions)):
+                batch[i] = tile
+        return batch
+
+    def get_tile(self, address: str) -> np.ndarray:
+        """Tile by address, e.g. x1_y1_z20"""
+        return self[self.index.index.get_loc(address)]
+
+    def get_image(self, position: int) -> Image.Image:
+        """Tile by position as a PIL image"""
+        return Image.frombuffer(self.mode, self.shape[1:3][::-1], self[position], "raw", self.mode, 0, 1)
@@ -0,0 +1,127 @@
+"""
+Tile tables
+
+Tile tables have one row per tile of a slide, indexed by tile address, e.g. tile store
+indexes, inference results and visualization inputs. Parquet is their canonical format,
+with typed columns, so consumers don't re-parse them:
+
+- x and y: int32 tile column and row, instead of "(x, y)" coordinate strings
+- scores, columns named *_score: float32
+- tile image offsets, lengths and sizes: int64, exact for tile stores of any size
+- labels and other strings: categorical, saved as dictionary-encoded Parquet columns
+
+read_tile_table also accepts legacy csv tile tables, and types them the same way.
+"""
+import os
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+TILE_TABLE_EXTENSIONS = (".parquet", ".csv")
+
+# integer tile store columns, saved as floats by legacy csv indexes
+TILE_IMAGE_INTEGER_COLUMNS = ("tile_image_offset", "tile_image_length", "tile_image_size_xy")
+
+
+def get_tile_grid_coordinates(addresses: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Tile x and y of x_y_z tile addresses, see luna_pathology.common.preprocess.coord_to_address
+
+    Args:
+        addresses (Iterable[str]): tile addresses
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: integer x and y of every tile
+    """
+    coords = pd.Series(addresses, dtype=str).str.extract(r'x(\d+)_y(\d+)_z\d+', expand=True)
+    if coords.isna().values.any():
+        raise ValueError("Expected tile addresses of the form x<x>_y<y>_z<magnification>")
+    return coords[0].to_numpy(dtype=int), coords[1].to_numpy(dtype=int)
+
+
+def to_tile_table(df: pd.DataFrame, score_dtype: Union[type, None] = np.float32) -> pd.DataFrame:
+    """Type the columns of a tile table
+
+    Adds int32 x and y columns from the tile addresses, if any, in place of a coordinates
+    column, and converts float score columns to score_dtype, tile image offsets, lengths
+    and sizes to int64 and string columns to categoricals. Other numeric columns are kept.
+
+    Args:
+        df (pd.DataFrame): tile table indexed by address, or with an address column
+        score_dtype (type): dtype of float score columns, None to keep their dtype
+
+    Returns:
+        pd.DataFrame: the typed tile table
+    """
+    has_addresses = "address" in df or "address" in df.index.names
+    if has_addresses and ("x" not in df or "y" not in df):
+        addresses = df["address"] if "address" in df else df.index.get_level_values("address")
+        tile_x, tile_y = get_tile_grid_coordinates(addresses)
+        df = df.assign(x=tile_x.astype(np.int32), y=tile_y.astype(np.int32))
+
+    columns = {}
+    for column, dtype in df.dtypes.items():
+        if column in ("address", "x", "y"):
+            continue
+        if column in TILE_IMAGE_INTEGER_COLUMNS and pd.api.types.is_float_dtype(dtype):
+            columns[column] = df[column].round().astype(np.int64)
+        elif str(column).endswith("_score") and pd.api.types.is_float_dtype(dtype) \
+                and score_dtype is not None and dtype != score_dtype:
+            columns[column] = df[column].astype(score_dtype)
+        elif not pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype) \
+                and not pd.api.types.is_bool_dtype(dtype):
+            columns[column] = df[column].astype("category")
+
+    return df.assign(**columns).drop(columns=["coordinates"], errors="ignore")
+
+
+def write_tile_table(df: pd.DataFrame, path: str):
+    """Save a tile table as Parquet, see to_tile_table
+
+    Args:
+        df (pd.DataFrame): tile table indexed by address
+        path (str): output .parquet path
+    """
+    pq.write_table(pa.Table.from_pandas(to_tile_table(df)), path)
+
+
+def read_tile_table(path: str, score_dtype: Union[type, None] = np.float32) -> pd.DataFrame:
+    """Read a Parquet tile table, or a legacy csv tile table
+
+    Args:
+        path (str): .parquet or .csv tile table path
+        score_dtype (type): dtype of float score columns, None to keep the dtype they
+            were saved with, see to_tile_table
+
+    Returns:
+        pd.DataFrame: typed tile table indexed by address, see to_tile_table
+    """
+    if path.endswith(".csv"):
+        df = pd.read_csv(path)
+        if "address" not in df:
+            # saved with an unnamed address index
+            df = df.rename(columns={df.columns[0]: "address"})
+        # saved with an unnamed row number index, e.g. inference results
+        df = df.drop(columns=[column for column in df if column.startswith("Unnamed:")])
+        return to_tile_table(df.set_index("address"), score_dtype)
+
+    return to_tile_table(pd.read_parquet(path), score_dtype)
+
+
+def find_tile_table(directory: str, name: str) -> str:
+    """Path of the name.parquet tile table in a directory, or of a legacy name.csv table
+
+    Args:
+        directory (str): directory of the tile table
+        name (str): file name of the table, without extension
+
+    Returns:
+        str: tile table path
+    """
+    for extension in TILE_TABLE_EXTENSIONS:
+        path = os.path.join(directory, name + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {name} tile table found in {directory}")
@@ -1,8 +1,12 @@
 import pytest
 from click.testing import CliRunner
-import os
+import os, json
+import numpy as np
+import pandas as pd
 
-from luna_pathology.cli.dsa.dsa_viz import cli
+from luna_pathology.cli.dsa.dsa_viz import cli, get_heatmap_elements, save_dsa_annotation_elements, \
+    base_dsa_annotation
+from luna_pathology.cli.dsa.utils import get_continuous_color, get_continuous_colors
 from luna_pathology.cli.dsa.dsa_upload import cli as upload
 
 
@@ -59,9 +63,59 @@ def test_heatmap():
     assert result.exit_code == 0
     output_file = "tests/luna_pathology/cli/dsa/testouts/otsu_score_test_123.json"
     assert os.path.exists(output_file)
+    with open(output_file) as fp:
+        annotation = json.load(fp)
+    assert "otsu_score_test" == annotation["name"]
+    assert 99 == len(annotation["elements"])
+    assert {"fillColor": "rgba(70, 12, 95, 100)", "lineColor": "rgb(70, 12, 95)", "lineWidth": 2,
+            "type": "polyline", "closed": True,
+            "points": [[1024, 1024, 0], [2048, 1024, 0], [2048, 2048, 0], [1024, 2048, 0], [1024, 1024, 0]],
+            "label": {"value": "0.03125"}} == annotation["elements"][0]
     # cleanup
     os.remove(output_file)
 
+def test_heatmap_labels_keep_score_precision(tmp_path):
+    pd.DataFrame({"address": ["x0_y0_z20", "x1_y0_z20"], "otsu_score": [0.123456789, 0.5]}) \
+        .to_csv(tmp_path / "tile_scores.csv", index=False)
+    with open(tmp_path / "heatmap.yaml", "w") as fp:
+        json.dump({"input": str(tmp_path / "tile_scores.csv"), "image_filename": "123.svs", "column": "otsu_score",
+                   "output_folder": str(tmp_path), "annotation_name": "test", "tile_size": 128}, fp)
+
+    result = CliRunner().invoke(cli, ["-s", "heatmap", "-d", str(tmp_path / "heatmap.yaml")])
+
+    assert result.exit_code == 0
+    with open(tmp_path / "otsu_score_test_123.json") as fp:
+        elements = json.load(fp)["elements"]
+    assert ["0.123456789", "0.5"] == [element["label"]["value"] for element in elements]
+
+def test_get_continuous_colors():
+    values = np.array([0.0, 0.03125, 0.5, 0.999, 1.0, np.nan])
+
+    line_colors, fill_colors = get_continuous_colors(values)
+
+    assert [get_continuous_color(value) for value in values] == list(zip(line_colors, fill_colors))
+
+def test_get_heatmap_elements():
+    scores = pd.Series([0.0, 0.5, 1.0], dtype=np.float32)
+
+    chunks = list(get_heatmap_elements(np.array([0, 1, 2]), np.array([3, 4, 5]), scores, 10, chunk_size=2))
+
+    assert [2, 1] == [len(chunk) for chunk in chunks]
+    assert [[20, 50, 0], [30, 50, 0], [30, 60, 0], [20, 60, 0], [20, 50, 0]] == chunks[1][0]["points"].tolist()
+    assert ["0.0", "0.5", "1.0"] == [element["label"]["value"] for chunk in chunks for element in chunk]
+
+def test_save_dsa_annotation_elements(tmp_path):
+    scores = pd.Series([0.0, 0.5, 1.0])
+    chunks = get_heatmap_elements(np.array([0, 1, 2]), np.array([0, 0, 0]), scores, 10, chunk_size=2)
+
+    path = save_dsa_annotation_elements(base_dsa_annotation, [[], *chunks, []], "test heatmap", str(tmp_path), "123.svs")
+
+    assert str(tmp_path / "test_heatmap_123.json") == path
+    with open(path) as fp:
+        annotation = json.load(fp)
+    assert {"description": "", "name": "test heatmap"} == {key: annotation[key] for key in ["description", "name"]}
+    assert [[0, 0, 0], [10, 0, 0], [20, 0, 0]] == [element["points"][0] for element in annotation["elements"]]
+
 def test_qupath_polygon():
 
     runner = CliRunner()
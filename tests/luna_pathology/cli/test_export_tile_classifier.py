@@ -0,0 +1,41 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+from click.testing import CliRunner
+from torchvision.models import resnet18
+
+from luna_pathology.cli.export_tile_classifier import cli
+from luna_pathology.common.tile_store import TileStoreWriter
+from luna_pathology.models.ov_tissuenet import TissueTileNet
+
+
+def test_cli(tmp_path):
+    tiles = np.random.default_rng(0).integers(0, 256, (16, 64, 64, 3), dtype=np.uint8)
+    writer = TileStoreWriter(str(tmp_path), len(tiles), 64)
+    df = writer.write_tiles((tile.tobytes(), "RGB", 64) for tile in tiles)
+    writer.write_index(df.set_index(pd.Index([f"x{i}_y0_z20" for i in range(len(tiles))], name="address")))
+    checkpoint_path = str(tmp_path / "epoch018.torch")
+    torch.save(TissueTileNet(resnet18(), 4).state_dict(), checkpoint_path)
+    method_param_path = str(tmp_path / "export_tile_classifier.json")
+    with open(method_param_path, "w") as fp:
+        json.dump({"model_package": "luna_pathology.models.ov_tissuenet",
+                   "model": {"checkpoint_path": checkpoint_path, "n_classes": 4},
+                   "quantization": "fx",
+                   "calibration_batches": 1,
+                   "tile_size": 64,
+                   "batch_size": 8,
+                   "tile_path": str(tmp_path)},
+                  fp)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['-m', method_param_path])
+
+    assert result.exit_code == 0
+    assert os.path.exists(tmp_path / "epoch018.fx_int8.pt")
+    with open(tmp_path / "epoch018.fx_int8.json") as fp:
+        properties = json.load(fp)
+    assert 16 == properties["report"]["tiles"]
+    assert 0 < properties["report"]["speedup"]
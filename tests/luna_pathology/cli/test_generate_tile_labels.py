@@ -14,6 +14,6 @@ from luna_pathology.cli.generate_tile_labels import cli
 #         '-m', 'tests/luna_pathology/cli/testdata/generate_tile_labels_with_ov_labels.json'])
 #
 #     assert result.exit_code == 0
-#     assert os.path.exists("tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data/address.slice.csv")
-#     assert os.path.exists("tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data/tiles.slice.pil")
+#     assert os.path.exists("tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data/tiles.slice.parquet")
+#     assert os.path.exists("tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data/tiles.slice.npy")
 #     assert os.path.exists("tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data/metadata.json")
@@ -0,0 +1,87 @@
+import os, json, time
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from luna_pathology.cli.generate_tile_labels_batch import cli, generate_tile_labels_batch, read_slide_ids
+
+
+def generate_tile_labels_or_fail(app_config, datastore_id, method_data):
+    if datastore_id == "bad":
+        raise ValueError("Image node not found")
+    if datastore_id == "large":
+        large = np.ones(256 << 20, dtype=np.uint8)
+        time.sleep(10)
+    if datastore_id == "crash":
+        os._exit(3)
+
+
+def test_generate_tile_labels_batch(mocker):
+    mocker.patch("luna_pathology.cli.generate_tile_labels_batch.generate_tile_labels_with_datastore",
+                 side_effect=generate_tile_labels_or_fail)
+
+    summary = generate_tile_labels_batch("config.yaml", ["123", "bad", "456"], {"job_tag": "test"}, num_processes=2)
+
+    assert 3 == summary["slides"]
+    assert 2 == summary["succeeded"]
+    assert {"bad": "ValueError: Image node not found"} == summary["failures"]
+    assert ["123", "bad", "456"] == [result["datastore_id"] for result in summary["results"]]
+
+def test_generate_tile_labels_batch_memory_limit(mocker):
+    mocker.patch("luna_pathology.cli.generate_tile_labels_batch.generate_tile_labels_with_datastore",
+                 side_effect=generate_tile_labels_or_fail)
+
+    start = time.perf_counter()
+    summary = generate_tile_labels_batch("config.yaml", ["123", "large"], {}, num_processes=2, memory_limit_mb=128)
+
+    assert ["large"] == list(summary["failures"])
+    assert summary["failures"]["large"].startswith("MemoryError")
+    assert time.perf_counter() - start < 10
+
+def test_generate_tile_labels_batch_process_exit(mocker):
+    mocker.patch("luna_pathology.cli.generate_tile_labels_batch.generate_tile_labels_with_datastore",
+                 side_effect=generate_tile_labels_or_fail)
+
+    summary = generate_tile_labels_batch("config.yaml", ["crash", "123"], {}, num_processes=1)
+
+    assert {"crash": "slide process exited with code 3"} == summary["failures"]
+    assert 1 == summary["succeeded"]
+
+def test_generate_tile_labels_batch_slide_workers(tmp_path, mocker):
+    # slide jobs start their own pool of tile reading processes with num_workers > 1
+    mocker.patch("luna_pathology.cli.generate_tile_labels.ConfigSet")
+    datastore = mocker.patch("luna_pathology.cli.generate_tile_labels.DataStore_v2")
+    datastore.return_value.get.return_value = "tests/luna_pathology/common/testdata/123.svs"
+    method_data = {"input_wsi_tag": "pathology.etl", "job_tag": "test", "root_path": str(tmp_path),
+                   "tile_size": 128, "scale_factor": 16, "requested_magnification": 20, "num_workers": 2}
+
+    summary = generate_tile_labels_batch("config.yaml", ["123", "456"], method_data, num_processes=2,
+                                         memory_limit_mb=4096)
+
+    assert 2 == summary["succeeded"], summary["failures"]
+    for datastore_id in ["123", "456"]:
+        with open(tmp_path / datastore_id / "test" / "TileImages" / "data" / "metadata.json") as fp:
+            assert json.load(fp)["tiles"] > 0
+
+def test_read_slide_ids(tmp_path):
+    pd.DataFrame({"slide_id": ["123", "456"], "path": ["123.svs", "456.svs"]}).to_csv(tmp_path / "slides.csv", index=False)
+    pd.DataFrame({"datastore_id": ["789"]}).set_index("datastore_id").to_parquet(tmp_path / "slides.parquet")
+
+    assert ["123", "456"] == read_slide_ids(str(tmp_path / "slides.csv"))
+    assert ["789"] == read_slide_ids(str(tmp_path / "slides.parquet"))
+
+def test_cli_failures(tmp_path, mocker):
+    mocker.patch("luna_pathology.cli.generate_tile_labels_batch.generate_tile_labels_with_datastore",
+                 side_effect=generate_tile_labels_or_fail)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        '-a', 'tests/luna_pathology/cli/testdata/test_config.yaml',
+        '-s', '123',
+        '-s', 'bad',
+        '-m', 'tests/luna_pathology/cli/testdata/generate_tile_labels_with_ov_labels.json',
+        '-o', str(tmp_path / "summary.json")])
+
+    assert 1 == result.exit_code
+    with open(tmp_path / "summary.json") as fp:
+        assert 1 == json.load(fp)["failed"]
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import openslide
+import pytest
+from openslide.deepzoom import DeepZoomGenerator
+
+from luna_pathology.common.heatmap_pyramid import *
+from luna_pathology.common.preprocess import get_tile_color
+
+slide_path = "tests/luna_pathology/common/testdata/123.svs"
+slide = openslide.OpenSlide(slide_path)
+
+# one score tile per 1024px at full resolution, scored only in the top left tile
+TILE_SIZE = 1024
+
+
+def get_scores(score=1.0):
+    scores = np.full((int(np.ceil(slide.dimensions[1] / TILE_SIZE)), int(np.ceil(slide.dimensions[0] / TILE_SIZE))), np.nan,
+                     dtype=np.float32)
+    scores[0, 0] = score
+    return scores
+
+
+def test_get_heatmap_color_grid():
+    scores = np.array([[0.0, np.nan], [1.0, 2.0]], dtype=np.float32)
+
+    color_grid = get_heatmap_color_grid(scores, alpha=1.0)
+
+    assert list(get_tile_color(0.0)) + [255] == color_grid[0, 0].tolist()
+    assert list(get_tile_color(1.0)) + [255] == color_grid[1, 0].tolist()
+    assert [0, 0, 0, 0] == color_grid[0, 1].tolist() == color_grid[1, 1].tolist()
+
+def test_get_heatmap_color_grid_labels():
+    labels = np.array([["tumor", None], ["stroma", "tumor"]], dtype=object)
+
+    color_grid = get_heatmap_color_grid(labels)
+
+    assert np.array_equal(color_grid[0, 0], color_grid[1, 1])
+    assert 0 == color_grid[0, 1, 3] and 128 == color_grid[1, 0, 3]
+
+def test_get_tile():
+    generator = HeatmapDeepZoomGenerator(slide, get_scores(), TILE_SIZE, tile_size=256, overlap=0, alpha=1.0)
+    slide_generator = DeepZoomGenerator(slide, tile_size=256, overlap=0)
+
+    assert slide_generator.level_tiles == generator.level_tiles
+    level = generator.level_count - 1
+    tile = np.array(generator.get_tile(level, (0, 0)))
+
+    assert (tile == get_tile_color(1.0)).all()
+    assert np.array_equal(np.array(slide_generator.get_tile(level, (4, 0))), np.array(generator.get_tile(level, (4, 0))))
+
+    # 4x downsampled, the scored tile covers the top left 256x256 pixels
+    tile = np.array(generator.get_tile(level - 2, (0, 0)))
+    assert (tile[:256, :256] == get_tile_color(1.0)).all()
+    assert np.array_equal(np.array(slide_generator.get_tile(level - 2, (0, 0)))[256:], tile[256:])
+
+def test_get_tile_bytes_cache(mocker):
+    generator = HeatmapDeepZoomGenerator(slide, get_scores(), TILE_SIZE, cache_size=2)
+    spy = mocker.spy(generator, "get_tile")
+
+    first = generator.get_tile_bytes(10, (0, 0))
+    generator.get_tile_bytes(10, (1, 0))
+    assert first == generator.get_tile_bytes(10, (0, 0))
+    assert 2 == spy.call_count
+
+    generator.get_tile_bytes(10, (0, 1), format="png")
+    generator.get_tile_bytes(10, (1, 0))
+    assert 4 == spy.call_count
+
+    with pytest.raises(ValueError):
+        generator.get_tile_bytes(10, (0, 0), format="webp")
+
+def test_write_dzi(tmp_path):
+    generator = HeatmapDeepZoomGenerator(slide, get_scores(0.5), TILE_SIZE)
+
+    dzi_path = generator.write_dzi(str(tmp_path / "heatmap.dzi"), max_level=9)
+
+    with open(dzi_path) as fp:
+        assert generator.get_dzi("jpeg") == fp.read()
+    assert ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"] == sorted(os.listdir(tmp_path / "heatmap_files"), key=int)
+    columns, rows = generator.level_tiles[9]
+    assert columns * rows == len(os.listdir(tmp_path / "heatmap_files" / "9"))
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+import torchvision
+from torchvision.models import resnet18
+
+from luna_pathology.common.inference import *
+from luna_pathology.common.preprocess import run_model
+from luna_pathology.common.tile_store import TileStoreWriter, TileStoreReader
+from luna_pathology.common.tile_table import read_tile_table
+
+
+def write_store(store_dir, n_tiles=10, tile_size=32, encoding="raw"):
+    tiles = np.random.default_rng(0).integers(0, 256, (n_tiles, tile_size, tile_size, 3), dtype=np.uint8)
+    writer = TileStoreWriter(str(store_dir), n_tiles, tile_size, encoding=encoding)
+    df_tile_images = writer.write_tiles((tile.tobytes(), "RGB", tile_size) for tile in tiles)
+    df = pd.DataFrame({"address": [f"x{i}_y0_z20" for i in range(n_tiles)]}).set_index("address")
+    writer.write_index(df.assign(**df_tile_images.set_index(df.index)))
+    return tiles
+
+def test_tile_dataset(tmp_path):
+    tiles = write_store(tmp_path)
+    transform = torchvision.transforms.ToTensor()
+
+    dataset = TileDataset(TileStoreReader(str(tmp_path)), transform)
+
+    assert 10 == len(dataset)
+    assert torch.equal(transform(tiles[3]), dataset[3])
+    assert all(torch.equal(transform(tiles[i]), tensor) for i, tensor in zip([1, 5], dataset.__getitems__([1, 5])))
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_get_tile_data_loader(tmp_path, num_workers):
+    tiles = write_store(tmp_path, encoding="png")
+    transform = torchvision.transforms.ToTensor()
+
+    data_loader = get_tile_data_loader(TileStoreReader(str(tmp_path)), transform, torch.device("cpu"),
+                                       batch_size=4, num_workers=num_workers)
+    batches = list(data_loader)
+
+    assert [4, 4, 2] == [len(batch) for batch in batches]
+    assert torch.equal(torch.stack([transform(tile) for tile in tiles]), torch.cat(batches))
+
+def test_get_device_cpu():
+    assert torch.device("cpu") == get_device("cpu")
+
+def test_get_device_auto():
+    assert ("cuda" if torch.cuda.is_available() else "cpu") == get_device("auto").type
+
+def test_set_cpu_threads():
+    num_threads = torch.get_num_threads()
+    try:
+        set_cpu_threads(1, torch.get_num_interop_threads())
+        assert 1 == torch.get_num_threads()
+    finally:
+        torch.set_num_threads(num_threads)
+
+@pytest.mark.parametrize("channels_last, bfloat16, abs", [(True, False, 1e-5), (False, True, 5e-2)])
+def test_predict_tiles_cpu_options(tmp_path, channels_last, bfloat16, abs):
+    write_store(tmp_path)
+    torch.manual_seed(0)
+    classifier = resnet18(num_classes=3)
+    data_loader = get_tile_data_loader(TileStoreReader(str(tmp_path)), torchvision.transforms.ToTensor(),
+                                       torch.device("cpu"), batch_size=4)
+
+    expected = predict_tiles(prepare_classifier(classifier, torch.device("cpu")), data_loader, torch.device("cpu"))
+    res = predict_tiles(prepare_classifier(classifier, torch.device("cpu"), channels_last=channels_last),
+                        data_loader, torch.device("cpu"), channels_last=channels_last, bfloat16=bfloat16)
+
+    assert np.allclose(expected["tumor_score"], res["tumor_score"], atol=abs)
+    assert np.allclose(expected["label_score"], res["label_score"], atol=abs)
+
+def test_predict_tiles_matches_single_tile(tmp_path):
+    tiles = write_store(tmp_path)
+    transform = torchvision.transforms.ToTensor()
+    torch.manual_seed(0)
+    classifier = prepare_classifier(resnet18(num_classes=3), torch.device("cpu"))
+
+    data_loader = get_tile_data_loader(TileStoreReader(str(tmp_path)), transform, torch.device("cpu"), batch_size=4)
+    res = predict_tiles(classifier, data_loader, torch.device("cpu"))
+
+    with torch.no_grad():
+        for i, tile in enumerate(tiles):
+            output = classifier(transform(tile).unsqueeze(0))
+            scores = output.exp() / output.exp().sum()
+            assert scores.argmax(1).item() == res["label"][i]
+            assert scores.flatten()[0].item() == pytest.approx(res["tumor_score"][i], abs=1e-6)
+            assert scores.max().item() == pytest.approx(res["label_score"][i], abs=1e-6)
+
+@pytest.mark.parametrize("n_tiles", [9, 11])
+def test_predict_tiles_tile_count_mismatch(tmp_path, n_tiles):
+    write_store(tmp_path)
+    data_loader = get_tile_data_loader(TileStoreReader(str(tmp_path)), torchvision.transforms.ToTensor(),
+                                       torch.device("cpu"), batch_size=4)
+
+    with pytest.raises(ValueError):
+        predict_tiles(prepare_classifier(resnet18(num_classes=3), torch.device("cpu")), data_loader,
+                      torch.device("cpu"), n_tiles=n_tiles)
+
+def test_run_model_cpu(tmp_path):
+    store_dir, output_dir = tmp_path / "store", tmp_path / "output"
+    store_dir.mkdir()
+    output_dir.mkdir()
+    write_store(store_dir)
+    checkpoint_path = str(tmp_path / "model.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, checkpoint_path)
+
+    res = run_model(str(store_dir), str(output_dir), {
+        "model_package": "luna_pathology.models.eng_tissuenet",
+        "model": {"checkpoint_path": checkpoint_path, "n_classes": 5},
+        "device": "cpu",
+        "batch_size": 4})
+
+    df = read_tile_table(res["data"])
+    assert 10 == res["total_tiles"]
+    assert "tiles.slice.npy" == res["image_filename"]
+    assert ["model_score", "tumor_score", "label_score"] == res["available_labels"][-3:]
+    assert df["model_score"].str.match(r"Label-[0-4]").all()
+    assert (df["label_score"] >= df["tumor_score"]).all()
+
+def test_tile_batch_queue(tmp_path):
+    tiles = np.random.default_rng(0).integers(0, 256, (10, 8, 8, 3), dtype=np.uint8)
+    transform = torchvision.transforms.ToTensor()
+    writer = TileStoreWriter(str(tmp_path), len(tiles), 8)
+
+    tile_batches = TileBatchQueue(((tile.tobytes(), "RGB", 8) for tile in tiles), transform,
+                                  batch_size=4, queue_size=2, tile_store=writer)
+    batches = list(tile_batches)
+
+    assert [4, 4, 2] == [len(batch) for batch in batches]
+    assert torch.equal(torch.stack([transform(tile) for tile in tiles]), torch.cat(batches))
+    assert np.array_equal(tiles, np.load(writer.data_path))
+    assert 10 == len(tile_batches.df_tile_images)
+
+def test_tile_batch_queue_error():
+    def tile_iterator():
+        yield np.zeros((8, 8, 3), dtype=np.uint8).tobytes(), "RGB", 8
+        raise OSError("slide read failed")
+
+    with pytest.raises(OSError):
+        list(TileBatchQueue(tile_iterator(), torchvision.transforms.ToTensor(), batch_size=4))
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from torchvision.models import resnet18
+
+from luna_pathology.common.model_export import *
+from luna_pathology.common.inference import get_tile_data_loader, prepare_classifier
+from luna_pathology.common.preprocess import run_model
+from luna_pathology.common.tile_store import TileStoreWriter, TileStoreReader
+from luna_pathology.common.tile_table import read_tile_table
+from luna_pathology.models import eng_tissuenet
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    torch.manual_seed(0)
+    checkpoint_path = str(tmp_path / "4.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, checkpoint_path)
+    return checkpoint_path
+
+@pytest.fixture
+def tile_store(tmp_path):
+    tiles = np.random.default_rng(0).integers(0, 256, (8, 32, 32, 3), dtype=np.uint8)
+    store_dir = tmp_path / "store"
+    store_dir.mkdir()
+    writer = TileStoreWriter(str(store_dir), len(tiles), 32)
+    df = writer.write_tiles((tile.tobytes(), "RGB", 32) for tile in tiles)
+    writer.write_index(df.set_index(pd.Index([f"x{i}_y0_z20" for i in range(len(tiles))], name="address")))
+    return TileStoreReader(str(store_dir))
+
+def test_get_artifact_path():
+    assert "/ckpts/4.torchscript.pt" == get_artifact_path("/ckpts/4.ckpt")
+    assert "/ckpts/4.dynamic_int8.pt" == get_artifact_path("/ckpts/4.ckpt", "dynamic")
+
+def test_quantize_classifier_invalid():
+    with pytest.raises(ValueError):
+        quantize_classifier(resnet18(), "int4", (torch.rand(1, 3, 32, 32),))
+
+def test_quantize_classifier_fx_needs_calibration():
+    with pytest.raises(ValueError):
+        quantize_classifier(resnet18().eval(), "fx", (torch.rand(1, 3, 32, 32),))
+
+@pytest.mark.parametrize("quantization", ["none", "dynamic"])
+def test_export_classifier(checkpoint_path, tile_store, quantization):
+    model_params = {"checkpoint_path": checkpoint_path, "n_classes": 5}
+
+    artifact_path = export_classifier("luna_pathology.models.eng_tissuenet", model_params, quantization, tile_size=32)
+    classifier, metadata = load_classifier_artifact(artifact_path)
+
+    assert artifact_path == get_artifact_path(checkpoint_path, quantization)
+    assert {"model_package": "luna_pathology.models.eng_tissuenet", "model": model_params,
+            "quantization": quantization, "quantized_layers": QUANTIZED_LAYERS[quantization], "tile_size": 32} == metadata
+
+    device = torch.device("cpu")
+    data_loader = get_tile_data_loader(tile_store, eng_tissuenet.get_transform(), device, batch_size=4)
+    report = compare_classifiers(prepare_classifier(eng_tissuenet.get_classifier(**model_params), device),
+                                 prepare_classifier(classifier, device), data_loader, device)
+    assert 8 == report["tiles"]
+    assert report["max_tumor_score_delta"] < (1e-5 if quantization == "none" else 1e-2)
+
+def test_export_classifier_fx(checkpoint_path, tile_store):
+    device = torch.device("cpu")
+    data_loader = get_tile_data_loader(tile_store, eng_tissuenet.get_transform(), device, batch_size=4)
+
+    artifact_path = export_classifier("luna_pathology.models.eng_tissuenet", {"checkpoint_path": checkpoint_path},
+                                      "fx", tile_size=32, calibration_batches=data_loader)
+    classifier, metadata = load_classifier_artifact(artifact_path)
+
+    assert "fx" == metadata["quantization"] and "all" == metadata["quantized_layers"]
+    assert (4, 5) == classifier(torch.rand(4, 3, 32, 32)).shape
+
+def test_run_model_artifact(tmp_path, checkpoint_path, tile_store):
+    artifact_path = export_classifier("luna_pathology.models.eng_tissuenet", {"checkpoint_path": checkpoint_path},
+                                      "dynamic", tile_size=32)
+    params = {"model_package": "luna_pathology.models.eng_tissuenet",
+              "model": {"checkpoint_path": checkpoint_path, "n_classes": 5},
+              "device": "cpu"}
+
+    eager = run_model(str(tmp_path / "store"), str(tmp_path), params)
+    df_eager = read_tile_table(eager["data"])
+    exported = run_model(str(tmp_path / "store"), str(tmp_path), {"model_artifact": artifact_path, "device": "cpu"})
+    df_exported = read_tile_table(exported["data"])
+
+    assert (df_eager["model_score"].astype(str) == df_exported["model_score"].astype(str)).all()
+    assert np.allclose(df_eager["tumor_score"], df_exported["tumor_score"], atol=1e-2)
@@ -1,11 +1,17 @@
 import pytest
 import os, shutil
-import json
+import json, itertools
 import numpy as np
+import pandas as pd
 import openslide
 from openslide.deepzoom import DeepZoomGenerator
+from PIL import Image
+from shapely.geometry import Polygon
 
+import luna_pathology.common.preprocess
 from luna_pathology.common.preprocess import *
+from luna_pathology.common.score_raster import read_score_raster
+from luna_pathology.common.tile_table import read_tile_table
 
 output_dir = "tests/luna_pathology/common/testdata/output-123"
 slide_path = "tests/luna_pathology/common/testdata/123.svs"
@@ -33,6 +39,80 @@ def test_get_tile_color_str():
     res = get_tile_color("blue")
     assert 3 == len(res)
 
+def test_get_tile_colors_matches_get_tile_color():
+    scores = pd.Series([0.0, 0.1, 0.5, 0.999, 1.0, 1.5, np.nan], name="tumor_score")
+
+    colors, valid = get_tile_colors(scores)
+
+    assert [True] * 5 + [False] * 2 == valid.tolist()
+    assert [get_tile_color(score) for score in scores[:5]] == colors[valid].tolist()
+
+def test_get_tile_colors_str():
+    labels = pd.Series(["Label-1", "Label-2", None, "Label-1"], name="model_score")
+
+    colors, valid = get_tile_colors(labels)
+
+    assert [True, True, False, True] == valid.tolist()
+    assert np.array_equal(np.array(get_tile_color("Label-2")).astype(np.uint8), colors[1])
+    assert np.array_equal(colors[0], colors[3])
+
+@pytest.mark.parametrize("fill", [False, True])
+def test_visualize_tiling_scores(fill):
+    df = pd.DataFrame({"address": ["x1_y1_z20", "x2_y1_z20", "x1_y2_z20"],
+                       "otsu_score": [1.0, 0.8, 0.2],
+                       "tumor_score": [0.0, 1.0, 1.0]}).set_index("address")
+    thumbnail_img = np.zeros((64, 64, 3), dtype=np.uint8)
+
+    res = visualize_tiling_scores(df, thumbnail_img, 16, "tumor_score", fill=fill)
+
+    low, high = get_tile_color(0.0), get_tile_color(1.0)
+    if fill:
+        assert (res[16:32, 16:32] == low).all() and (res[16:32, 32:48] == high).all()
+        assert 2 * 16 * 16 == np.count_nonzero(res.any(axis=-1))
+    else:
+        # borders just outside the tiles, the second tile painted over the first
+        assert (res[15, 15:31] == low).all() and (res[16:32, 15] == low).all()
+        assert (res[15, 31:49] == high).all() and (res[16:33, 31] == high).all()
+        assert not res[16:31, 16:31].any() and not res[40:, :].any()
+
+@pytest.mark.parametrize("fill", [False, True])
+def test_visualize_tiling_scores_partial_edge_tiles(monkeypatch, fill):
+    rng = np.random.default_rng(0)
+    coordinates = [(x, y) for x in range(11) for y in range(9)]
+    df = pd.DataFrame({"address": [coord_to_address(address, 20) for address in coordinates],
+                       "otsu_score": rng.uniform(0.4, 1, len(coordinates)),
+                       "tumor_score": rng.uniform(size=len(coordinates))}).set_index("address")
+
+    # thumbnail cut through the last row and column of tiles
+    res = visualize_tiling_scores(df, np.zeros((70, 100, 3), dtype=np.uint8), 8, "tumor_score", fill=fill)
+    monkeypatch.setattr(luna_pathology.common.preprocess, "VISUALIZE_CHUNK_TILES", 7)
+    chunked = visualize_tiling_scores(df, np.zeros((70, 100, 3), dtype=np.uint8), 8, "tumor_score", fill=fill)
+
+    assert np.array_equal(res, chunked)
+    if fill:
+        expected = np.zeros((72, 104, 3), dtype=np.uint8)
+        for (x, y), otsu_score, score in zip(coordinates, df["otsu_score"], df["tumor_score"]):
+            if otsu_score > 0.5: expected[y * 8:(y + 1) * 8, x * 8:(x + 1) * 8] = get_tile_color(score)
+        assert np.array_equal(expected[:70, :100], res)
+
+def test_create_tile_thumbnail_image(tmp_path):
+    df, tiling = score_tiles(slide_path, None, {"tile_size": 128, "requested_magnification": 20}, "123")
+    df.assign(tumor_score=np.linspace(0, 1, len(df))).to_csv(tmp_path / "scores.csv")
+
+    properties = create_tile_thumbnail_image(slide_path, str(tmp_path / "scores.csv"), str(tmp_path),
+                                             {"tile_size": 128, "requested_magnification": 20, "heatmap_dzi": True})
+
+    assert ["otsu_score", "purple_score", "tumor_score"] == sorted(properties["score_rasters"])
+    scores, metadata = read_score_raster(properties["score_rasters"]["tumor_score"])
+    tile_x, tile_y = zip(*df["coordinates"])
+    assert np.allclose(np.linspace(0, 1, len(df)), scores[tile_y, tile_x], atol=1e-3)
+    assert len(df) == np.count_nonzero(~np.isnan(scores))
+    assert 128 == metadata["tile_size"]
+    assert os.path.exists(tmp_path / "tile_scores_and_labels_visualization_tumor_score.png")
+    # 20x of a 20x slide, every deep zoom level is saved
+    assert str(tmp_path / "tile_scores_heatmap_tumor_score.dzi") == properties["heatmap_dzis"]["tumor_score"]
+    assert 13 == len(os.listdir(tmp_path / "tile_scores_heatmap_tumor_score_files"))
+
 def test_get_full_resolution_generator():
 
     generator, level = get_full_resolution_generator(slide, 128)
@@ -44,6 +124,35 @@ def test_get_downscaled_thumbnail():
 
     assert isinstance(res, np.ndarray)
 
+@pytest.mark.parametrize("strip_height", [37, 512])
+def test_get_downscaled_thumbnail_matches_get_thumbnail(strip_height):
+    res = get_downscaled_thumbnail(slide, 4, num_threads=2, strip_height=strip_height)
+
+    expected = slide.get_thumbnail((slide.dimensions[0] // 4, slide.dimensions[1] // 4))
+    assert np.array_equal(np.array(expected), res)
+
+def test_get_downscaled_thumbnail_non_integer_downsample():
+    class StripSlide:
+        dimensions = (4000, 16000)
+        level_dimensions = [(4000, 16000), (999, 3999)]
+        level_downsamples = [1.0, 4.0002]
+        properties = {}
+
+        def __init__(self):
+            self.rows = []
+
+        def read_region(self, location, level, size):
+            # openslide reads a level from location / downsample, interpolating fractional rows
+            self.rows.append(location[1] / self.level_downsamples[level])
+            return Image.new("RGBA", size, (0, 0, 0, 255))
+
+    strip_slide = StripSlide()
+    get_downscaled_thumbnail(strip_slide, 4, strip_height=500)
+
+    # strips start within half a level-0 pixel of their level row
+    rows = np.array(sorted(strip_slide.rows))
+    assert np.all(np.abs(rows - np.arange(0, 3999, 500)) <= 0.5 / 4.0002)
+
 def test_array_to_slide():
     res = array_to_slide(img_arr)
 
@@ -56,6 +165,181 @@ def test_make_otsu():
     assert 0 == np.count_nonzero(res[0])
     assert isinstance(res, np.ndarray)
 
+def test_get_tile_block_view():
+    res = get_tile_block_view(img_arr, 16)
+
+    assert (img_arr.shape[0] // 16, img_arr.shape[1] // 16, 16, 16, 3) == res.shape
+    assert np.array_equal(img_arr[32:48, 16:32], res[2, 1])
+
+def test_get_thumbnail_images_matches_make_otsu():
+    rgb, gray, threshold = get_thumbnail_images(slide_path, slide, 10, {})
+
+    assert np.array_equal(img_arr, rgb)
+    assert np.array_equal(make_otsu(img_arr), (gray < threshold).astype(float))
+
+def test_get_thumbnail_images_cache(tmp_path, mocker):
+    params = {"thumbnail_cache_dir": str(tmp_path)}
+
+    rgb, gray, threshold = get_thumbnail_images(slide_path, slide, 10, params)
+    spy = mocker.spy(luna_pathology.common.preprocess, "get_downscaled_thumbnail")
+    cached_rgb, cached_gray, cached_threshold = get_thumbnail_images(slide_path, slide, 10, params)
+
+    assert 0 == spy.call_count
+    # computed on a miss, cached as float32
+    assert np.float64 == gray.dtype and np.float32 == cached_gray.dtype
+    assert np.array_equal(img_arr, cached_rgb)
+    assert np.allclose(gray, cached_gray, atol=1e-6)
+    assert threshold == cached_threshold
+    assert np.array_equal(make_otsu(img_arr), (cached_gray < cached_threshold).astype(float))
+
+def test_get_block_scores_matches_generator():
+    otsu_img = make_otsu(img_arr)
+    generator, level = get_full_resolution_generator(array_to_slide(otsu_img), 16)
+    address_raster = [(1, 1), (3, 2), (5, 7)]
+
+    res = get_otsu_scores(address_raster, otsu_img, 16)
+
+    expected = [np.array(generator.get_tile(level, address)).mean() for address in address_raster]
+    assert np.allclose(expected, res)
+
+def test_get_block_scores_invalid_address():
+    with pytest.raises(ValueError):
+        get_purple_scores([(1000, 1)], img_arr, 16)
+
+def test_register_tile_scorer():
+
+    @register_tile_scorer("max_score", source="rgb")
+    def max_scorer(blocks):
+        return blocks.max(axis=(2, 3, 4))
+
+    try:
+        assert (max_scorer, "rgb") == tile_scorers["max_score"]
+        assert [img_arr[16:32, 16:32].max()] == get_block_scores([(1, 1)], img_arr, 16, max_scorer)
+    finally:
+        tile_scorers.pop("max_score")
+
+def test_get_best_level_for_downsample(mocker):
+    pyramid = mocker.Mock(level_downsamples=(1.0, 4.000345, 16.0013))
+
+    assert 0 == get_best_level_for_downsample(slide, 2)
+    assert 0 == get_best_level_for_downsample(pyramid, 2)
+    assert 1 == get_best_level_for_downsample(pyramid, 4)
+    assert 1 == get_best_level_for_downsample(pyramid, 8)
+    assert 2 == get_best_level_for_downsample(pyramid, 32)
+
+def test_read_tile_matches_generator():
+    generator, level = get_full_resolution_generator(slide, 256)
+
+    res = read_tile(slide, (3, 4), 256, 128, 0)
+
+    assert (128, 128) == res.size
+    assert 'RGB' == res.mode
+    assert generator.get_tile(level, (3, 4)).resize((128, 128)).tobytes() == res.tobytes()
+
+def get_regional_labels_with_generator(address_raster, annotation_polygons, annotation_labels, generator, level):
+    """linear scan over DeepZoom tile polygons, as get_regional_labels labeled tiles before the STRtree"""
+    labels = []
+    for address in address_raster:
+        (tile_x, tile_y), _, (tile_size_x, tile_size_y) = generator.get_tile_coordinates(level, address)
+        tile_polygon = Polygon([(tile_x, tile_y), (tile_x, tile_y + tile_size_y),
+                                (tile_x + tile_size_x, tile_y + tile_size_y), (tile_x + tile_size_x, tile_y)])
+        labels.append(next((label for polygon, label in zip(annotation_polygons, annotation_labels)
+                            if polygon.contains(tile_polygon)), None))
+    return labels
+
+def test_get_tile_rectangles():
+    res = get_tile_rectangles([(0, 0), (2, 1)], 100, (250, 180))
+
+    assert [[0, 0, 100, 100], [200, 100, 250, 180]] == res.tolist()
+
+def test_get_regional_labels_matches_generator():
+    generator, level = get_full_resolution_generator(slide, 128)
+    address_raster = list(itertools.product(*[range(count) for count in generator.level_tiles[level]]))
+    width, height = slide.dimensions
+    annotation_polygons = [
+        Polygon([(0, 0), (width // 2, 0), (width // 2, height // 2), (0, height // 2)]),
+        # overlaps the first polygon, which keeps its label where both contain a tile
+        Polygon([(100, 100), (width, 100), (width, height), (100, height)],
+                holes=[[(1000, 1000), (1500, 1000), (1500, 1500), (1000, 1500)]]),
+        Polygon([(0, 0), (300, 900), (700, 200)]),
+    ]
+    annotation_labels = ["tumor", "stroma", "tumor"]
+
+    res = get_regional_labels(address_raster, annotation_polygons, annotation_labels, 128, slide.dimensions)
+
+    expected = get_regional_labels_with_generator(address_raster, annotation_polygons, annotation_labels, generator, level)
+    assert expected == res
+    assert {"tumor", "stroma", None} == set(res)
+
+def test_get_regional_labels_no_annotations():
+    assert [None, None] == get_regional_labels([(1, 1), (2, 2)], [], [], 128, slide.dimensions)
+
+def test_rasterize_polygon():
+    polygon = Polygon([(16, 16), (64, 16), (64, 48), (16, 48)], holes=[[(32, 32), (48, 32), (48, 48), (32, 48)]])
+
+    res = rasterize_polygon(polygon, (1, 0), (4, 4), 16)
+
+    assert [[False, False, False, False],
+            [True,  True,  True,  False],
+            [True,  False, True,  False],
+            [False, False, False, False]] == res.tolist()
+
+def test_get_rasterized_regional_labels_matches_polygons():
+    # polygon vertices on the 16 pixel cell grid, where rasterized and polygon containment agree
+    tile_size, cells_per_tile, slide_dimensions = 128, 8, (1008, 704)
+    annotation_polygons = [
+        Polygon([(0, 0), (512, 0), (512, 384), (0, 384)]),
+        Polygon([(128, 64), (1008, 64), (1008, 704), (128, 704)],
+                holes=[[(384, 384), (640, 384), (640, 512), (384, 512)]]),
+        Polygon([(0, 256), (256, 704), (0, 704)]),
+    ]
+    annotation_labels = ["tumor", "stroma", "tumor"]
+    address_raster = list(itertools.product(range(8), range(6)))
+
+    res = get_rasterized_regional_labels(address_raster, annotation_polygons, annotation_labels,
+                                         tile_size, slide_dimensions, cells_per_tile)
+
+    expected = get_regional_labels(address_raster, annotation_polygons, annotation_labels, tile_size, slide_dimensions)
+    assert expected == [label if isinstance(label, str) else None for label in res["regional_label"]]
+    assert ["regional_label", "regional_coverage_tumor", "regional_coverage_stroma"] == list(res.columns)
+    assert 1.0 == res["regional_coverage_tumor"][address_raster.index((0, 0))]
+    assert 0.5 == res["regional_coverage_stroma"][address_raster.index((1, 0))]
+    assert 0.0 == res["regional_coverage_stroma"][address_raster.index((0, 5))]
+
+def test_get_rasterized_regional_labels_invalid_address():
+    with pytest.raises(ValueError):
+        get_rasterized_regional_labels([(100, 1)], [], [], 128, slide.dimensions, 8)
+
+def test_get_candidate_raster_matches_full_raster():
+    tile_x_count, tile_y_count, tile_size = 12, 9, 128
+    rng = np.random.default_rng(0)
+    score_grids = {"otsu_score": rng.random((tile_y_count, tile_x_count)),
+                   "purple_score": rng.random((tile_y_count, tile_x_count))}
+    filter = {"otsu_score": 0.3, "regional_label": 0}
+    annotation_polygons = [
+        Polygon([(-50, -50), (400, -50), (400, 300), (-50, 300)]),
+        Polygon([(700, 500), (1300, 500), (1100, 1000)]),
+    ]
+    annotation_labels = ["tumor", "stroma"]
+
+    res = get_candidate_raster(tile_x_count, tile_y_count, score_grids, filter, annotation_polygons, tile_size)
+
+    # filter and label the full raster of interior tiles
+    full_raster = list(itertools.product(range(1, tile_x_count-1), range(1, tile_y_count-1)))
+    labels = get_regional_labels(full_raster, annotation_polygons, annotation_labels, tile_size,
+                                 (tile_x_count * tile_size, tile_y_count * tile_size))
+    expected = [(x, y) for (x, y), label in zip(full_raster, labels)
+                if score_grids["otsu_score"][y, x] >= 0.3 and label is not None]
+
+    candidates = [tuple(address) for address in res.tolist()]
+    assert sorted(candidates) == candidates
+    assert set(expected) <= set(candidates)
+    assert len(candidates) < len(full_raster)
+
+def test_get_candidate_raster_invalid_score_grid():
+    with pytest.raises(ValueError):
+        get_candidate_raster(12, 9, {"otsu_score": np.zeros((4, 4))})
+
 def test_pretile_scoring(requests_mock):
 
     # setup
@@ -75,8 +359,8 @@ def test_pretile_scoring(requests_mock):
                           params, "123")
 
     print(res)
-    assert 'tests/luna_pathology/common/testdata/output-123/tiles.slice.pil' == res['data']
-    assert 'tests/luna_pathology/common/testdata/output-123/address.slice.csv' == res['aux']
+    assert 'tests/luna_pathology/common/testdata/output-123/tiles.slice.npy' == res['data']
+    assert 'tests/luna_pathology/common/testdata/output-123/tiles.slice.parquet' == res['aux']
     assert 'RGB' == res['pil_image_bytes_mode']
     assert 20 == res['full_resolution_magnification']
     assert ['coordinates', 'otsu_score', 'purple_score', 'regional_label'] == res['available_labels']
@@ -85,6 +369,134 @@ def test_pretile_scoring(requests_mock):
     # clean up
     shutil.rmtree(output_dir)
 
+def test_pretile_scoring_raster_labels(tmp_path):
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "project_id": "project",
+              "labelset": "default_labels",
+              "regional_label_mode": "raster"
+              }
+    res = pretile_scoring(slide_path, str(tmp_path),
+                          "tests/luna_pathology/common/testdata/project/tables/REGIONAL_METADATA_RESULTS",
+                          params, "123")
+
+    print(res)
+    assert ['coordinates', 'otsu_score', 'purple_score', 'regional_label'] == res['available_labels'][:4]
+    assert all(label.startswith("regional_coverage_") for label in res['available_labels'][4:])
+
+def test_pretile_scoring_num_workers():
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "filter": {
+                  "otsu_score": 0.5
+              }
+              }
+    serial_dir, parallel_dir = f"{output_dir}/serial", f"{output_dir}/parallel"
+    os.makedirs(serial_dir, exist_ok=True)
+    os.makedirs(parallel_dir, exist_ok=True)
+
+    pretile_scoring(slide_path, serial_dir, None, params, "123")
+    pretile_scoring(slide_path, parallel_dir, None, dict(params, num_workers=2), "123")
+
+    for filename in ["tiles.slice.npy", "tiles.slice.parquet"]:
+        with open(f"{serial_dir}/{filename}", "rb") as serial, open(f"{parallel_dir}/{filename}", "rb") as parallel:
+            assert serial.read() == parallel.read()
+
+    # clean up
+    shutil.rmtree(output_dir)
+
+def test_pretile_scoring_tile_encoding():
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "filter": {
+                  "otsu_score": 0.5
+              }
+              }
+    raw_dir, webp_dir = f"{output_dir}/raw", f"{output_dir}/webp"
+    os.makedirs(raw_dir, exist_ok=True)
+    os.makedirs(webp_dir, exist_ok=True)
+
+    pretile_scoring(slide_path, raw_dir, None, params, "123")
+    properties = pretile_scoring(slide_path, webp_dir, None, dict(params, tile_encoding="webp"), "123")
+
+    assert properties["data"].endswith("tiles.slice.webp")
+    assert "webp" == properties["tile_encoding"]
+    raw_store, webp_store = TileStoreReader(raw_dir), TileStoreReader(webp_dir)
+    assert np.array_equal(raw_store[:], webp_store.read_tiles(range(len(webp_store))))
+
+    # clean up
+    shutil.rmtree(output_dir)
+
+def test_pretile_scoring_resume(tmp_path, mocker):
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "checkpoint_interval": 50,
+              "filter": {
+                  "otsu_score": 0.5
+              }
+              }
+    expected = pretile_scoring(slide_path, str(tmp_path), None, params, "123")
+    expected_tiles = TileStoreReader(str(tmp_path))[:]
+    os.remove(expected["aux"])
+
+    # interrupt the job after 120 tiles, with a checkpoint after 100
+    def interrupted_tile_bytes(*args, **kwargs):
+        for i, tile in enumerate(iter_tile_bytes(*args, **kwargs)):
+            if i == 120: raise KeyboardInterrupt
+            yield tile
+
+    mocker.patch("luna_pathology.common.preprocess.iter_tile_bytes", side_effect=interrupted_tile_bytes)
+    with pytest.raises(KeyboardInterrupt):
+        pretile_scoring(slide_path, str(tmp_path), None, params, "123")
+    mocker.stopall()
+
+    spy = mocker.spy(luna_pathology.common.preprocess, "iter_tile_bytes")
+    properties = pretile_scoring(slide_path, str(tmp_path), None, params, "123")
+
+    assert {**expected, "timings": None} == {**properties, "timings": None}
+    assert expected["tiles"] - 100 == len(spy.call_args.args[1])
+    assert np.array_equal(expected_tiles, TileStoreReader(str(tmp_path))[:])
+
+def test_pretile_scoring_skip_completed(tmp_path, mocker):
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "filter": {
+                  "otsu_score": 0.5
+              }
+              }
+    properties = pretile_scoring(slide_path, str(tmp_path), None, params, "123")
+    with open(tmp_path / "metadata.json", "w") as fp:
+        json.dump(properties, fp)
+
+    spy = mocker.spy(luna_pathology.common.preprocess, "score_tiles")
+    assert properties == pretile_scoring(slide_path, str(tmp_path), None, dict(params, num_workers=2), "123")
+    assert 0 == spy.call_count
+
+    pretile_scoring(slide_path, str(tmp_path), None, dict(params, filter={"otsu_score": 0.8}), "123")
+    assert 1 == spy.call_count
+
+def test_pretile_scoring_profile(tmp_path):
+
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "profile": "chrome",
+              "filter": {
+                  "otsu_score": 0.5
+              }
+              }
+    properties = pretile_scoring(slide_path, str(tmp_path), None, params, "123")
+
+    assert ["thumbnail", "otsu", "scoring", "read", "resize", "write"] == list(properties["timings"])
+    assert properties["tiles"] == properties["timings"]["write"]["calls"]
+    assert str(tmp_path / "profile.trace.json") == properties["profile"]
+    with open(properties["profile"]) as fp:
+        assert {"thumbnail", "otsu", "scoring", "write"} <= {event["name"] for event in json.load(fp)["traceEvents"]}
+
 """
 # works on a cuda enabled env
 def test_run_model():
@@ -96,9 +508,49 @@ def test_run_model():
             "n_classes": 5
         }
     }
-    res = run_model('/gpfs/mskmindhdp_emc/data/TCGA-BRCA/TCGA-D8-A4Z1-01Z-00-DX1.D39D38B5-FC9F-4298-8720-016407DC6591/test_collect_tiles/tiles.slice.pil',
-                    '/gpfs/mskmindhdp_emc/data/TCGA-BRCA/TCGA-D8-A4Z1-01Z-00-DX1.D39D38B5-FC9F-4298-8720-016407DC6591/test_collect_tiles/address.slice.csv',
+    res = run_model('/gpfs/mskmindhdp_emc/data/TCGA-BRCA/TCGA-D8-A4Z1-01Z-00-DX1.D39D38B5-FC9F-4298-8720-016407DC6591/test_collect_tiles',
                     'tests/luna_pathology/common/testdata', params)
 
     print(res)
 """
+
+@pytest.mark.parametrize("persist_tiles", [True, False])
+def test_run_tile_pipeline_matches_pretile_and_run_model(tmp_path, persist_tiles):
+    import torch
+    from torchvision.models import resnet18
+
+    checkpoint_path = str(tmp_path / "model.ckpt")
+    torch.save({"model_states": {"net": resnet18(num_classes=5).state_dict()}}, checkpoint_path)
+    params = {"tile_size":128,
+              "requested_magnification":20,
+              "filter": {
+                  "otsu_score": 0.5
+              },
+              "model_package": "luna_pathology.models.eng_tissuenet",
+              "model": {"checkpoint_path": checkpoint_path, "n_classes": 5},
+              "device": "cpu",
+              "batch_size": 16,
+              "queue_size": 32,
+              "tile_workers": 2,
+              "persist_tiles": persist_tiles
+              }
+    for directory in ["tiles", "scores", "pipeline_tiles", "pipeline_scores"]:
+        (tmp_path / directory).mkdir()
+
+    tile_properties = pretile_scoring(slide_path, str(tmp_path / "tiles"), None, params, "123")
+    properties = run_model(str(tmp_path / "tiles"), str(tmp_path / "scores"), params)
+    pipeline_tile_properties, pipeline_properties = run_tile_pipeline(slide_path, str(tmp_path / "pipeline_tiles"),
+                                                                      str(tmp_path / "pipeline_scores"), None, params, "123")
+
+    df = read_tile_table(properties["data"])
+    df_pipeline = read_tile_table(pipeline_properties["data"])
+    assert properties["total_tiles"] == pipeline_properties["total_tiles"]
+    if persist_tiles:
+        assert {**tile_properties, "data": None, "aux": None, "timings": None} == \
+            {**pipeline_tile_properties, "data": None, "aux": None, "timings": None}
+        assert {**properties, "data": None, "timings": None} == {**pipeline_properties, "data": None, "timings": None}
+        assert df.equals(df_pipeline)
+    else:
+        assert pipeline_tile_properties is None
+        assert not os.listdir(tmp_path / "pipeline_tiles")
+        assert df.drop(columns=[column for column in df if column.startswith("tile_image_")]).equals(df_pipeline)
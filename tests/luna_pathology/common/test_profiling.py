@@ -0,0 +1,54 @@
+import json
+import pstats
+import pytest
+
+from luna_pathology.common.profiling import StageTimer, stage, get_active_timer, profile_stages
+
+
+def test_stage_without_timer():
+    assert get_active_timer() is None
+    with stage("read"):
+        pass
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.activate():
+        assert timer is get_active_timer()
+        for _ in range(3):
+            with stage("read"):
+                pass
+        with stage("write"):
+            pass
+    assert get_active_timer() is None
+
+    timer.merge({"read": {"seconds": 1.0, "calls": 2}, "resize": {"seconds": 0.5, "calls": 1}})
+
+    timings = timer.to_dict()
+    assert ["read", "write", "resize"] == list(timings)
+    assert 5 == timings["read"]["calls"]
+    assert 1.0 <= timings["read"]["seconds"]
+    assert timer.events is None
+
+def test_profile_stages_chrome(tmp_path):
+    with profile_stages(str(tmp_path), "chrome") as timer:
+        with stage("read"):
+            with stage("resize"):
+                pass
+
+    assert {"read", "resize"} == set(timer.to_dict())
+    with open(tmp_path / "profile.trace.json") as fp:
+        events = json.load(fp)["traceEvents"]
+    assert ["resize", "read"] == [event["name"] for event in events]
+    assert all("X" == event["ph"] for event in events)
+
+def test_profile_stages_pstats(tmp_path):
+    with profile_stages(str(tmp_path), "pstats"):
+        with stage("read"):
+            sorted(range(1000))
+
+    assert pstats.Stats(str(tmp_path / "profile.pstats")).total_calls > 0
+
+def test_profile_stages_invalid_profile(tmp_path):
+    with pytest.raises(ValueError):
+        with profile_stages(str(tmp_path), "flamegraph"):
+            pass
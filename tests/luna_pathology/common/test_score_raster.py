@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from luna_pathology.common.score_raster import *
+
+
+@pytest.fixture
+def df_scores():
+    return pd.DataFrame({"address": ["x1_y2_z20", "x3_y1_z20", "x0_y0_z20"],
+                         "tumor_score": [0.25, 1.0, np.nan],
+                         "regional_label": ["tumor", None, "stroma"]}).set_index("address")
+
+
+@pytest.mark.parametrize("encoding", ["float16", "uint8"])
+def test_save_score_rasters(tmp_path, df_scores, encoding):
+    paths = save_score_rasters(df_scores, ["tumor_score", "regional_label"], str(tmp_path), (3, 4),
+                               encoding=encoding, properties={"tile_size": 128})
+
+    scores, metadata = read_score_raster(paths["tumor_score"])
+    assert (3, 4) == scores.shape and np.float32 == scores.dtype
+    assert {"column": "tumor_score", "tile_size": 128, "encoding": encoding} == {key: metadata[key] for key in ["column", "tile_size", "encoding"]}
+    assert np.isclose(0.25, scores[2, 1], atol=1 / 254) and 1.0 == scores[1, 3]
+    assert 2 == np.count_nonzero(~np.isnan(scores))
+
+    labels, metadata = read_score_raster(paths["regional_label"])
+    assert "labels" == metadata["encoding"]
+    assert "tumor" == labels[2, 1] and "stroma" == labels[0, 0]
+    assert 2 == np.count_nonzero(labels != None)
+
+def test_encode_score_grid_uint8_range():
+    scores = pd.Series([-1.0, 3.0], name="score")
+
+    grid, metadata = encode_score_grid(scores, np.array([0, 1]), np.array([0, 0]), (1, 2), "uint8")
+
+    assert [0, 254] == grid[0].tolist()
+    assert [-1.0, 3.0] == metadata["value_range"]
+    assert [-1.0, 3.0] == decode_score_grid(grid, metadata)[0].tolist()
+
+def test_encode_score_grid_invalid(df_scores):
+    tile_x, tile_y = get_tile_grid_coordinates(df_scores.index)
+
+    with pytest.raises(ValueError):
+        encode_score_grid(df_scores["tumor_score"], tile_x, tile_y, (3, 4), "float32")
+    with pytest.raises(ValueError):
+        encode_score_grid(df_scores["tumor_score"], tile_x, tile_y, (2, 2))
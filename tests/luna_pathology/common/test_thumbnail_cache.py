@@ -0,0 +1,62 @@
+import os
+import numpy as np
+
+from luna_pathology.common.thumbnail_cache import *
+
+slide_path = "tests/luna_pathology/common/testdata/123.svs"
+
+
+def test_get_slide_key(tmp_path):
+    copy_path = tmp_path / "copy.svs"
+    with open(slide_path, "rb") as src, open(copy_path, "wb") as dst:
+        dst.write(src.read())
+
+    assert get_slide_key(slide_path, 4) == get_slide_key(str(copy_path), 4)
+    assert get_slide_key(slide_path, 4) != get_slide_key(slide_path, 8)
+    assert get_slide_key(slide_path, 4) != get_slide_key(slide_path, 4, version=THUMBNAIL_VERSION + 1)
+
+    with open(copy_path, "r+b") as fp:
+        fp.write(b"\0")
+    assert get_slide_key(slide_path, 4) != get_slide_key(str(copy_path), 4)
+
+def test_get_or_compute(tmp_path):
+    cache = ThumbnailCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"rgb": np.ones((4, 4, 3), dtype=np.uint8)}, {"otsu_threshold": 0.5}
+
+    arrays, metadata = cache.get_or_compute("a", compute)
+    cached_arrays, cached_metadata = cache.get_or_compute("a", compute)
+
+    assert 1 == len(calls)
+    assert np.array_equal(arrays["rgb"], cached_arrays["rgb"])
+    assert {"otsu_threshold": 0.5} == cached_metadata
+
+def test_get_miss(tmp_path):
+    assert ThumbnailCache(str(tmp_path)).get("a") is None
+
+def test_get_corrupt_entry(tmp_path):
+    cache = ThumbnailCache(str(tmp_path))
+    cache.put("a", {"rgb": np.ones((64, 64, 3), dtype=np.uint8)}, {})
+    with open(tmp_path / "a" / "rgb.npy", "r+b") as fp:
+        fp.truncate(200)
+
+    assert cache.get("a") is None
+    assert not os.path.exists(tmp_path / "a")
+
+def test_evict_least_recently_used(tmp_path):
+    arr = np.zeros(1000, dtype=np.uint8)
+    cache = ThumbnailCache(str(tmp_path), max_bytes=2500)
+
+    cache.put("a", {"arr": arr}, {})
+    cache.put("b", {"arr": arr}, {})
+    os.utime(tmp_path / "a", (0, 0))
+    os.utime(tmp_path / "b", (1, 1))
+    cache.get("a")
+    cache.put("c", {"arr": arr}, {})
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
@@ -0,0 +1,161 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from luna_pathology.common.tile_store import *
+
+legacy_store_dir = "tests/luna_pathology/cli/testdata/data/test/slides/123/test_generate_tile_ov_labels/TileImages/data"
+
+
+def make_tiles(n_tiles, tile_size=4):
+    return np.arange(n_tiles * tile_size * tile_size * 3, dtype=np.uint64).astype(np.uint8) \
+        .reshape(n_tiles, tile_size, tile_size, 3)
+
+def write_store(store_dir, tiles, encoding="raw"):
+    writer = TileStoreWriter(str(store_dir), len(tiles), tiles.shape[1], encoding=encoding)
+    df_tile_images = writer.write_tiles((tile.tobytes(), "RGB", tile.shape[0]) for tile in tiles)
+    df = pd.DataFrame({"address": [f"x{i}_y0_z20" for i in range(len(tiles))],
+                       "otsu_score": np.linspace(0, 1, len(tiles))}).set_index("address")
+    writer.write_index(df.assign(**df_tile_images.set_index(df.index)))
+    return writer
+
+def test_write_tiles(tmp_path):
+    tiles = make_tiles(3)
+
+    writer = write_store(tmp_path, tiles)
+
+    arr = np.load(writer.data_path)
+    assert np.array_equal(tiles, arr)
+    df = pd.read_parquet(writer.index_path)
+    assert [writer.header_length + i * 48 for i in range(3)] == df["tile_image_offset"].tolist()
+    assert ["RGB"] * 3 == df["tile_image_mode"].tolist()
+
+def test_write_tiles_count_mismatch(tmp_path):
+    writer = TileStoreWriter(str(tmp_path), 2, 4)
+
+    with pytest.raises(ValueError):
+        writer.write_tiles(iter([(make_tiles(1)[0].tobytes(), "RGB", 4)]))
+
+@pytest.mark.parametrize("encoding", ["raw", "png"])
+def test_write_tiles_resume_from_checkpoint(tmp_path, encoding):
+    tiles = make_tiles(7)
+    os.makedirs(tmp_path / "expected")
+    expected = write_store(tmp_path / "expected", tiles, encoding)
+
+    # interrupted after 5 tiles, with a checkpoint after 4
+    def interrupted_tiles():
+        for tile in tiles[:5]:
+            yield tile.tobytes(), "RGB", 4
+        raise KeyboardInterrupt
+
+    writer = TileStoreWriter(str(tmp_path), len(tiles), 4, encoding=encoding, checkpoint_interval=2, fingerprint="a")
+    with pytest.raises(KeyboardInterrupt):
+        writer.write_tiles(interrupted_tiles())
+    assert os.path.exists(writer.checkpoint_path)
+
+    resumed = TileStoreWriter(str(tmp_path), len(tiles), 4, encoding=encoding, checkpoint_interval=2, fingerprint="a")
+    assert 4 == resumed.n_written
+    df_tile_images = resumed.write_tiles((tile.tobytes(), "RGB", 4) for tile in tiles[4:])
+    resumed.write_index(df_tile_images)
+
+    assert not os.path.exists(resumed.checkpoint_path)
+    reader = TileStoreReader(str(tmp_path))
+    assert np.array_equal(tiles, reader[:])
+    assert pd.read_parquet(expected.index_path)["tile_image_offset"].tolist() == df_tile_images["tile_image_offset"].tolist()
+
+def test_write_tiles_checkpoint_fingerprint_mismatch(tmp_path):
+    tiles = make_tiles(4)
+    writer = TileStoreWriter(str(tmp_path), len(tiles), 4, checkpoint_interval=2, fingerprint="a")
+    for tile in tiles[:3]:
+        writer.write(tile.tobytes(), "RGB")
+    writer.checkpoint()
+
+    assert 3 == TileStoreWriter(str(tmp_path), len(tiles), 4, checkpoint_interval=2, fingerprint="a").n_written
+    assert 0 == TileStoreWriter(str(tmp_path), len(tiles), 4, checkpoint_interval=2, fingerprint="b").n_written
+
+def test_write_wrong_tile_size(tmp_path):
+    writer = TileStoreWriter(str(tmp_path), 1, 4)
+
+    with pytest.raises(ValueError):
+        writer.write(b"0" * 12, "RGB")
+
+def test_reader(tmp_path):
+    tiles = make_tiles(5)
+    write_store(tmp_path, tiles)
+
+    reader = TileStoreReader(str(tmp_path))
+
+    assert 5 == len(reader)
+    assert (5, 4, 4, 3) == reader.shape
+    assert np.array_equal(tiles[1:4], reader[1:4])
+    assert np.array_equal(tiles[2], reader.get_tile("x2_y0_z20"))
+    assert isinstance(reader.tiles, np.memmap)
+    assert np.shares_memory(reader[1:4], reader.tiles)
+    assert tiles[3].tobytes() == reader.get_image(3).tobytes()
+    assert ["otsu_score", "tile_image_offset", "tile_image_length", "tile_image_size_xy", "tile_image_mode", "x", "y"] \
+        == list(reader.index.columns)
+    assert [0, 1, 2, 3, 4] == reader.index["x"].tolist()
+
+def test_reader_empty_store(tmp_path):
+    write_store(tmp_path, make_tiles(0))
+
+    reader = TileStoreReader(str(tmp_path))
+
+    assert 0 == len(reader)
+    assert (0, 4, 4, 3) == reader[:].shape
+
+@pytest.mark.parametrize("encoding", ["webp", "png"])
+def test_reader_lossless_encoding(tmp_path, encoding):
+    tiles = make_tiles(5, tile_size=16)
+    writer = write_store(tmp_path, tiles, encoding=encoding)
+
+    reader = TileStoreReader(str(tmp_path), num_threads=2)
+
+    assert writer.data_path.endswith(f"tiles.slice.{encoding}")
+    assert encoding == reader.encoding
+    assert np.array_equal(tiles, reader.read_tiles(range(5)))
+    assert np.array_equal(tiles[1:4], reader[1:4])
+    assert np.array_equal(tiles[2], reader.get_tile("x2_y0_z20"))
+    assert tiles[3].tobytes() == reader.get_image(3).tobytes()
+    with pytest.raises(ValueError):
+        reader.tiles
+
+def test_reader_jpeg_encoding(tmp_path):
+    tiles = np.full((3, 16, 16, 3), 128, dtype=np.uint8)
+    write_store(tmp_path, tiles, encoding="jpeg")
+
+    reader = TileStoreReader(str(tmp_path))
+    df = reader.index
+
+    assert (df["tile_image_offset"] + df["tile_image_length"]).iloc[-1] == os.path.getsize(reader.data_path)
+    assert np.abs(tiles.astype(int) - reader.read_tiles([0, 1, 2])).max() <= 2
+
+def test_write_unknown_encoding(tmp_path):
+    with pytest.raises(ValueError):
+        TileStoreWriter(str(tmp_path), 1, 4, encoding="gif")
+
+def test_reader_legacy(tmp_path):
+    tiles = make_tiles(3)
+    (tmp_path / "tiles.slice.pil").write_bytes(tiles.tobytes())
+    pd.DataFrame({"address": ["x1_y1_z20", "x1_y2_z20", "x1_y3_z20"],
+                  "tile_image_offset": [0.0, 48.0, 96.0],
+                  "tile_image_length": [48.0] * 3,
+                  "tile_image_size_xy": [4.0] * 3,
+                  "tile_image_mode": ["RGB"] * 3}).to_csv(tmp_path / "address.slice.csv", index=False)
+
+    reader = TileStoreReader(str(tmp_path))
+
+    assert np.array_equal(tiles, reader[:])
+    assert np.array_equal(tiles[1], reader.get_tile("x1_y2_z20"))
+
+def test_reader_legacy_index_only():
+    reader = TileStoreReader(legacy_store_dir)
+
+    assert 352 == len(reader)
+    assert (352, 128, 128, 3) == reader.shape
+    assert str(reader.data_path).endswith("tiles.slice.pil")
+
+def test_reader_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        TileStoreReader(str(tmp_path))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from luna_pathology.common.tile_table import *
+
+
+@pytest.fixture
+def df_tiles():
+    return pd.DataFrame({"address": ["x1_y2_z20", "x3_y1_z20", "x0_y0_z20"],
+                         "coordinates": [(1, 2), (3, 1), (0, 0)],
+                         "otsu_score": [0.25, 1.0, 0.5],
+                         "tile_image_length": [10, 20, 30],
+                         "regional_label": ["tumor", None, "stroma"]}).set_index("address")
+
+
+def test_get_tile_grid_coordinates():
+    tile_x, tile_y = get_tile_grid_coordinates(["x1_y2_z20", "x30_y4_z10"])
+
+    assert [1, 30] == tile_x.tolist()
+    assert [2, 4] == tile_y.tolist()
+
+def test_get_tile_grid_coordinates_invalid_address():
+    with pytest.raises(ValueError):
+        get_tile_grid_coordinates(["(1, 2)"])
+
+def test_to_tile_table(df_tiles):
+    df = to_tile_table(df_tiles)
+
+    assert "coordinates" not in df
+    assert [1, 3, 0] == df["x"].tolist() and [2, 1, 0] == df["y"].tolist()
+    assert np.int32 == df["x"].dtype and np.int32 == df["y"].dtype
+    assert np.float32 == df["otsu_score"].dtype
+    assert np.int64 == df["tile_image_length"].dtype
+    assert isinstance(df["regional_label"].dtype, pd.CategoricalDtype)
+    assert ["stroma", "tumor"] == df["regional_label"].cat.categories.tolist()
+
+def test_to_tile_table_keeps_non_score_columns(df_tiles):
+    df = to_tile_table(df_tiles.assign(area=[0.1, 0.2, 0.3]), score_dtype=None)
+
+    assert np.float64 == df["area"].dtype and np.float64 == df["otsu_score"].dtype
+
+def test_read_tile_table_legacy_csv_tile_image_offsets(tmp_path, df_tiles):
+    # legacy csv indexes save offsets as floats, not exact as float32 over 2^24
+    offsets = (1 << 30) + np.arange(3) * 12289
+    df_tiles.assign(tile_image_offset=offsets.astype(float)).to_csv(tmp_path / "tiles.csv")
+
+    df = read_tile_table(str(tmp_path / "tiles.csv"))
+    assert np.int64 == df["tile_image_offset"].dtype
+    assert offsets.tolist() == df["tile_image_offset"].tolist()
+
+def test_write_read_tile_table(tmp_path, df_tiles):
+    path = str(tmp_path / "tiles.parquet")
+    write_tile_table(df_tiles, path)
+
+    assert pa.types.is_dictionary(pq.read_schema(path).field("regional_label").type)
+    df = read_tile_table(path)
+    assert df.equals(to_tile_table(df_tiles))
+    assert "address" == df.index.name
+
+def test_read_tile_table_legacy_csv(tmp_path, df_tiles):
+    df_tiles.to_csv(tmp_path / "tiles.csv")
+
+    df = read_tile_table(str(tmp_path / "tiles.csv"))
+    assert ["x1_y2_z20", "x3_y1_z20", "x0_y0_z20"] == df.index.tolist()
+    assert [1, 3, 0] == df["x"].tolist()
+    assert np.float32 == df["otsu_score"].dtype
+    assert "coordinates" not in df
+
+def test_read_tile_table_legacy_csv_row_index(tmp_path, df_tiles):
+    # e.g. inference results saved with a row number index
+    df_tiles.reset_index().to_csv(tmp_path / "tiles.csv")
+
+    df = read_tile_table(str(tmp_path / "tiles.csv"))
+    assert ["x1_y2_z20", "x3_y1_z20", "x0_y0_z20"] == df.index.tolist()
+    assert not [column for column in df if column.startswith("Unnamed:")]
+
+def test_find_tile_table(tmp_path, df_tiles):
+    with pytest.raises(FileNotFoundError):
+        find_tile_table(str(tmp_path), "tiles")
+
+    df_tiles.to_csv(tmp_path / "tiles.csv")
+    assert str(tmp_path / "tiles.csv") == find_tile_table(str(tmp_path), "tiles")
+
+    write_tile_table(df_tiles, str(tmp_path / "tiles.parquet"))
+    assert str(tmp_path / "tiles.parquet") == find_tile_table(str(tmp_path), "tiles")
+
+def test_to_tile_table_without_addresses(df_tiles):
+    df = to_tile_table(df_tiles.reset_index(drop=True))
+
+    assert "x" not in df and "y" not in df
+    assert np.float32 == df["otsu_score"].dtype